@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+'''the AOI metadata every stage needs from the shapefile (the crs to project to, the bounds to crop to and the polygon
+to search ASF with), read once and cached by the shapefile's fingerprint'''
+
+import os
+import json
+import hashlib
+import checkpoint
+import get_crs
+
+CACHE_DIR='/products/.aoi' # set before the first get_metadata to cache elsewhere
+SIDECARS=('.shp', '.shx', '.dbf', '.prj', '.cpg') # the files of a shapefile, any of which changes its contents
+
+def fingerprint(shapefile):
+    '''returns the fingerprint of the shapefile and its sidecar files'''
+    stem, ext = os.path.splitext(shapefile)
+    paths = [stem + e for e in SIDECARS if os.path.exists(stem + e)] if ext.lower() == '.shp' else [shapefile]
+    return hashlib.sha1(json.dumps([os.path.abspath(shapefile)] + [checkpoint.file_fingerprint(p) for p in paths]).encode()).hexdigest()
+
+def compute(shapefile):
+    '''reads the shapefile once for all of its metadata'''
+    import geopandas # only needed on a cache miss
+    data = geopandas.read_file(shapefile)
+    lat = data.exterior.geometry.centroid.to_crs(epsg=4326).y.iloc[0]
+    minx, miny, maxx, maxy = [float(b) for b in data.total_bounds] # what ogrinfo reports as the layer extent
+    coords = json.loads(data.to_crs(epsg=4326).exterior.to_json()).get('features', {})[0].get('geometry').get('coordinates') # epsg used by ASF
+    return {'crs': get_crs.crs_for_latitude(lat), 'bounds': [minx, miny, maxx, maxy],
+            'polygon': 'polygon(({}))'.format(','.join(['{} {}'.format(a, b) for a, b in coords]))}
+
+def get_metadata(shapefile, cache_dir=None):
+    '''returns {'crs', 'bounds': [minx, miny, maxx, maxy] in the shapefile's crs, 'polygon': wkt in epsg 4326}'''
+    if not os.path.exists(shapefile):
+        raise Exception('shapefile path does not exist: {}'.format(shapefile))
+    cache_dir = cache_dir or CACHE_DIR
+    path = os.path.join(cache_dir, '{}.json'.format(fingerprint(shapefile)))
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    meta = compute(shapefile)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, path)
+    return meta
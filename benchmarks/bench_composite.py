@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+'''compares composite.compositor against the numpy.ma compositing combine_files_and_save did before it,
+for time and peak memory per date (the frame saving is left out of both)'''
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import composite
+
+
+def masked_combine(scenes, base, pmin):
+    '''the compositing combine_files_and_save did before composite.py, scenes are the raw (gdal read) arrays'''
+    arrays = []
+    for scene in scenes:
+        arrays.append(np.ma.masked_less_equal(np.ma.array(scene.copy()), 0)) # copy, as load_gdal read a new array
+    stack = np.ma.dstack(arrays)
+    combined = np.ma.mean(stack, axis=2)
+    base = np.ma.array(np.ma.filled(combined, fill_value=base))
+    return (base - pmin) + pmin
+
+def kernel_combine(scenes, comp):
+    for scene in scenes:
+        np.copyto(comp.scratch, scene) # as read_gdal reads into the scratch buffer
+        comp.add(comp.scratch)
+    return comp.composite()
+
+def synthetic_dates(shape, dates, per_date, nodata=0.3, seed=0):
+    '''per date lists of float32 scenes, with nodata pixels set to 0'''
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(dates):
+        scenes = []
+        for _ in range(per_date):
+            scene = rng.gamma(4., 0.1, size=shape).astype(np.float32)
+            scene[rng.random(shape) < nodata] = 0.
+            scenes.append(scene)
+        out.append(scenes)
+    return out
+
+def measure(func, dates):
+    '''returns (seconds per date, peak traced bytes above the start, the last result)'''
+    tracemalloc.start()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = None
+    for scenes in dates:
+        result = func(scenes)
+    elapsed = (time.perf_counter() - start) / len(dates)
+    peak = tracemalloc.get_traced_memory()[1] - start_bytes
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+def main(rows, cols, dates, per_date):
+    shape = (rows, cols)
+    pmin = 0.
+    data = synthetic_dates(shape, dates, per_date)
+    state = {'base': np.full(shape, pmin, dtype=np.float32)}
+    def old(scenes):
+        state['base'] = masked_combine(scenes, state['base'], pmin)
+        return state['base']
+    comp = composite.compositor(shape, fill=pmin)
+    comp.get_base()
+    t_old, m_old, ref = measure(old, data)
+    t_new, m_new, out = measure(lambda scenes: kernel_combine(scenes, comp), data)
+    diff = np.abs(np.ma.getdata(ref) - out).max()
+    mb = 1024. * 1024.
+    frame = rows * cols * 4 / mb
+    print('{} dates of {} {}x{} scenes ({:.1f}MB per float32 frame)'.format(dates, per_date, rows, cols, frame))
+    print(' numpy.ma:   {:.3f}s/date, peak {:.1f}MB ({:.1f} frames)'.format(t_old, m_old / mb, m_old / mb / frame))
+    print(' compositor: {:.3f}s/date, peak {:.1f}MB ({:.1f} frames), {:.1f}x faster'.format(t_new, m_new / mb, m_new / mb / frame, t_old / t_new))
+    print(' max difference: {:.2e}'.format(diff))
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Benchmark the compositing kernel against numpy.ma")
+    parse.add_argument("--rows", required=False, default=2000, type=int, help="rows of the synthetic scenes")
+    parse.add_argument("--cols", required=False, default=3000, type=int, help="columns of the synthetic scenes")
+    parse.add_argument("--dates", required=False, default=5, type=int, help="dates to composite")
+    parse.add_argument("--per-date", dest="per_date", required=False, default=3, type=int, help="scenes per date")
+    return parse
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    main(args.rows, args.cols, args.dates, args.per_date)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+'''compares render.renderer against the pyplot frame saving it replaced, for speed and pixel differences'''
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+from datetime import datetime
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import render
+
+
+def pyplot_save(arr, filename, clim, date=None, overview=None):
+    '''the frame saving mean_and_match.save did before render.py'''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    y,x=arr.shape
+    dpi=300
+    figsize=(x/dpi, y/dpi)
+    fig, ax = plt.subplots(figsize=figsize)
+    cmap = matplotlib.colormaps['gist_gray']
+    size = fig.get_size_inches()*fig.dpi # size of figure
+    extent = 0, size[0], 0, size[1]
+    ax.imshow(arr, cmap=cmap, clim=clim, extent=extent)
+    if date:
+        plt.text(10,10, date.strftime('%Y-%m-%d'), color='white', backgroundcolor='black', font='serif', fontweight='bold', fontsize='medium')
+    if not overview is None:
+        plt.imshow(overview, interpolation='nearest', extent=extent)
+    ax.axis('off')
+    fig.savefig(filename, dpi=dpi, bbox_inches='tight', pad_inches=0.0, transparent=True, format='png', facecolor=(0.,0.,0.))
+    plt.close(fig)
+
+def synthetic_scene(shape, seed=0):
+    '''gamma0-like backscatter: smooth structure with multiplicative speckle'''
+    rng = np.random.default_rng(seed)
+    coarse = rng.random((shape[0] // 50 + 2, shape[1] // 50 + 2))
+    structure = np.asarray(Image.fromarray(coarse.astype(np.float32), 'F').resize((shape[1], shape[0]), Image.BICUBIC))
+    return np.clip(structure, 0.05, None) * rng.gamma(4., 0.25, size=shape) * 0.6
+
+def main(rows, cols, frames):
+    arr = synthetic_scene((rows, cols))
+    clim = (0, 0.75)
+    date = datetime(2017, 5, 13)
+    with tempfile.TemporaryDirectory() as tmp:
+        ref_path = os.path.join(tmp, 'ref.png')
+        out_path = os.path.join(tmp, 'out.png')
+        start = time.perf_counter()
+        for _ in range(frames):
+            pyplot_save(arr, ref_path, clim, date=date)
+        t_ref = (time.perf_counter() - start) / frames
+        start = time.perf_counter()
+        r = render.renderer(arr.shape, clim)
+        t_setup = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(frames):
+            r.save(arr, out_path, date=date)
+        t_fast = (time.perf_counter() - start) / frames
+        ref = np.asarray(Image.open(ref_path))[:, :, :3].astype(int)
+        out = np.asarray(Image.open(out_path).convert('RGB')).astype(int)
+    diff = np.abs(ref - out)
+    print('frame {}x{} -> {}x{}'.format(rows, cols, out.shape[0], out.shape[1]))
+    print(' pyplot:   {:.3f}s/frame'.format(t_ref))
+    print(' renderer: {:.3f}s/frame (+{:.3f}s setup), {:.1f}x faster'.format(t_fast, t_setup, t_ref / t_fast))
+    print(' difference: mean {:.2f}, 99th percentile {:.0f}, max {:.0f} (of 255)'.format(diff.mean(), np.percentile(diff, 99), diff.max()))
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Benchmark the frame renderer against pyplot")
+    parse.add_argument("--rows", required=False, default=2000, type=int, help="rows of the synthetic frame")
+    parse.add_argument("--cols", required=False, default=3000, type=int, help="columns of the synthetic frame")
+    parse.add_argument("--frames", required=False, default=3, type=int, help="frames to time")
+    return parse
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    main(args.rows, args.cols, args.frames)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+'''runs the retrieve_data polling loop against the fake HyP3 API and reports API calls and download throughput'''
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import track
+import retrieve_data
+import scheduler
+import granules
+import fake_hyp3
+from bench_track import build_track
+
+
+def run(n, workers, delay, product_size, bandwidth=fake_hyp3.BANDWIDTH):
+    '''retrieves n granules with the given number of download workers. returns (seconds, api calls, bytes)'''
+    server, svc = fake_hyp3.serve(delay=delay, product_size=product_size, bandwidth=bandwidth)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            t = build_track(tmp, n, submitted=0)
+            store = granules.store(os.path.join(tmp, 'store'))
+            hyp3 = retrieve_data.get_client(svc.url, token='fake')
+            sched = scheduler.scheduler(min_interval=delay / 4., max_interval=delay * 2., start_interval=delay)
+            start = time.perf_counter()
+            while not t.is_done():
+                store.link(t.output_dir)
+                t.refresh()
+                status = retrieve_data.sync_jobs(hyp3, names=retrieve_data.get_job_names(t))
+                sched.observe(status)
+                if retrieve_data.check_and_retrieve(t, status, store, workers=workers, callback=sched.retrieved):
+                    t.refresh()
+                retrieve_data.resubmit_failed(t, status, store)
+                retrieve_data.submit(t, hyp3, store)
+                if not t.is_done():
+                    sched.wait(status, track.ALLOWABLE - len(t.granules.submitted), t.granules.count_unsubmitted())
+            sched.print_latency()
+            elapsed = time.perf_counter() - start
+            nbytes = sum(len(v) for v in svc.products.values())
+    finally:
+        server.shutdown()
+    return elapsed, svc.requests, nbytes
+
+def main(n, workers, delay, product_size, bandwidth):
+    print('{:>8} {:>10} {:>10} {:>12}'.format('workers', 'time (s)', 'api calls', 'MB/s'))
+    for w in workers:
+        elapsed, calls, nbytes = run(n, w, delay, product_size, bandwidth)
+        print('{:>8} {:>10.2f} {:>10} {:>12.1f}'.format(w, elapsed, calls, nbytes / elapsed / 1e6))
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Benchmark retrieve_data against a local fake HyP3 API")
+    parse.add_argument("--granules", required=False, default=track.ALLOWABLE, type=int, help="number of granules to retrieve")
+    parse.add_argument("--workers", required=False, default='1,4', help="comma separated download worker counts")
+    parse.add_argument("--delay", required=False, default=0.5, type=float, help="seconds a fake job stays PENDING and RUNNING")
+    parse.add_argument("--product-size", required=False, default=fake_hyp3.PRODUCT_SIZE, type=int, help="bytes per fake raster")
+    parse.add_argument("--bandwidth", required=False, default=fake_hyp3.BANDWIDTH, type=int, help="bytes/s per download connection")
+    return parse
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    main(args.granules, [int(w) for w in args.workers.split(',')], args.delay, args.product_size, args.bandwidth)
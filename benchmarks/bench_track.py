@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+'''benchmarks track.refresh and track.submit_these against synthetic ASF query results'''
+
+import os
+import sys
+import time
+import random
+import string
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import track
+
+
+def synthetic_names(n, seed=0):
+    '''returns n unique synthetic S1 SLC granule names'''
+    rand = random.Random(seed)
+    chars = string.ascii_uppercase + string.digits
+    names = []
+    gids = set()
+    while len(names) < n:
+        gid = ''.join(rand.choice(chars) for _ in range(4))
+        if gid in gids:
+            continue
+        gids.add(gid)
+        names.append('S1A_IW_SLC__1SSH_20170501T000000_20170501T000030_016000_01A000_{}'.format(gid))
+    return names
+
+def build_track(output_dir, n, submitted=track.ALLOWABLE // 2):
+    '''writes synthetic search results & submitted granules, returns a track that does not touch ASF'''
+    names = synthetic_names(n)
+    with open(os.path.join(output_dir, 'asf-results.txt'), 'w') as fout:
+        fout.write(''.join('{}\n'.format(name) for name in names))
+    t = track.track.__new__(track.track)
+    t.output_dir = output_dir
+    t.results_file = os.path.join(output_dir, 'asf-results.txt')
+    t.submitted_file = os.path.join(output_dir, 'submitted.pkl')
+    t.refresh()
+    # leave room under ALLOWABLE so submit_these has work to do
+    for name in names[:submitted]:
+        t.submit(name)
+    t.commit()
+    return t
+
+def timeit(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(sizes):
+    print('{:>10} {:>12} {:>16} {:>18} {:>14}'.format('granules', 'refresh (s)', 'submit_these (s)', 'unsubmitted (s)', 'us/granule'))
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            t = build_track(tmp, n)
+            t_refresh = timeit(t.refresh)
+            t_submit = timeit(t.submit_these)
+            t_unsub = timeit(t.get_unsubmitted)
+            print('{:>10} {:>12.3f} {:>16.5f} {:>18.4f} {:>14.2f}'.format(n, t_refresh, t_submit, t_unsub, t_refresh / n * 1e6))
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Benchmark track.refresh and track.submit_these")
+    parse.add_argument("--sizes", required=False, default='1000,10000,100000', help="comma separated granule counts")
+    return parse
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    main([int(s) for s in args.sizes.split(',')])
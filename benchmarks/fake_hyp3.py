@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+'''local stand-in for the HyP3 API and the ASF search, so searching, job submission, polling and downloads can be
+exercised offline'''
+
+import io
+import re
+import csv
+import json
+import time
+import uuid
+import random
+import zipfile
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PAGE_SIZE=100 # jobs per /jobs page, the real API paginates with 'next'
+DELAY=2.0 # seconds a job spends PENDING and then RUNNING
+PRODUCT_SIZE=1024*1024 # bytes of filler in each product raster
+BANDWIDTH=50*1024*1024 # bytes/s per download connection, emulates the real per-connection throughput
+CHUNK=256*1024
+SEARCH_PATH='/services/search/param' # point track.SEARCH_URL at svc.url + SEARCH_PATH
+DATE_REGEX=r'_([0-9]{8}T[0-9]{6})_'
+
+def isoformat(stamp):
+    return datetime.fromtimestamp(stamp, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+def build_product(product_name, granule, size=PRODUCT_SIZE):
+    '''returns the bytes of a deflated zip of an RTC product directory with a log file and filler rasters,
+    incompressible like the (compressed) rasters of the real products'''
+    rand = random.Random(product_name)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as z:
+        z.writestr('{0}/{0}.log'.format(product_name), 'SAFE directory          : {}.SAFE\n'.format(granule))
+        for layer in ('HH', 'HV', 'area', 'dem', 'inc_map', 'ls_map'):
+            z.writestr('{0}/{0}_{1}.tif'.format(product_name, layer), rand.randbytes(size))
+    return buf.getvalue()
+
+def parse_range(header, size):
+    '''returns the (start, end) exclusive byte range of a 'bytes=a-b', 'bytes=a-' or 'bytes=-n' header, None if absent'''
+    match = re.match(r'^bytes=(\d*)-(\d*)$', header or '')
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == '':
+        return max(0, size - int(last)), size
+    return int(first), min(size, int(last) + 1) if last else size
+
+class service:
+    '''in-memory job table. jobs move PENDING -> RUNNING -> SUCCEEDED based on their age'''
+    def __init__(self, delay=DELAY, product_size=PRODUCT_SIZE, bandwidth=BANDWIDTH, catalog=None):
+        self.delay = delay
+        self.catalog = list(catalog or []) # granule names the search returns
+        self.product_size = product_size
+        self.bandwidth = bandwidth
+        self.jobs = {} # job_id: job dict
+        self.products = {} # filename: bytes
+        self.lock = threading.Lock()
+        self.requests = 0 # number of API calls served
+        self.ranged_bytes = 0 # bytes served to range requests
+        self.url = None
+
+    def status(self, job):
+        age = time.time() - job['_submitted']
+        if age < self.delay:
+            return 'PENDING'
+        if age < 2 * self.delay:
+            return 'RUNNING'
+        return 'SUCCEEDED'
+
+    def submit(self, prepared):
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        granule = prepared.get('job_parameters', {}).get('granules', [''])[0]
+        job = {'job_id': job_id, 'job_type': prepared.get('job_type', 'RTC_GAMMA'), 'name': prepared.get('name'),
+               'job_parameters': prepared.get('job_parameters', {}), 'user_id': 'fake', 'request_time': isoformat(now),
+               '_submitted': now, '_granule': granule}
+        with self.lock:
+            self.jobs[job_id] = job
+        return self.render(job)
+
+    def render(self, job):
+        '''returns the public representation of the job'''
+        out = {k: v for k, v in job.items() if not k.startswith('_')}
+        out['status_code'] = self.status(job)
+        if out['status_code'] == 'SUCCEEDED':
+            product_name = 'S1A_IW_{}_DHP_RTC30_G_gpuned_{}'.format(
+                datetime.fromtimestamp(job['_submitted'], tz=timezone.utc).strftime('%Y%m%dT%H%M%S'), job['job_id'][:4].upper())
+            filename = '{}.zip'.format(product_name)
+            with self.lock:
+                if filename not in self.products:
+                    self.products[filename] = build_product(product_name, job['_granule'], self.product_size)
+            out['files'] = [{'url': '{}/files/{}'.format(self.url, filename), 'filename': filename, 'size': len(self.products[filename])}]
+            out['expiration_time'] = isoformat(job['_submitted'] + timedelta(days=14).total_seconds())
+        return out
+
+    def find(self, params):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        out = [self.render(job) for job in jobs]
+        if 'name' in params:
+            out = [job for job in out if job['name'] == params['name']]
+        if 'status_code' in params:
+            out = [job for job in out if job['status_code'] == params['status_code']]
+        return out
+
+    def search(self, params):
+        '''returns the catalog names acquired between the start and end params (ASF's date format), in catalog order'''
+        out = []
+        for name in self.catalog:
+            match = re.search(DATE_REGEX, name)
+            acquired = datetime.strptime(match.group(1), '%Y%m%dT%H%M%S').strftime('%Y-%m-%dT%H:%M:%S') if match else None
+            if acquired is not None and (('start' in params and acquired < params['start']) or ('end' in params and acquired > params['end'])):
+                continue
+            out.append(name)
+        return out
+
+def handler_for(svc):
+    class handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, obj, code=200):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            svc.requests += 1
+            parsed = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+            if parsed.path == '/jobs':
+                jobs = svc.find(params)
+                start = int(params.pop('start_token', 0))
+                page = {'jobs': jobs[start:start + PAGE_SIZE]}
+                if start + PAGE_SIZE < len(jobs):
+                    params['start_token'] = start + PAGE_SIZE
+                    page['next'] = '{}/jobs?{}'.format(svc.url, '&'.join('{}={}'.format(k, v) for k, v in params.items()))
+                return self.send_json(page)
+            if parsed.path.startswith('/jobs/'):
+                job = svc.jobs.get(parsed.path.split('/')[-1])
+                if job is None:
+                    return self.send_json({'detail': 'not found'}, code=404)
+                return self.send_json(svc.render(job))
+            if parsed.path == SEARCH_PATH:
+                # the csv output of the real search, with only the columns track reads
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                writer.writerow(['Granule Name', 'Acquisition Date'])
+                for name in svc.search(params):
+                    match = re.search(DATE_REGEX, name)
+                    writer.writerow([name, match.group(1) if match else ''])
+                body = buf.getvalue().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/csv')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if parsed.path == '/user':
+                return self.send_json({'user_id': 'fake', 'remaining_credits': 10000})
+            if parsed.path.startswith('/files/'):
+                data = svc.products.get(parsed.path.split('/')[-1])
+                if data is None:
+                    return self.send_json({'detail': 'not found'}, code=404)
+                start, end = 0, len(data)
+                byte_range = parse_range(self.headers.get('Range'), len(data))
+                if byte_range is not None:
+                    start, end = byte_range
+                    if start >= end:
+                        return self.send_json({'detail': 'range not satisfiable'}, code=416)
+                    svc.ranged_bytes += end - start
+                self.send_response(200 if byte_range is None else 206)
+                self.send_header('Content-Type', 'application/zip')
+                self.send_header('Accept-Ranges', 'bytes')
+                if byte_range is not None:
+                    self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end - 1, len(data)))
+                self.send_header('Content-Length', str(end - start))
+                self.end_headers()
+                try:
+                    for i in range(start, end, CHUNK):
+                        self.wfile.write(data[i:min(end, i + CHUNK)])
+                        if svc.bandwidth:
+                            time.sleep(min(CHUNK, end - i) / float(svc.bandwidth))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # the client stopped reading, e.g. after probing the size
+                return
+            self.send_json({'detail': 'not found'}, code=404)
+
+        def do_POST(self):
+            svc.requests += 1
+            if urlparse(self.path).path != '/jobs':
+                return self.send_json({'detail': 'not found'}, code=404)
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            return self.send_json({'jobs': [svc.submit(job) for job in payload.get('jobs', [])]})
+    return handler
+
+def serve(port=0, delay=DELAY, product_size=PRODUCT_SIZE, bandwidth=BANDWIDTH, catalog=None):
+    '''starts the service on a background thread, returns (server, service). server.shutdown() stops it'''
+    svc = service(delay=delay, product_size=product_size, bandwidth=bandwidth, catalog=catalog)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler_for(svc))
+    svc.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, svc
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Run a local stand-in for the HyP3 API")
+    parse.add_argument("--port", required=False, default=8080, type=int, help="port to listen on")
+    parse.add_argument("--delay", required=False, default=DELAY, type=float, help="seconds a job spends in each of PENDING and RUNNING")
+    parse.add_argument("--bandwidth", required=False, default=BANDWIDTH, type=int, help="bytes/s per download connection (0 for unlimited)")
+    parse.add_argument("--catalog", required=False, default=None, help="file of granule names (one per line) for the search to return")
+    return parse
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    catalog = None
+    if args.catalog:
+        with open(args.catalog) as f:
+            catalog = [line.strip() for line in f if line.strip()]
+    server, svc = serve(port=args.port, delay=args.delay, bandwidth=args.bandwidth, catalog=catalog)
+    print('serving fake HyP3 API at {}, ASF search at {}{}'.format(svc.url, svc.url, SEARCH_PATH))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+'''runs every stage after retrieve_data on a synthetic stack (synthetic.py), searching the stand-in ASF service
+(fake_hyp3.py), and reports the throughput and peak memory of each. the results can be saved as a baseline,
+and later runs compared against it to catch regressions'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+
+os.environ['METRICS_PATH'] = '' # the stages' own records default to /products, set before metrics is imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+import track
+import move
+import warp
+import composite
+import render
+import mean_and_match
+import generate_timelapse
+import fake_hyp3
+import synthetic
+import aoi
+
+CLIM=(0, 0.75) # the manual bounds of mean_and_match
+REPEAT=5 # warm track.refresh calls
+TOLERANCE=0.2 # fraction slower (or larger) than the baseline that is reported as a regression
+COMPARED=('seconds', 'peak_rss')
+MB=1024.*1024.
+
+def children_peak_rss():
+    '''the peak rss (bytes) of the largest child process waited for so far, e.g. of a process pool'''
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+class stage:
+    '''times a block and records its peak rss in results[name], including any child process that peaked higher during
+    it. the items and bytes processed are given, or set on the stage inside the block'''
+    def __init__(self, results, name, items=0, nbytes=0):
+        self.results = results
+        self.name = name
+        self.fields = {'items': items, 'bytes': nbytes}
+
+    def __setitem__(self, key, value):
+        self.fields[key] = value
+
+    def __enter__(self):
+        print('{}...'.format(self.name))
+        self.children = children_peak_rss()
+        self.measure = metrics.measure('benchmark', self.name).__enter__() # tracks the peak rss through nested measures
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.measure.__exit__(exc_type, exc, tb)
+        if exc_type is not None:
+            return False
+        children = children_peak_rss()
+        peak = max(self.measure.peak, children if children > self.children else 0)
+        items, nbytes = self.fields['items'], self.fields['bytes']
+        self.results[self.name] = {'seconds': elapsed, 'items': items, 'bytes': nbytes, 'peak_rss': peak,
+                                   'items_per_s': items / elapsed if elapsed > 0 else 0.,
+                                   'mb_per_s': nbytes / MB / elapsed if elapsed > 0 else 0.}
+        return False
+
+def file_bytes(paths):
+    return sum(os.path.getsize(p) for p in paths)
+
+def run(folder, rows, cols, dates, per_date, workers, repeat=REPEAT):
+    '''generates the stack in folder and benchmarks each stage on it in pipeline order, returns {stage: result}'''
+    results = {}
+    start = time.perf_counter()
+    names, shapefile = synthetic.make_stack(folder, rows, cols, dates, per_date)
+    print('generated {} {}x{} scenes in {:.1f}s'.format(len(names), rows, cols, time.perf_counter() - start))
+    rtc, corrected, warped, matched = [os.path.join(folder, d) for d in ('RTC', 'corrected', 'warped', 'matched')]
+    aoi.CACHE_DIR = os.path.join(folder, '.aoi')
+    scene_bytes = rows * cols * 4
+
+    server, svc = fake_hyp3.serve(catalog=names)
+    track.SEARCH_URL = svc.url + fake_hyp3.SEARCH_PATH
+    try:
+        # the search and the first refresh, which parses every product's log
+        with stage(results, 'track.search', items=len(names)):
+            t = track.track(shapefile, output_dir=rtc)
+        if len(t.granules.local) != len(names):
+            raise Exception('track found {} of the {} synthetic products'.format(len(t.granules.local), len(names)))
+        with stage(results, 'track.refresh', items=len(names) * repeat):
+            for _ in range(repeat):
+                t.refresh()
+    finally:
+        server.shutdown()
+
+    with stage(results, 'move.copy_tiffs') as s:
+        g = move.group(inpath=rtc, outpath=corrected)
+        vrts = g.copy_tiffs(workers=workers, force=True)
+        s['items'] = len(vrts)
+        s['bytes'] = len(vrts) * scene_bytes
+
+    # the warped files are virtual, so this is the setup cost. the reprojection itself is paid reading them below
+    with stage(results, 'warp') as s:
+        outpaths = warp.main(shapefile=shapefile, resolution=synthetic.RESOLUTION, infolder=corrected, outfolder=warped, workers=workers, force=True)
+        s['items'] = len(outpaths)
+
+    files = mean_and_match.get_matching(warped)
+    fil_dict = mean_and_match.sort_into_dict(files)
+    frame_dates = sorted(fil_dict.keys())
+    shape = mean_and_match.get_shape(files[0])
+    with stage(results, 'combine_files_and_save', items=len(files), nbytes=len(files) * shape[0] * shape[1] * 4):
+        comp = composite.compositor(shape, fill=CLIM[0])
+        for date in frame_dates:
+            base = mean_and_match.combine_files_and_save(fil_dict[date], CLIM, date=date, compositor=comp, render_frame=False)
+
+    # every frame is rendered from the last base, the render time hardly depends on the values
+    mean_and_match.OUTFOLDER = matched
+    if not os.path.exists(matched):
+        os.makedirs(matched)
+    with stage(results, 'save', items=len(frame_dates)) as s:
+        pool = render.frame_pool(shape, workers=workers) if workers > 1 else None
+        try:
+            for date in frame_dates:
+                mean_and_match.save(base, mean_and_match.get_outpath(date), CLIM, date=date, pool=pool)
+        finally:
+            if pool is not None:
+                pool.close()
+        s['bytes'] = file_bytes([mean_and_match.get_outpath(date) for date in frame_dates])
+
+    if shutil.which('ffmpeg') is None:
+        print('ffmpeg not found, skipping the timelapse encode')
+    else:
+        with stage(results, 'timelapse') as s:
+            s['items'] = generate_timelapse.timelapse(outpath=os.path.join(folder, 'timelapse.mp4'), infolder=matched).build()
+            s['bytes'] = results['save']['bytes'] # the pngs decoded
+    return results
+
+def report(results, baseline=None, tolerance=TOLERANCE, out=sys.stdout):
+    '''prints each stage's results, and the ratios to the baseline's if given. returns the regressed stages'''
+    regressions = []
+    header = '{:<24} {:>7} {:>10} {:>10} {:>10} {:>9}'.format('stage', 'items', 'time (s)', 'items/s', 'MB/s', 'peak MB')
+    if baseline:
+        header += ' {:>10} {:>10}'.format('time x', 'peak x')
+    out.write(header + '\n')
+    for name, r in results.items():
+        line = '{:<24} {:>7} {:>10.3f} {:>10.1f} {:>10.1f} {:>9.0f}'.format(name, r['items'], r['seconds'], r['items_per_s'], r['mb_per_s'], r['peak_rss'] / MB)
+        base = (baseline or {}).get(name)
+        if base:
+            ratios = [r[key] / base[key] if base[key] else 1. for key in COMPARED]
+            line += ' {:>10.2f} {:>10.2f}'.format(*ratios)
+            if any(ratio > 1. + tolerance for ratio in ratios):
+                regressions.append(name)
+                line += '  REGRESSION'
+        out.write(line + '\n')
+    return regressions
+
+def load_baseline(path, params):
+    '''returns the baseline's {stage: result}, which must have been run with the same params'''
+    with open(path) as f:
+        saved = json.load(f)
+    if saved['params'] != params:
+        raise Exception('the baseline was run with {}, rerun with the same parameters to compare'.format(saved['params']))
+    return saved['results']
+
+def save_baseline(path, params, results):
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as f:
+        json.dump({'params': params, 'results': results}, f, indent=1)
+    os.replace(tmp, path)
+
+def main(rows, cols, dates, per_date, workers, repeat=REPEAT, baseline=None, save=None, tolerance=TOLERANCE, folder=None):
+    params = {'rows': rows, 'cols': cols, 'dates': dates, 'per_date': per_date, 'workers': workers, 'repeat': repeat}
+    previous = load_baseline(baseline, params) if baseline else None
+    if folder is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = run(tmp, rows, cols, dates, per_date, workers, repeat)
+    else:
+        results = run(folder, rows, cols, dates, per_date, workers, repeat)
+    regressions = report(results, previous, tolerance)
+    if save:
+        save_baseline(save, params, results)
+        print('saved the baseline to {}'.format(save))
+    if regressions:
+        print('{} regressed by more than {:.0f}%: {}'.format(len(regressions), tolerance * 100, ', '.join(regressions)))
+    return regressions
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Benchmark the pipeline stages on a synthetic stack against a stand-in ASF/HyP3 service")
+    parse.add_argument("--rows", required=False, default=synthetic.ROWS, type=int, help="rows of the synthetic scenes")
+    parse.add_argument("--cols", required=False, default=synthetic.COLS, type=int, help="columns of the synthetic scenes")
+    parse.add_argument("--dates", required=False, default=synthetic.DATES, type=int, help="acquisition dates")
+    parse.add_argument("--per-date", dest="per_date", required=False, default=synthetic.PER_DATE, type=int, help="scenes per date")
+    parse.add_argument("--workers", required=False, default=os.cpu_count(), type=int, help="workers of the move, warp and render pools")
+    parse.add_argument("--repeat", required=False, default=REPEAT, type=int, help="warm track.refresh calls")
+    parse.add_argument("--baseline", required=False, default=None, help="compare against the results saved to this file")
+    parse.add_argument("--save", required=False, default=None, help="save the results to this file as a baseline")
+    parse.add_argument("--tolerance", required=False, default=TOLERANCE, type=float, help="fraction slower or larger than the baseline reported as a regression")
+    parse.add_argument("--keep", required=False, default=None, help="generate into (and keep) this folder instead of a temporary one")
+    return parse
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    regressions = main(args.rows, args.cols, args.dates, args.per_date, args.workers, repeat=args.repeat,
+                       baseline=args.baseline, save=args.save, tolerance=args.tolerance, folder=args.keep)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+'''generates synthetic, georeferenced gamma0 stacks laid out like the retrieved RTC products (a directory per product
+with the HH GeoTIFF and the log naming its SAFE granule), along with a shapefile of the AOI, so every stage after
+retrieve_data can run offline'''
+
+import os
+import string
+import argparse
+import numpy as np
+from datetime import datetime, timedelta
+from PIL import Image
+from osgeo import gdal, ogr, osr
+
+gdal.UseExceptions()
+
+ROWS=2000
+COLS=3000
+DATES=10
+PER_DATE=2 # adjacent frames of one pass that both overlap the AOI
+START=datetime(2017, 5, 1)
+REVISIT=timedelta(days=6) # the S1 repeat cycle
+FRAME_TIME=timedelta(seconds=25) # between adjacent frames of a pass
+EPSG=3031 # the scenes sit over Thwaites, so get_crs picks the same projection and warp only crops
+ORIGIN=(-1600000., -300000.) # upper left corner
+RESOLUTION=30.
+LOOKS=4 # speckle of the gamma0, multiplicative gamma(LOOKS, 1/LOOKS) noise
+SHADOW=0.97 # terrain steeper than this quantile is in radar shadow/layover, nodata in every scene
+AOI_MARGIN=0.05 # fraction of the raster the AOI is inset by on each side
+GID_CHARS=string.ascii_uppercase + string.digits
+
+def get_gid(i):
+    '''the 4 character id ending each granule name, unique for i < 36**4'''
+    out = ''
+    for _ in range(4):
+        i, r = divmod(i, len(GID_CHARS))
+        out = GID_CHARS[r] + out
+    return out
+
+def granule_names(dates=DATES, per_date=PER_DATE, start=START):
+    '''returns [(date, SAFE granule name)], per_date consecutive frames on every revisit from start'''
+    out = []
+    for d in range(dates):
+        date = start + d * REVISIT
+        for f in range(per_date):
+            t0 = date + f * FRAME_TIME
+            t1 = t0 + FRAME_TIME + timedelta(seconds=2)
+            name = 'S1A_IW_SLC__1SSH_{}_{}_016000_01A000_{}'.format(t0.strftime('%Y%m%dT%H%M%S'), t1.strftime('%Y%m%dT%H%M%S'), get_gid(len(out)))
+            out.append((t0, name))
+    return out
+
+def smooth_field(shape, rng, cell=50):
+    '''low frequency structure in 0-1: random values every cell pixels, bicubic interpolated'''
+    coarse = rng.random((shape[0] // cell + 2, shape[1] // cell + 2)).astype(np.float32)
+    return np.asarray(Image.fromarray(coarse, 'F').resize((shape[1], shape[0]), Image.BICUBIC))
+
+def terrain(shape, rng):
+    '''returns (mean gamma0, shadow mask): the backscatter the scenes scatter around, and the pixels in radar shadow'''
+    relief = smooth_field(shape, rng, cell=100)
+    slope = np.hypot(*np.gradient(relief))
+    gamma0 = 0.02 + 0.3 * smooth_field(shape, rng, cell=50) + 0.3 * slope / slope.max()
+    return gamma0.astype(np.float32), slope > np.quantile(slope, SHADOW)
+
+def pass_geometry(cols, rng):
+    '''returns (skew, near, far) of a pass: the slant of its swath across the AOI and the columns of its edges on the
+    first row. the swath is wider than the AOI, but its edges often cut into it'''
+    skew = np.tan(np.radians(rng.uniform(8., 14.)))
+    near = rng.uniform(-0.3, 0.1) * cols
+    return skew, near, near + rng.uniform(1.0, 1.4) * cols
+
+def swath_mask(shape, geometry, frame=0, per_date=1):
+    '''returns the pixels a frame covers: between the swath edges of its pass, and along track in the frame's part of
+    the pass (overlapping the adjacent frames a little)'''
+    rows, cols = shape
+    skew, near, far = geometry
+    r, c = np.ogrid[:rows, :cols]
+    across = c + skew * r
+    along = r - skew * 0.3 * c
+    top = rows * (frame / per_date - 0.05)
+    bottom = rows * ((frame + 1) / per_date + 0.05)
+    return (across >= near) & (across < far) & (along >= top) & (along < bottom)
+
+def scene(gamma0, shadow, rng, geometry, frame=0, per_date=1):
+    '''a float32 gamma0 scene: the terrain with temporal change and speckle, 0 (nodata) outside the frame's swath and
+    in the radar shadow'''
+    change = 1. + 0.4 * (smooth_field(gamma0.shape, rng, cell=200) - 0.5)
+    speckle = rng.gamma(LOOKS, 1. / LOOKS, size=gamma0.shape).astype(np.float32)
+    out = gamma0 * change * speckle
+    out[~swath_mask(gamma0.shape, geometry, frame, per_date) | shadow] = 0.
+    return out.astype(np.float32)
+
+def get_srs(epsg=EPSG):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    return srs
+
+def write_geotiff(path, arr, origin=ORIGIN, resolution=RESOLUTION, epsg=EPSG):
+    '''writes a single band float32 GeoTIFF with nodata 0, tiled like the HyP3 products'''
+    ds = gdal.GetDriverByName('GTiff').Create(path, arr.shape[1], arr.shape[0], 1, gdal.GDT_Float32, options=['TILED=YES'])
+    ds.SetGeoTransform((origin[0], resolution, 0., origin[1], 0., -resolution))
+    ds.SetProjection(get_srs(epsg).ExportToWkt())
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(0.)
+    band.WriteArray(arr)
+    ds = None # close raster
+
+def write_product(folder, acquired, name, arr):
+    '''writes the product directory retrieve_data extracts: the HH raster and the log with the SAFE name. returns the path'''
+    product = 'S1A_IW_{}_DHP_RTC30_G_gpuned_{}'.format(acquired.strftime('%Y%m%dT%H%M%S'), name[-4:])
+    pdir = os.path.join(folder, product)
+    if not os.path.exists(pdir):
+        os.makedirs(pdir)
+    write_geotiff(os.path.join(pdir, '{}_HH.tif'.format(product)), arr)
+    with open(os.path.join(pdir, '{}.log'.format(product)), 'w') as f:
+        f.write('SAFE directory          : {}.SAFE\n'.format(name))
+    return pdir
+
+def get_bounds(shape, origin=ORIGIN, resolution=RESOLUTION, margin=AOI_MARGIN):
+    '''the AOI (minx, miny, maxx, maxy), the raster extent inset by margin'''
+    rows, cols = shape
+    dx, dy = cols * resolution * margin, rows * resolution * margin
+    minx, maxy = origin
+    maxx, miny = minx + cols * resolution, maxy - rows * resolution
+    return (minx + dx, miny + dy, maxx - dx, maxy - dy)
+
+def write_shapefile(path, bounds, epsg=EPSG):
+    '''writes the AOI rectangle as a single polygon shapefile'''
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    ds = driver.CreateDataSource(path)
+    layer = ds.CreateLayer('aoi', get_srs(epsg), ogr.wkbPolygon)
+    minx, miny, maxx, maxy = bounds
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in ((minx, miny), (minx, maxy), (maxx, maxy), (maxx, miny), (minx, miny)):
+        ring.AddPoint_2D(x, y)
+    poly = ogr.Geometry(ogr.wkbPolygon)
+    poly.AddGeometry(ring)
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(poly)
+    layer.CreateFeature(feature)
+    ds = None # close datasource
+
+def make_stack(folder, rows=ROWS, cols=COLS, dates=DATES, per_date=PER_DATE, seed=0):
+    '''writes the products of every granule to folder/RTC and the AOI to folder/aoi.shp.
+    returns (granule names, shapefile path)'''
+    rng = np.random.default_rng(seed)
+    shape = (rows, cols)
+    rtc = os.path.join(folder, 'RTC')
+    if not os.path.exists(rtc):
+        os.makedirs(rtc)
+    gamma0, shadow = terrain(shape, rng)
+    names = []
+    for i, (acquired, name) in enumerate(granule_names(dates, per_date)):
+        if i % per_date == 0:
+            geometry = pass_geometry(cols, rng)
+        write_product(rtc, acquired, name, scene(gamma0, shadow, rng, geometry, frame=i % per_date, per_date=per_date))
+        names.append(name)
+    shapefile = os.path.join(folder, 'aoi.shp')
+    write_shapefile(shapefile, get_bounds(shape))
+    return names, shapefile
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Generate a synthetic gamma0 stack laid out like the retrieved RTC products")
+    parse.add_argument("--output", required=True, help="folder to write RTC/ and aoi.shp to")
+    parse.add_argument("--rows", required=False, default=ROWS, type=int, help="rows of each scene")
+    parse.add_argument("--cols", required=False, default=COLS, type=int, help="columns of each scene")
+    parse.add_argument("--dates", required=False, default=DATES, type=int, help="number of acquisition dates")
+    parse.add_argument("--per-date", dest="per_date", required=False, default=PER_DATE, type=int, help="frames per date")
+    parse.add_argument("--seed", required=False, default=0, type=int, help="random seed")
+    return parse
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    names, shapefile = make_stack(args.output, args.rows, args.cols, args.dates, args.per_date, seed=args.seed)
+    print('wrote {} products to {} and the AOI to {}'.format(len(names), os.path.join(args.output, 'RTC'), shapefile))
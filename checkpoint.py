@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+'''checkpoints of the forward filled base, keyed by date and a fingerprint of every input up to that date,
+so re-runs resume from the last unchanged date and only re-render the frames that changed'''
+
+import os
+import json
+import hashlib
+import numpy as np
+
+CHECKPOINT_DIR='.checkpoints' # under the output folder
+MANIFEST='manifest.json'
+EVERY=10 # dates between checkpoints, the last date is always checkpointed
+
+def file_fingerprint(path):
+    st = os.stat(path)
+    return [os.path.basename(path), st.st_size, st.st_mtime]
+
+def get_key(date):
+    return date.strftime('%Y%m%d')
+
+def chain(dates, fil_dict, settings):
+    '''returns {date: fingerprint}. each fingerprint covers the settings, the date's files and every earlier date's
+    fingerprint, as the forward filled base of a date depends on all of them'''
+    out = {}
+    prev = json.dumps(settings, sort_keys=True)
+    for date in dates:
+        h = hashlib.sha1(prev.encode())
+        h.update(get_key(date).encode())
+        for fil in sorted(fil_dict[date]):
+            h.update(json.dumps(file_fingerprint(fil)).encode())
+        prev = out[date] = h.hexdigest()
+    return out
+
+def frame_fingerprint(fingerprint, clim, overview=None):
+    '''the frame of a date also depends on the clim it is scaled by and the overview drawn over it'''
+    over = file_fingerprint(overview) if isinstance(overview, str) else None
+    return hashlib.sha1(json.dumps([fingerprint, [float(c) for c in clim], over]).encode()).hexdigest()
+
+class store:
+    def __init__(self, folder, every=EVERY):
+        self.dir = os.path.join(folder, CHECKPOINT_DIR)
+        self.every = every
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+        self.path = os.path.join(self.dir, MANIFEST)
+        self.manifest = {'checkpoints': {}, 'frames': {}} # key: base fingerprint, key: frame fingerprint
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.manifest = json.load(f)
+
+    def get_path(self, date):
+        return os.path.join(self.dir, '{}.npy'.format(get_key(date)))
+
+    def has_checkpoint(self, date, fingerprint):
+        return self.manifest['checkpoints'].get(get_key(date)) == fingerprint and os.path.exists(self.get_path(date))
+
+    def is_rendered(self, date, fingerprint, path):
+        return self.manifest['frames'].get(get_key(date)) == fingerprint and os.path.exists(path)
+
+    def resume_index(self, dates, fingerprints, first):
+        '''returns the index of the latest checkpointed date before dates[first], or -1 to start from scratch'''
+        for i in reversed(range(first)):
+            if self.has_checkpoint(dates[i], fingerprints[dates[i]]):
+                return i
+        return -1
+
+    def should_checkpoint(self, i, dates):
+        return (i + 1) % self.every == 0 or i == len(dates) - 1
+
+    def save(self, date, fingerprint, base):
+        path = self.get_path(date)
+        tmp = '{}.tmp.npy'.format(path[:-4])
+        np.save(tmp, base)
+        os.replace(tmp, path)
+        self.manifest['checkpoints'][get_key(date)] = fingerprint
+        self.write()
+
+    def restore(self, date, base):
+        '''copies the checkpointed base of date into base (an array or memmap of the same shape)'''
+        base[...] = np.load(self.get_path(date), mmap_mode='r')
+        return base
+
+    def get_clim(self):
+        '''returns the clim the recorded frames were rendered with, None if there is none'''
+        clim = self.manifest.get('clim')
+        return tuple(clim) if clim else None
+
+    def set_clim(self, clim):
+        self.manifest['clim'] = [float(c) for c in clim]
+
+    def rendered(self, date, fingerprint):
+        self.manifest['frames'][get_key(date)] = fingerprint
+
+    def prune(self, fingerprints):
+        '''drops the checkpoints and frame records that are not of the current inputs'''
+        current = {get_key(date): fp for date, fp in fingerprints.items()}
+        for key, fp in list(self.manifest['checkpoints'].items()):
+            if current.get(key) != fp:
+                del self.manifest['checkpoints'][key]
+                path = os.path.join(self.dir, '{}.npy'.format(key))
+                if os.path.exists(path):
+                    os.remove(path)
+        for key in list(self.manifest['frames']):
+            if key not in current:
+                del self.manifest['frames'][key]
+        self.write()
+
+    def write(self):
+        tmp = '{}.tmp'.format(self.path)
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+'''allocation free compositing: the per date mean of the valid pixels of each scene, or a rolling mean/median over a
+sliding window of scenes, forward filled into a base frame.
+pixels are valid when > 0 (so nans and the <= 0 nodata of the warped scenes are invalid), no numpy.ma involved'''
+
+import warnings
+import numpy as np
+
+class compositor:
+    def __init__(self, shape, fill=0., base=None):
+        '''preallocates the running sum/count buffers for scenes of shape. base is the forward filled frame,
+        which is created (filled with fill) if not given, and may be a view of a larger array or a memmap'''
+        self.shape = tuple(shape)
+        self.total = np.zeros(self.shape, dtype=np.float32)
+        self.count = np.zeros(self.shape, dtype=np.uint16)
+        self.valid = np.empty(self.shape, dtype=bool)
+        self.scratch = np.empty(self.shape, dtype=np.float32) # read buffer for the scenes
+        self.fill = fill
+        self.base = base
+
+    def get_base(self):
+        if self.base is None:
+            self.base = np.full(self.shape, self.fill, dtype=np.float32)
+        return self.base
+
+    def add(self, data, valid=None):
+        '''adds the valid pixels of data (any float array of the shape) to the running sum and count.
+        valid is an optional boolean mask, by default the pixels > 0'''
+        if valid is None:
+            valid = np.greater(data, 0, out=self.valid)
+        np.add(self.total, data, out=self.total, where=valid)
+        np.add(self.count, valid, out=self.count)
+
+    def composite(self, base=None):
+        '''forward fills the base (or the given array of the shape) with the mean of the scenes added since the last
+        composite, wherever any was valid, and resets the sums for the next date. returns the base'''
+        if base is None:
+            base = self.get_base()
+        has_data = np.greater(self.count, 0, out=self.valid)
+        np.divide(self.total, self.count, out=base, where=has_data, casting='unsafe')
+        self.total.fill(0.)
+        self.count.fill(0)
+        return base
+
+MODES=('mean', 'median') # temporal compositing over a sliding window
+CAPACITY=16 # scenes a rolling median can hold
+
+class rolling_mean:
+    '''per pixel mean of the valid pixels of the scenes in a sliding window. scenes are pushed when they enter the window
+    and popped (with the same data) when they leave it, each an O(1) update per pixel'''
+    pop_needs_data = True
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.total = np.zeros(self.shape, dtype=np.float64) # float64, so the sums don't drift over many add/evict pairs
+        self.count = np.zeros(self.shape, dtype=np.uint16)
+        self.valid = np.empty(self.shape, dtype=bool)
+        self.scratch = np.empty(self.shape, dtype=np.float32)
+
+    def push(self, key, data, valid=None):
+        if valid is None:
+            valid = np.greater(data, 0, out=self.valid)
+        np.add(self.total, data, out=self.total, where=valid)
+        np.add(self.count, valid, out=self.count)
+
+    def pop(self, key, data, valid=None):
+        if valid is None:
+            valid = np.greater(data, 0, out=self.valid)
+        np.subtract(self.total, data, out=self.total, where=valid)
+        np.subtract(self.count, valid, out=self.count, casting='unsafe')
+        # drop any rounding residue where the window emptied
+        np.copyto(self.total, 0., where=np.equal(self.count, 0, out=self.valid))
+
+    def composite(self, base):
+        '''forward fills base with the window mean wherever the window has data, returns base'''
+        has_data = np.greater(self.count, 0, out=self.valid)
+        np.divide(self.total, self.count, out=base, where=has_data, casting='unsafe')
+        return base
+
+class rolling_median:
+    '''per pixel median of the valid pixels of the scenes in a sliding window, held in a ring buffer of capacity scenes
+    with nan marking invalid pixels. popping a scene only frees its slot, so its data isn't needed'''
+    pop_needs_data = False
+
+    def __init__(self, shape, capacity=CAPACITY):
+        self.shape = tuple(shape)
+        self.buffer = np.full((capacity,) + self.shape, np.nan, dtype=np.float32)
+        self.slots = {} # key: buffer index
+        self.free = list(reversed(range(capacity)))
+        self.valid = np.empty(self.shape, dtype=bool)
+        self.scratch = np.empty(self.shape, dtype=np.float32)
+
+    def push(self, key, data, valid=None):
+        if not self.free:
+            raise Exception('more than {} scenes in the window, raise the rolling median capacity'.format(len(self.buffer)))
+        i = self.free.pop()
+        slot = self.buffer[i]
+        np.copyto(slot, data)
+        if valid is None:
+            valid = np.greater(slot, 0, out=self.valid)
+        np.copyto(slot, np.nan, where=~valid)
+        self.slots[key] = i
+
+    def pop(self, key, data=None, valid=None):
+        i = self.slots.pop(key)
+        self.buffer[i].fill(np.nan)
+        self.free.append(i)
+
+    def composite(self, base):
+        '''forward fills base with the window median wherever the window has data, returns base'''
+        if not self.slots:
+            return base
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # all nan pixels, left to the forward fill
+            med = np.nanmedian(self.buffer[sorted(self.slots.values())], axis=0)
+        has_data = np.isfinite(med)
+        base[has_data] = med[has_data]
+        return base
+
+def get_window(mode, shape, capacity=CAPACITY):
+    '''returns the sliding window compositor of the mode'''
+    if mode == 'mean':
+        return rolling_mean(shape)
+    if mode == 'median':
+        return rolling_median(shape, capacity=capacity)
+    raise Exception('unknown temporal compositing mode: {}'.format(mode))
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+'''reads the shell style configs file so the python stages use the same settings as run.sh'''
+
+import os
+import shlex
+
+SCRIPT_DIR=os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH=os.path.join(SCRIPT_DIR, 'configs')
+DOCKER_DATA_DIR='/data'
+DEFAULT_SHAPEFILE=os.path.join(SCRIPT_DIR, 'shapefiles', 'test.shp')
+
+def load(path=CONFIG_PATH):
+    '''returns a dict of the KEY=value entries in the configs file'''
+    cfg = {}
+    if not os.path.exists(path):
+        return cfg
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            value = shlex.split(value, comments=True)
+            cfg[key.strip()] = value[0] if value else ''
+    return cfg
+
+def get(key, default=None, path=CONFIG_PATH):
+    return load(path).get(key, default)
+
+def get_shapefile_path(cfg=None):
+    '''returns the configured shapefile, falling back to its mount in the container and then to the test shapefile'''
+    if cfg is None:
+        cfg = load()
+    path = cfg.get('SHAPEFILE_PATH', '')
+    if path and os.path.exists(path):
+        return path
+    docker_path = os.path.join(DOCKER_DATA_DIR, os.path.basename(path))
+    if path and os.path.exists(docker_path):
+        return docker_path
+    return DEFAULT_SHAPEFILE
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+'''chunked, compressed (time, y, x) datacube of the warped scenes, so they are only warped/read from the RTC tiffs once'''
+
+import os
+import numpy as np
+import h5py
+from datetime import datetime as dt
+
+CUBE_PATH='/products/cube.h5'
+CHUNK=(1, 256, 256)
+SCALE=1e-4 # uint16 step, stores 0.0001 to 6.5535 with 0 reserved for invalid pixels
+DTYPES=('uint16', 'float16') # float16 marks invalid pixels with nan
+
+class cube:
+    def __init__(self, path=CUBE_PATH, shape=None, dtype='uint16', grid=None):
+        '''opens (or creates, given the (rows, cols) shape) the cube at path. grid is a string identifying the pixel
+        grid of the scenes (e.g. their geotransform and projection), stored when the cube is created'''
+        self.path = path
+        exists = os.path.exists(path)
+        self.h5 = h5py.File(path, 'a')
+        if not exists or 'data' not in self.h5:
+            if shape is None:
+                raise Exception('cube does not exist, a shape is needed to create it: {}'.format(path))
+            if dtype not in DTYPES:
+                raise Exception('unsupported cube dtype: {}'.format(dtype))
+            chunk = (1, min(CHUNK[1], shape[0]), min(CHUNK[2], shape[1]))
+            self.h5.create_dataset('data', shape=(0,) + tuple(shape), maxshape=(None,) + tuple(shape), dtype=dtype,
+                                   chunks=chunk, compression='gzip', compression_opts=1, shuffle=True)
+            self.h5.create_dataset('dates', shape=(0,), maxshape=(None,), dtype='i4')
+            self.h5.create_dataset('names', shape=(0,), maxshape=(None,), dtype=h5py.string_dtype())
+            self.h5.create_dataset('mtimes', shape=(0,), maxshape=(None,), dtype='f8')
+            self.h5['data'].attrs['scale'] = SCALE
+            if grid is not None:
+                self.h5['data'].attrs['grid'] = grid
+        self.data = self.h5['data']
+        self.scale = self.data.attrs.get('scale', SCALE)
+        self.index = {name: i for i, name in enumerate(self.get_names())} # name: time index
+        self.buffers = {} # shape: raw read buffer, reused by read_into
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    @property
+    def shape(self):
+        return self.data.shape[1:]
+
+    @property
+    def grid(self):
+        grid = self.data.attrs.get('grid')
+        return grid.decode() if isinstance(grid, bytes) else grid
+
+    def get_names(self):
+        return [n.decode() if isinstance(n, bytes) else n for n in self.h5['names'][:]]
+
+    def get_dates(self):
+        return [dt.strptime(str(d), '%Y%m%d') for d in self.h5['dates'][:]]
+
+    def indices(self, date):
+        '''returns the time indices of the scenes acquired on date'''
+        key = int(date.strftime('%Y%m%d'))
+        return [int(i) for i in np.nonzero(self.h5['dates'][:] == key)[0]]
+
+    def is_current(self, name, mtime):
+        return name in self.index and self.h5['mtimes'][self.index[name]] >= mtime
+
+    def encode(self, arr):
+        data = np.ma.getdata(arr)
+        invalid = np.ma.getmaskarray(arr) | ~np.isfinite(data) | (data <= 0)
+        if self.data.dtype == np.float16:
+            out = data.astype(np.float16)
+            out[invalid] = np.nan
+            return out
+        out = np.rint(np.clip(data, SCALE, 65535 * self.scale) / self.scale).astype(np.uint16)
+        out[invalid] = 0
+        return out
+
+    def decode(self, raw):
+        '''returns a float32 masked array'''
+        if raw.dtype == np.float16:
+            out = raw.astype(np.float32)
+            return np.ma.masked_invalid(out)
+        out = raw.astype(np.float32)
+        out *= self.scale
+        return np.ma.array(out, mask=(raw == 0))
+
+    def write(self, name, date, arr, mtime=0., window=None):
+        '''appends the scene, or overwrites its slice in place if it is already in the cube. existing slices are never rewritten.
+        window is an optional (row_off, col_off, rows, cols), to write a scene tile by tile'''
+        shape = self.shape if window is None else tuple(window[2:])
+        if arr.shape != shape:
+            raise Exception('{} has shape {}, expected {}'.format(name, arr.shape, shape))
+        if name in self.index:
+            i = self.index[name]
+        else:
+            i = len(self)
+            for key in ('data', 'dates', 'names', 'mtimes'):
+                self.h5[key].resize(i + 1, axis=0)
+            self.h5['names'][i] = name
+            self.index[name] = i
+        if window is None:
+            self.data[i] = self.encode(arr)
+        else:
+            r, c, nr, nc = window
+            self.data[i, r:r + nr, c:c + nc] = self.encode(arr)
+        self.h5['dates'][i] = int(date.strftime('%Y%m%d'))
+        self.h5['mtimes'][i] = mtime
+
+    def read(self, i, window=None):
+        '''returns scene i as a masked array, window is an optional (row_off, col_off, rows, cols)'''
+        if window is None:
+            return self.decode(self.data[i])
+        r, c, nr, nc = window
+        return self.decode(self.data[i, r:r + nr, c:c + nc])
+
+    def read_name(self, name, window=None):
+        return self.read(self.index[name], window=window)
+
+    def read_into(self, i, out, window=None):
+        '''reads scene i into the float32 array out without a mask, invalid pixels are 0 (or nan for float16 cubes)'''
+        sel = np.s_[i] if window is None else np.s_[i, window[0]:window[0] + window[2], window[1]:window[1] + window[3]]
+        shape = out.shape
+        if shape not in self.buffers:
+            self.buffers[shape] = np.empty(shape, dtype=self.data.dtype)
+        raw = self.buffers[shape]
+        self.data.read_direct(raw, source_sel=sel)
+        if raw.dtype == np.float16:
+            out[...] = raw
+        else:
+            np.multiply(raw, np.float32(self.scale), out=out)
+        return out
+
+    def reader(self):
+        '''returns a read function keyed by the original file path, a drop in for mean_and_match.read_gdal'''
+        def read(path, window=None, out=None):
+            if out is None:
+                shape = self.shape if window is None else tuple(window[2:])
+                out = np.empty(shape, dtype=np.float32)
+            return self.read_into(self.index[os.path.basename(path)], out, window=window)
+        return read
+
+    def loader(self):
+        '''returns a load function keyed by the original file path, a drop in for load_gdal'''
+        def load(path, window=None):
+            return self.read_name(os.path.basename(path), window=window)
+        return load
+
+    def flush(self):
+        self.h5.flush()
+
+    def close(self):
+        self.h5.close()
+
+def build(files, loader, get_date, path=CUBE_PATH, dtype='uint16', shape=None, windows=None, grid=None):
+    '''materializes any files that are new or modified since they were added, returns the opened cube.
+    given the (rows, cols) shape and windows, each file is read and written window by window with loader(path, window=...).
+    a cube of another grid or shape (a new AOI or resolution) is rebuilt rather than mixed with the new scenes'''
+    c = None
+    if os.path.exists(path):
+        c = cube(path)
+        if (grid is not None and c.grid != grid) or (shape is not None and tuple(c.shape) != tuple(shape)):
+            print('{} holds scenes of another grid, rebuilding it...'.format(path))
+            c.close()
+            os.remove(path)
+            c = None
+    todo = []
+    for fil in files:
+        mtime = os.path.getmtime(fil)
+        if c is None or not c.is_current(os.path.basename(fil), mtime):
+            todo.append((fil, mtime))
+    if todo:
+        print('adding {} scenes to {}...'.format(len(todo), path))
+    for fil, mtime in todo:
+        name = os.path.basename(fil)
+        if windows is not None:
+            if c is None:
+                c = cube(path, shape=shape, dtype=dtype, grid=grid)
+            # mark the scene stale until every window is written, so an interrupted build redoes it
+            for window in windows:
+                c.write(name, get_date(fil), loader(fil, window=window), mtime=0., window=window)
+            c.h5['mtimes'][c.index[name]] = mtime
+            continue
+        arr = loader(fil)
+        if c is None:
+            c = cube(path, shape=arr.shape, dtype=dtype, grid=grid)
+        c.write(name, get_date(fil), arr, mtime=mtime)
+    if c is not None:
+        c.flush()
+    return c
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+'''extracts only the needed members of a remote product zip: the central directory is read through http range requests,
+then just the included members' bytes are downloaded (resumably) and checked against their crc32, so the unused layers
+are never downloaded or written'''
+
+import os
+import io
+import zlib
+import time
+import struct
+import fnmatch
+import zipfile
+import requests
+from tqdm import tqdm
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+INCLUDE=('*_HH.tif', '*.log') # the members move.py reads, matched against the member's file name
+BLOCK=64*1024 # minimum bytes per range request reading the zip's directory and headers, coalescing zipfile's small reads
+CHUNK=1024*1024 # bytes per write when downloading a member
+RETRIES=3 # resumed attempts of an interrupted member download
+LOCAL_HEADER=struct.Struct('<4s5H3L2H') # zip local file header, followed by the name and extra field
+PART='.part' # suffix of the raw member bytes while downloading
+
+def get_session(retries=2, backoff_factor=1):
+    '''a session retrying the transient errors, as hyp3_sdk.util.download_file does'''
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504])
+    session.mount('https://', HTTPAdapter(max_retries=retry))
+    session.mount('http://', HTTPAdapter(max_retries=retry))
+    return session
+
+def is_included(name, include=INCLUDE):
+    return include is None or any(fnmatch.fnmatch(os.path.basename(name), pattern) for pattern in include)
+
+class http_file(io.RawIOBase):
+    '''read only, seekable view of a remote file through range requests, so zipfile can read the end of central
+    directory and the directory itself in a few requests. reads are fetched at least block bytes at a time'''
+    def __init__(self, url, session, block=BLOCK):
+        self.url = url
+        self.session = session
+        self.block = block
+        self.pos = 0
+        self.fetched = 0 # bytes downloaded
+        self.cache = (0, b'')
+        with session.get(url, headers={'Range': 'bytes=0-0'}, stream=True) as r:
+            r.raise_for_status()
+            self.ranged = r.status_code == 206
+            self.size = int(r.headers['Content-Range'].rsplit('/', 1)[1]) if self.ranged else int(r.headers.get('Content-Length', 0))
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.pos = max(0, offset)
+        return self.pos
+
+    def get(self, start, end):
+        '''returns the bytes start-end (exclusive) of the file'''
+        r = self.session.get(self.url, headers={'Range': 'bytes={}-{}'.format(start, end - 1)})
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise Exception('{} does not support range requests'.format(self.url))
+        self.fetched += len(r.content)
+        return r.content
+
+    def read(self, n=-1):
+        end = self.size if n is None or n < 0 else min(self.size, self.pos + n)
+        if end <= self.pos:
+            return b''
+        start, data = self.cache
+        if not (start <= self.pos and end <= start + len(data)):
+            start, data = self.cache = (self.pos, self.get(self.pos, min(self.size, max(end, self.pos + self.block))))
+        out = data[self.pos - start:end - start]
+        self.pos += len(out)
+        return out
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+def get_outpath(location, name):
+    '''returns where the member is extracted in location, refusing names (absolute, or with ..) that resolve outside it,
+    which zipfile.extract would have sanitized'''
+    outpath = os.path.realpath(os.path.join(location, name))
+    if not outpath.startswith(os.path.realpath(location) + os.sep):
+        raise Exception('refusing to extract {} outside {}'.format(name, location))
+    return outpath
+
+def get_data_offset(f, info):
+    '''returns the offset of the member's (compressed) data, after its local header'''
+    f.seek(info.header_offset)
+    header = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+    if header[0] != b'PK\x03\x04':
+        raise Exception('bad local header for {}'.format(info.filename))
+    return info.header_offset + LOCAL_HEADER.size + header[-2] + header[-1]
+
+def download_range(session, url, start, end, path, progress=None, retries=RETRIES):
+    '''appends the bytes start-end (exclusive) of url to path, resuming from what path already holds.
+    returns the bytes downloaded'''
+    fetched = 0
+    for attempt in range(retries + 1):
+        have = os.path.getsize(path) if os.path.exists(path) else 0
+        if start + have >= end:
+            break
+        try:
+            with session.get(url, headers={'Range': 'bytes={}-{}'.format(start + have, end - 1)}, stream=True) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise Exception('{} does not support range requests'.format(url))
+                with open(path, 'ab') as f:
+                    for chunk in r.iter_content(chunk_size=CHUNK):
+                        f.write(chunk)
+                        fetched += len(chunk)
+                        if progress is not None:
+                            progress.update(len(chunk))
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == retries:
+                raise
+            print('resuming {} after: {}'.format(os.path.basename(path), e))
+            time.sleep(2 ** attempt)
+    if os.path.getsize(path) != end - start:
+        raise Exception('downloaded {} of {} bytes of {}'.format(os.path.getsize(path), end - start, os.path.basename(path)))
+    return fetched
+
+def is_complete(path, info):
+    '''True if path already holds the member, extracted by an earlier attempt'''
+    if not os.path.exists(path) or os.path.getsize(path) != info.file_size:
+        return False
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc == info.CRC
+
+def inflate(part, outpath, info):
+    '''writes the member from its raw bytes in part to outpath, checking the crc32 and size. returns the bytes written'''
+    crc, size, written = 0, 0, 0
+    if info.compress_type == zipfile.ZIP_STORED:
+        with open(part, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK), b''):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        tmp = part # already the member, no copy
+    elif info.compress_type == zipfile.ZIP_DEFLATED:
+        tmp = '{}.tmp'.format(outpath)
+        d = zlib.decompressobj(-15)
+        with open(part, 'rb') as fin, open(tmp, 'wb') as fout:
+            for chunk in iter(lambda: fin.read(CHUNK), b''):
+                data = d.decompress(chunk)
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                fout.write(data)
+            data = d.flush()
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            fout.write(data)
+        written = size
+    else:
+        raise Exception('unsupported compression {} of {}'.format(info.compress_type, info.filename))
+    if crc != info.CRC or size != info.file_size:
+        for path in set([part, tmp]):
+            os.remove(path)
+        raise Exception('checksum mismatch for {}, it will be downloaded again'.format(info.filename))
+    os.replace(tmp, outpath)
+    if os.path.exists(part):
+        os.remove(part)
+    return written
+
+def fetch(url, location, include=INCLUDE, expected_size=None, session=None, desc=None):
+    '''extracts the members of the zip at url matching include (file name patterns, None for all) into location,
+    keeping their paths in the zip. returns the stats: archive size, bytes downloaded and written, and the bytes
+    saved against downloading the zip and extracting all of it'''
+    session = session or get_session()
+    f = http_file(url, session)
+    if expected_size is not None and f.size != expected_size:
+        raise Exception('{} is {} bytes, expected {}'.format(url, f.size, expected_size))
+    if not f.ranged:
+        return fetch_whole(session, url, location, include)
+    z = zipfile.ZipFile(f)
+    infos = [info for info in z.infolist() if not info.is_dir()]
+    members = [info for info in infos if is_included(info.filename, include)]
+    outpaths = [get_outpath(location, info.filename) for info in members] # every name is checked before any download
+    stats = {'archive_bytes': f.size, 'downloaded_bytes': 0, 'written_bytes': 0,
+             'extracted_bytes': sum(info.file_size for info in members), 'members': len(members), 'skipped': len(infos) - len(members)}
+    with tqdm(total=sum(info.compress_size for info in members), unit='B', unit_scale=True, desc=desc) as progress:
+        for info, outpath in zip(members, outpaths):
+            if not os.path.exists(os.path.dirname(outpath)):
+                os.makedirs(os.path.dirname(outpath))
+            if is_complete(outpath, info):
+                progress.update(info.compress_size)
+                continue
+            start = get_data_offset(f, info)
+            part = outpath + PART
+            stats['downloaded_bytes'] += download_range(session, url, start, start + info.compress_size, part, progress)
+            stats['written_bytes'] += info.compress_size + inflate(part, outpath, info)
+    stats['downloaded_bytes'] += f.fetched
+    stats['saved_bytes'] = f.size + sum(info.file_size for info in infos) - stats['written_bytes']
+    return stats
+
+def fetch_whole(session, url, location, include):
+    '''fallback for servers without range requests: downloads the zip, extracts the included members and removes it'''
+    path = os.path.join(location, '{}.zip'.format(os.getpid()))
+    with session.get(url, stream=True) as r:
+        r.raise_for_status()
+        with open(path, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=CHUNK):
+                f.write(chunk)
+    archive = os.path.getsize(path)
+    try:
+        with zipfile.ZipFile(path) as z:
+            infos = [info for info in z.infolist() if not info.is_dir()]
+            members = [info for info in infos if is_included(info.filename, include)]
+            for info in members:
+                z.extract(info, location) # zipfile checks the crc32 as it reads
+    finally:
+        os.remove(path)
+    extracted = sum(info.file_size for info in members)
+    return {'archive_bytes': archive, 'downloaded_bytes': archive, 'written_bytes': archive + extracted, 'extracted_bytes': extracted,
+            'members': len(members), 'skipped': len(infos) - len(members), 'saved_bytes': sum(info.file_size for info in infos) - extracted}
@@ -5,87 +5,125 @@
 
 import os
 import re
+import json
+import time
 import argparse
+import subprocess
 import numpy as np
 from tqdm import tqdm
 from datetime import datetime as dt
-from datetime import timedelta
-import matplotlib.pyplot as plt
 from PIL import Image
-from osgeo import gdal
-import shutil
+import config
+import metrics
 
 DIRECTORY_REGEX=r'^[0-9]{8}$'
 INFOLDER='/products/matched'
-OUTFOLDER='/products/timelapse'
+OUTPATH='/products/s1-backscatter_timeseries.mp4'
+PREVIEW_INFOLDER='/products/preview' # mean_and_match --preview frames
+PREVIEW_OUTPATH='/products/s1-backscatter_timeseries.preview.mp4'
 IN_REGEX=r'^S1-([0-9]{8}).matched.png$'
-N_DAYS=1 # a frame every n days (>1)
+FPS=20
+WIDTH=3840 # output width, the height keeps the aspect ratio (rounded to even for the encoder)
+CRF=22
+PRESET='slow'
+PIX_FMT='yuv420p' # 4:2:0, gray or rgb input would otherwise encode 4:0:0 or 4:4:4, which many players can't decode
+FRAME_LIST='.frames.json' # written to INFOLDER by mean_and_match: the frames of the run in order, and whether it finished
+POLL=1. # seconds between checks for new frames when following
+
+
+class encoder:
+    '''pipes raw uint8 frames of a fixed shape to ffmpeg on stdin, which scales and encodes them'''
+    def __init__(self, shape, outpath=OUTPATH, fps=FPS, width=WIDTH, gray=False):
+        self.shape = tuple(shape)
+        rows, cols = self.shape[:2]
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'gray' if gray else 'rgb24', '-s', '{}x{}'.format(cols, rows), '-r', str(fps), '-i', '-',
+               '-vf', 'scale={}:-2'.format(width), '-crf', str(CRF), '-preset', PRESET, '-pix_fmt', PIX_FMT, outpath]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        self.frames = 0
+        self.start = time.perf_counter()
+
+    def write(self, frame):
+        if frame.shape != self.shape:
+            raise Exception('frame has shape {}, the video is {}'.format(frame.shape, self.shape))
+        self.proc.stdin.write(memoryview(np.ascontiguousarray(frame, dtype=np.uint8)))
+        self.frames += 1
+
+    @property
+    def fps(self):
+        elapsed = time.perf_counter() - self.start
+        return self.frames / elapsed if elapsed > 0 else 0.
+
+    def close(self):
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise Exception('ffmpeg exited with {}'.format(self.proc.returncode))
 
 
 class timelapse():
 
-    def __init__(self):
-        self.dates = {} # dict that gives a filename from the date obj
-        if not os.path.exists(OUTFOLDER):
-            os.makedirs(OUTFOLDER)
+    def __init__(self, outpath=OUTPATH, fps=FPS, width=WIDTH, infolder=INFOLDER):
+        self.infolder = infolder
+        self.outpath = outpath
+        self.fps = fps
+        self.width = width
 
-    def build(self):
-        '''generate the timelapse'''
+    def build(self, follow=False):
+        '''generate the timelapse, following the frames as mean_and_match renders them if follow'''
         print('generating timelapse...')
-        self.fils = self.get_input_files()
-        for i, fil in enumerate(tqdm(self.fils)):
-            inpath = os.path.join(INFOLDER, fil)
-            outpath = os.path.join(OUTFOLDER, 's1-{:05d}.png'.format(i))
-            shutil.copy(inpath, outpath)
-
-        # generate mp4 from images
-        print('saving to s1-backscatter_timeseries.mp4...')
-        cmd = 'ffmpeg -y -r 20 -i "{}/s1-%05d.png" -crf 22 -preset slow -c:a ac3 -vf "scale=3840:-1" /products/s1-backscatter_timeseries.mp4 > /dev/null'.format(OUTFOLDER,OUTFOLDER)
-        os.system(cmd)
-        #print(cmd)
-
-    def combine_date(self, date):
-        '''combine files for the given date and save the output'''
-        fils = self.dates.get(date, [])
-        if len(fils) == 0:
-            return self.base
-        return self.combine(fils)
-
-    def fill_dates(self):
-        '''fill self.dates with {date: filename}'''
-        for fil in self.fils:
-            date = get_date(fil)
-            if date not in self.dates:
-                self.dates[date] = list()
-            self.dates[date].extend([fil])
-
-    def load(self, fil):
-        ds = gdal.Open(fil)
-        arr = np.ma.masked_less(np.ma.array(ds.GetRasterBand(1).ReadAsArray()),1)
-        return arr
-
-    def save(self, arr, path):
-        fig, ax = plt.subplots(figsize=(11,7))
-        #rgba = np.dstack((arr,arr,arr,arr.mask))
-        im = ax.imshow(arr, cmap='gist_gray')
-        ax.axis('off')
-        #print('saving as {}'.format(path))
-        fig.savefig(path, dpi=300, bbox_inches='tight', pad_inches=0.0, transparent=True, format='png')
-        plt.close()
-
-    def combine(self, fil_list):
-        '''combine multiple images into a single array (if needed). returns the combined array'''
-        stack = np.ma.dstack([self.load(os.path.join(INFOLDER,fil)) for fil in fil_list])
-        # get the mean of the stack
-        med = np.ma.mean(stack, axis=2)
-        # combine it with the base
-        combined = np.ma.filled(med, fill_value=self.base)
-        self.base = combined
-        return combined
+        if follow:
+            paths = follow_frames(self.infolder)
+            total = None
+        else:
+            self.fils = self.get_input_files()
+            paths = [os.path.join(self.infolder, fil) for fil in self.fils]
+            total = len(paths)
+        print('saving to {}...'.format(os.path.basename(self.outpath)))
+        enc = None
+        progress = tqdm(paths, total=total, unit='frame')
+        for path in progress:
+            frame = decode(path, gray=None if enc is None else len(enc.shape) == 2)
+            if enc is None:
+                enc = encoder(frame.shape, outpath=self.outpath, fps=self.fps, width=self.width, gray=(frame.ndim == 2))
+            enc.write(frame)
+            progress.set_postfix(fps='{:.1f}'.format(enc.fps))
+        if enc is None:
+            print('no frames to encode')
+            return 0
+        enc.close()
+        print('encoded {} frames at {:.1f} frames/s'.format(enc.frames, enc.fps))
+        return enc.frames
 
     def get_input_files(self):
         '''returns all input files'''
-        return sorted([f for f in os.listdir(INFOLDER) if re.match(IN_REGEX,f)], key=get_date)
+        return sorted([f for f in os.listdir(self.infolder) if re.match(IN_REGEX,f)], key=get_date)
+
+def decode(path, gray=None):
+    '''decodes the png once to a uint8 array, (rows, cols) if gray else (rows, cols, 3). gray=None keeps the png's mode'''
+    img = Image.open(path)
+    if gray is None:
+        gray = img.mode in ('L', 'I', 'I;16')
+    return np.asarray(img.convert('L' if gray else 'RGB'))
+
+def follow_frames(infolder, poll=POLL):
+    '''yields the frame paths of the running (or finished) mean_and_match in order, waiting for each to be written'''
+    list_path = os.path.join(infolder, FRAME_LIST)
+    i = 0
+    while True:
+        if not os.path.exists(list_path):
+            time.sleep(poll)
+            continue
+        with open(list_path) as f:
+            listing = json.load(f)
+        frames = listing['frames']
+        while i < len(frames) and os.path.exists(os.path.join(infolder, frames[i])):
+            yield os.path.join(infolder, frames[i])
+            i += 1
+        if i == len(frames):
+            return
+        if listing['complete']:
+            raise Exception('mean_and_match finished without writing {}'.format(frames[i]))
+        time.sleep(poll)
 
 def get_date(path):
     '''parses the datetime from the path name'''
@@ -93,7 +131,25 @@ def get_date(path):
     datestr = re.search(IN_REGEX, filename).group(1)
     return dt.strptime(datestr, '%Y%m%d')
 
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Encode the matched frames into the timelapse")
+    parse.add_argument("--follow", required=False, default=False, action="store_true", help="encode the frames as mean_and_match writes them")
+    parse.add_argument("--fps", required=False, default=FPS, type=int, help="frames per second of the video")
+    parse.add_argument("--width", required=False, default=None, type=int, help="width the frames are scaled to (default {}, reduced by PREVIEW_FACTOR with --preview)".format(WIDTH))
+    parse.add_argument("--output", required=False, default=None, help="output video path (default {})".format(OUTPATH))
+    parse.add_argument("--preview", required=False, default=False, action="store_true", help="encode the mean_and_match --preview frames")
+    return parse
+
 
 if __name__ == '__main__':
-    t = timelapse()
-    t.build()
+    args = parser().parse_args()
+    infolder, outpath, width = INFOLDER, OUTPATH, WIDTH
+    if args.preview:
+        factor = int(config.get('PREVIEW_FACTOR', 8))
+        infolder, outpath, width = PREVIEW_INFOLDER, PREVIEW_OUTPATH, WIDTH // factor // 2 * 2
+    t = timelapse(outpath=args.output or outpath, fps=args.fps, width=args.width or width, infolder=infolder)
+    with metrics.measure('generate_timelapse', follow=args.follow, preview=args.preview) as m:
+        m['frames'] = t.build(follow=args.follow)
@@ -4,24 +4,33 @@
 
 import os
 import argparse
-import geopandas
 
 
 def main(shapefile=False):
+    crs = determine_crs(shapefile)
+    if crs is not None:
+        print(crs)
+
+def determine_crs(shapefile):
+    '''returns the crs to use for the shapefile, determined by its centroid latitude'''
     if shapefile is False:
         return
     if not os.path.exists(shapefile):
         return
+    import geopandas # heavy, only when run directly, the pipeline reads the crs from aoi's cache
     data = geopandas.read_file(shapefile)
     #data = data.to_crs(epsg=4326)
     centroid = data.exterior.geometry.centroid.to_crs(epsg=4326)
-    lat = centroid.y.iloc[0]
+    return crs_for_latitude(centroid.y.iloc[0])
+
+def crs_for_latitude(lat):
+    '''polar stereographic north/south above 70 degrees, otherwise geographic'''
     if lat > 70:
-        print('EPSG:3995')
+        return 'EPSG:3995'
     elif lat < -70:
-        print('EPSG:3031')
+        return 'EPSG:3031'
     else:
-        print('EPSG:4326')
+        return 'EPSG:4326'
 
 def parser():
     '''
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+'''granule store shared by concurrent runs (of other AOIs, orbits or date ranges). each RTC product is keyed by its
+granule and processing parameters, submitted, downloaded and extracted once, and linked into the RTC folder of every
+run that references it. products no longer referenced by any run are removed by collect(). each run references a product with the file name
+patterns it extracts, and a product missing some run's files is downloaded again (keeping the files it has)'''
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+from contextlib import contextmanager
+
+STORE_PATH='/products/store'
+DATABASE='granules.db'
+PRODUCTS='products' # the extracted products, a folder per key
+JOB_PREFIX='rtc'
+LEASE=3600 # seconds a run's claim to submit or download a product holds before another run may take it over
+TIMEOUT=60 # seconds to wait on another run's lock of the database
+
+SUBMITTING='submitting'
+SUBMITTED='submitted'
+DOWNLOADING='downloading'
+LOCAL='local'
+
+def get_key(granule, params):
+    '''the content address of the product of the (full) granule name processed with params'''
+    return hashlib.sha1(json.dumps([granule, params], sort_keys=True).encode()).hexdigest()
+
+def get_include(include):
+    '''the stored form of the file name patterns, None (unknown, before the patterns were recorded) is kept'''
+    return None if include is None else json.dumps(sorted(set(include)))
+
+def covers(have, want):
+    '''True if a product extracted with the (stored) patterns have holds every file of want'''
+    if have is None or want is None:
+        return True # products and references from before the patterns were recorded
+    have, want = json.loads(have), json.loads(want)
+    return '*' in have or set(want) <= set(have)
+
+def get_job_name(granule, params):
+    '''the HyP3 job name of the product, the same for every run that needs it'''
+    return '{}_{}_{}'.format(JOB_PREFIX, granule[-4:], get_key(granule, params)[:16])
+
+class store:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.products = os.path.join(path, PRODUCTS)
+        if not os.path.exists(self.products):
+            os.makedirs(self.products)
+        # autocommit, so every transaction() takes the write lock up front
+        self.conn = sqlite3.connect(os.path.join(path, DATABASE), timeout=TIMEOUT, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.transaction():
+            self.conn.execute('CREATE TABLE IF NOT EXISTS products (key TEXT PRIMARY KEY, granule TEXT NOT NULL, params TEXT NOT NULL, '
+                              'job_name TEXT NOT NULL, state TEXT NOT NULL, path TEXT, owner INTEGER, updated REAL NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS refs (key TEXT NOT NULL, folder TEXT NOT NULL, PRIMARY KEY (key, folder))')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS refs_folder ON refs (folder)')
+            for table in ('products', 'refs'):
+                if 'include' not in [row[1] for row in self.conn.execute('PRAGMA table_info({})'.format(table))]:
+                    self.conn.execute('ALTER TABLE {} ADD COLUMN include TEXT'.format(table))
+
+    @contextmanager
+    def transaction(self):
+        '''holds the database write lock, blocking the other runs' transactions, until the block exits'''
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def is_stale(self, state, updated, now):
+        return state in (SUBMITTING, DOWNLOADING) and now - updated > LEASE
+
+    def get_dir(self, key):
+        return os.path.join(self.products, key)
+
+    def acquire(self, folder, granules, params, state=SUBMITTING, include=None):
+        '''references the granules' products from the run's RTC folder, needing the files matching include (file name
+        patterns), and claims the ones no run has submitted yet (or whose claim went stale). returns the claimed
+        granules, which the caller must submit() or abandon(). state=SUBMITTED records granules this run already
+        submitted without claiming them'''
+        folder = os.path.realpath(folder)
+        include = get_include(include)
+        now = time.time()
+        claimed = []
+        with self.transaction():
+            for gran in granules:
+                key = get_key(gran, params)
+                self.conn.execute('INSERT OR REPLACE INTO refs (key, folder, include) VALUES (?, ?, ?)', (key, folder, include))
+                row = self.conn.execute('SELECT state, updated FROM products WHERE key=?', (key,)).fetchone()
+                if row is None:
+                    self.conn.execute('INSERT INTO products (key, granule, params, job_name, state, owner, updated) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                      (key, gran, json.dumps(params, sort_keys=True), get_job_name(gran, params), state, os.getpid(), now))
+                elif not self.is_stale(*row, now):
+                    continue
+                else:
+                    self.conn.execute('UPDATE products SET state=?, owner=?, updated=? WHERE key=?', (state, os.getpid(), now, key))
+                if state == SUBMITTING:
+                    claimed.append(gran)
+        self.link(folder)
+        return claimed
+
+    def set_state(self, granules, params, state, only=None):
+        keys = [get_key(gran, params) for gran in granules]
+        with self.transaction():
+            for key in keys:
+                if only is None:
+                    self.conn.execute('UPDATE products SET state=?, updated=? WHERE key=?', (state, time.time(), key))
+                else:
+                    self.conn.execute('UPDATE products SET state=?, updated=? WHERE key=? AND state=?', (state, time.time(), key, only))
+
+    def submitted(self, granules, params):
+        '''records that the claimed granules' jobs were submitted'''
+        self.set_state(granules, params, SUBMITTED, only=SUBMITTING)
+
+    def abandon(self, granules, params):
+        '''gives up the claims of granules that could not be submitted, so any run may claim them again'''
+        with self.transaction():
+            for gran in granules:
+                self.conn.execute('DELETE FROM products WHERE key=? AND state=?', (get_key(gran, params), SUBMITTING))
+
+    def reset(self, granules, params):
+        '''makes the products of jobs that failed or expired claimable again, unless they are already local or claimed.
+        returns the granules any run may now claim and submit'''
+        claimable = []
+        with self.transaction():
+            for gran in granules:
+                key = get_key(gran, params)
+                self.conn.execute('DELETE FROM products WHERE key=? AND state=?', (key, SUBMITTED))
+                if self.conn.execute('SELECT 1 FROM products WHERE key=?', (key,)).fetchone() is None:
+                    claimable.append(gran)
+        return claimable
+
+    def claim_download(self, key):
+        '''claims the download of the product of a succeeded job. returns False if it is already local, or another run
+        is downloading it'''
+        now = time.time()
+        with self.transaction():
+            row = self.conn.execute('SELECT state, updated FROM products WHERE key=?', (key,)).fetchone()
+            if row is None or row[0] == LOCAL or (row[0] == DOWNLOADING and not self.is_stale(*row, now)):
+                return False
+            self.conn.execute('UPDATE products SET state=?, owner=?, updated=? WHERE key=?', (DOWNLOADING, os.getpid(), now, key))
+        return True
+
+    def get_partial_dir(self, key):
+        '''returns the folder to download and extract the product of key into'''
+        partial = '{}.partial'.format(self.get_dir(key))
+        if os.path.exists(partial):
+            return partial # left by an interrupted download, which is resumed
+        if os.path.exists(self.get_dir(key)):
+            # a product missing files of a new reference, its files are hard linked so only the missing ones are fetched
+            shutil.copytree(self.get_dir(key), partial, copy_function=os.link)
+        else:
+            os.makedirs(partial)
+        return partial
+
+    def get_include(self, key):
+        '''returns the file name patterns to extract the product with: those of every run referencing it and of the
+        files it already has, None for every file'''
+        rows = self.conn.execute('SELECT include FROM refs WHERE key=? UNION SELECT include FROM products WHERE key=?', (key, key)).fetchall()
+        include = set()
+        for (patterns,) in rows:
+            if patterns is not None:
+                include.update(json.loads(patterns))
+        return sorted(include) if include else None
+
+    def finished(self, key, paths, include=None):
+        '''moves the products extracted to the partial folder into the store, links them into every run that
+        references them. returns their paths in the store'''
+        target = self.get_dir(key)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace('{}.partial'.format(target), target)
+        paths = [os.path.join(target, os.path.basename(os.path.normpath(str(p)))) for p in paths]
+        with self.transaction():
+            self.conn.execute('UPDATE products SET state=?, path=?, include=?, updated=? WHERE key=?',
+                              (LOCAL, paths[0] if paths else None, get_include(include), time.time(), key))
+            folders = [row[0] for row in self.conn.execute('SELECT folder FROM refs WHERE key=?', (key,))]
+        for folder in folders:
+            self.link(folder)
+        return paths
+
+    def failed(self, key):
+        '''returns a product whose download failed to submitted, so the next cycle (of any run) retries it'''
+        with self.transaction():
+            self.conn.execute('UPDATE products SET state=?, updated=? WHERE key=? AND state=?', (SUBMITTED, time.time(), key, DOWNLOADING))
+
+    def link(self, folder):
+        '''links the local products the folder references into it, returns the number of new links. products missing
+        some of the folder's files are returned to submitted, so the run downloads them again'''
+        folder = os.path.realpath(folder)
+        rows = self.conn.execute('SELECT p.key, p.path, p.include, r.include FROM products p JOIN refs r ON p.key = r.key WHERE r.folder=? AND p.state=?',
+                                 (folder, LOCAL)).fetchall()
+        missing = [key for key, _, have, want in rows if not covers(have, want)]
+        if missing:
+            with self.transaction():
+                for key in missing:
+                    self.conn.execute('UPDATE products SET state=?, updated=? WHERE key=? AND state=?', (SUBMITTED, time.time(), key, LOCAL))
+        rows = [(path,) for key, path, have, want in rows if key not in missing]
+        if rows and not os.path.exists(folder):
+            os.makedirs(folder)
+        n = 0
+        for (path,) in rows:
+            dst = os.path.join(folder, os.path.basename(path))
+            if path and not os.path.lexists(dst):
+                os.symlink(path, dst)
+                n += 1
+        return n
+
+    def job_names(self, folder):
+        '''returns {job name: key} of the products the folder references'''
+        rows = self.conn.execute('SELECT p.job_name, p.key FROM products p JOIN refs r ON p.key = r.key WHERE r.folder=?', (os.path.realpath(folder),))
+        return dict(rows.fetchall())
+
+    def release(self, folder):
+        '''drops the folder's references and links, then removes the products no run references any more'''
+        folder = os.path.realpath(folder)
+        with self.transaction():
+            self.conn.execute('DELETE FROM refs WHERE folder=?', (folder,))
+        if os.path.exists(folder):
+            for fil in os.listdir(folder):
+                path = os.path.join(folder, fil)
+                if os.path.islink(path) and os.path.realpath(path).startswith(os.path.realpath(self.products) + os.sep):
+                    os.remove(path)
+        return self.collect()
+
+    def collect(self):
+        '''removes the products (and records) no run references, except those a run is still submitting or
+        downloading. returns the number removed'''
+        now = time.time()
+        removed = []
+        with self.transaction():
+            rows = self.conn.execute('SELECT key, state, updated FROM products WHERE key NOT IN (SELECT key FROM refs)').fetchall()
+            for key, state, updated in rows:
+                if state in (SUBMITTING, DOWNLOADING) and not self.is_stale(state, updated, now):
+                    continue
+                self.conn.execute('DELETE FROM products WHERE key=?', (key,))
+                # moved aside under the lock, so a run re-acquiring the granule never sees a half removed folder
+                if os.path.exists(self.get_dir(key)):
+                    trash = '{}.deleted.{}'.format(self.get_dir(key), os.getpid())
+                    os.replace(self.get_dir(key), trash)
+                    removed.append(trash)
+                else:
+                    removed.append(None)
+        for trash in removed:
+            if trash is not None:
+                shutil.rmtree(trash, ignore_errors=True)
+        return len(removed)
+
+    def status(self):
+        '''returns ({state: products}, {folder: references})'''
+        states = dict(self.conn.execute('SELECT state, COUNT(*) FROM products GROUP BY state').fetchall())
+        refs = dict(self.conn.execute('SELECT folder, COUNT(*) FROM refs GROUP BY folder').fetchall())
+        return states, refs
+
+    def close(self):
+        self.conn.close()
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Inspect or clean up the granule store shared by the runs")
+    parse.add_argument("--store", required=False, default=STORE_PATH, help="granule store folder")
+    parse.add_argument("--release", required=False, default=None, help="drop the references (and links) of this RTC folder")
+    parse.add_argument("--collect", required=False, default=False, action="store_true", help="remove the products no run references")
+    return parse
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    s = store(args.store)
+    if args.release:
+        print('released {}, removed {} products'.format(args.release, s.release(args.release)))
+    elif args.collect:
+        print('removed {} products'.format(s.collect()))
+    states, refs = s.status()
+    print('::STORE::')
+    for state in (SUBMITTING, SUBMITTED, DOWNLOADING, LOCAL):
+        print(' {:<12} {}'.format(state + ':', states.get(state, 0)))
+    for folder, n in sorted(refs.items()):
+        print(' {} references {}'.format(folder, n))
@@ -4,24 +4,51 @@
 
 import os
 import re
-import fiona
+import argparse
+import json
 import numpy as np
 from osgeo import gdal
 from PIL import Image
 from tqdm import tqdm
 from datetime import datetime as dt
-from skimage.measure import block_reduce
-import matplotlib.pyplot as plt
-from scipy.optimize import minimize
-from skimage.exposure import match_histograms
+from datetime import timedelta
+from collections import deque
+import render
+import normalize
+import stats
+import cube
+import composite
+import config
+import metrics
+import checkpoint
 
 
 INFOLDER='/products/warped'
 OUTFOLDER='/products/matched'
-#RANGE=[.5,99.5] # percentile range to scale output images
+PREVIEW_FOLDER='/products/preview'
+RANGE=[.5,99.5] # percentile range to scale output images (None to use the manual min/max bounds in main)
+PER_SCENE_CLIM=False # scale each date by its own percentile range instead of the range over all dates
 OVERVIEW_PATH='/hyp3_timeseries/shapefiles/overview.png'
 IN_REGEX=r'^S1[AB].*?_([0-9]{8}).*.warped.vrt$' # for dates
+OUT_REGEX=r'^S1-([0-9]{8}).matched.png$'
 BLACKLIST_DATES = ['YYYY-MM-DD'] # custom list for dates with poor/bad data (will ignore these dates)
+NORMALIZE = None # None, or 'l2', 'l1' or 'huber' to fit each scene (m*x-b) to the mean of all scenes
+MATCH = False # histogram match every scene to MATCH_REFERENCE before compositing
+MATCH_REFERENCE = None # None for the distribution of all scenes, or the path of a warped scene to match to
+USE_CUBE = True # read the scenes from the datacube at cube.CUBE_PATH, which is updated with any new/changed scenes
+TILE = None # None, or the tile size in pixels to process the scenes in (TILE, TILE) windows for AOIs too large for memory
+BASE_PATH = os.path.join(OUTFOLDER, '.base.npy') # disk backed forward filled base, used when tiling
+RENDER_WORKERS = 4 # processes rendering/encoding the frames while the next dates are composited (1 to render in line), each
+                   # holding a full size float32 frame (plus one being queued) in shared memory, so lower it for large AOIs
+CLIM_DECIMALS = 3 # percentile clims are rounded, so a few new scenes don't shift the clim and invalidate every frame
+CLIM_TOLERANCE = 0.02 # the clim of the rendered frames is kept until the percentiles move by more than this fraction of its range
+FILL = 0. # the base before a pixel's first observation, at or below any clim so it renders as the lowest level
+MATCH_QUANTILES = 101 # MATCH matches to this many percentiles of the reference, rounded to CLIM_DECIMALS for the same reason
+TEMPORAL = None # None for the same day mean, or 'mean'/'median' of the scenes in a rolling window of WINDOW_DAYS
+WINDOW_DAYS = 24
+N_DAYS = 12 # with TEMPORAL, a frame every n days
+FACTOR = 1 # scenes are read decimated by this factor, set from PREVIEW_FACTOR in configs with --preview
+FRAME_LIST = '.frames.json' # in OUTFOLDER, the frames of the run in order for generate_timelapse --follow
 
 def main():
     # get filenames matching regex & determine associated outfile names
@@ -31,83 +58,275 @@ def main():
     pmax=0.75
     if not os.path.exists(OUTFOLDER):
         os.makedirs(OUTFOLDER)
+    checkpoints = checkpoint.store(OUTFOLDER)
+
+    # in tiled mode the scenes are only ever read (TILE, TILE) windows at a time
+    shape = get_shape(files[0])
+    windows = get_windows(shape, TILE) if TILE else None
+    if windows and NORMALIZE:
+        raise Exception('normalization fits whole scenes against the mean image, it is not supported with TILE')
+    if MATCH and NORMALIZE:
+        raise Exception('MATCH and NORMALIZE are alternative corrections, set only one')
+    if TEMPORAL and (windows or NORMALIZE):
+        raise Exception('TEMPORAL compositing works on whole, unnormalized scenes, it is not supported with TILE or NORMALIZE')
+
+    # materialize the warped scenes once, everything after reads the cube
+    load, read = load_gdal, read_gdal
+    if USE_CUBE:
+        c = cube.build(files, load_gdal, get_date, shape=shape, windows=windows, grid=get_grid(files[0]))
+        load, read = c.loader(), c.reader()
+
+    # one pass over the files for the percentile clims and the normalization reference
+    acc = None
+    if RANGE or NORMALIZE or MATCH:
+        scan_files = [f for f in files if get_date(f).strftime('%Y-%m-%d') not in BLACKLIST_DATES]
+        print('computing statistics over {} files...'.format(len(scan_files)))
+        acc = stats.scan(scan_files, load, key=get_date, per_pixel=bool(NORMALIZE), windows=windows)
+        print(' mean: {:.4f}, std: {:.4f}'.format(acc.mean, acc.std))
+    if RANGE:
+        pmin, pmax = round_clim(acc.clim(RANGE))
+        print(' clim from the {}-{} percentiles: {:.4f} to {:.4f}'.format(RANGE[0], RANGE[1], pmin, pmax))
+        # appending a few dates nudges the percentiles, which would re-render every frame
+        previous = checkpoints.get_clim()
+        if previous is not None and is_close(previous, (pmin,pmax)):
+            pmin, pmax = previous
+            print(' keeping the clim of the rendered frames: {:.4f} to {:.4f}'.format(pmin, pmax))
+    checkpoints.set_clim((pmin,pmax)) # written with the manifest
     
     # load overview (map legend, north arrow, shapefiles, etc)
     overview = None
     if os.path.exists(OVERVIEW_PATH):
-        overview = plt.imread(OVERVIEW_PATH)
+        overview = OVERVIEW_PATH # decoded once by the renderer
+
+    # optional radiometric normalization against the mean of all scenes
+    med = None
+    if NORMALIZE:
+        med = acc.mean_image()
+
+    # or histogram matching of every scene as it is read
+    if MATCH:
+        reference = acc # all scenes, skipping the blacklisted dates
+        if MATCH_REFERENCE:
+            reference = stats.scan([MATCH_REFERENCE], load_gdal, windows=windows)
+        quantiles = get_quantiles(reference)
+        matcher = normalize.histogram_matcher(reference.hist, reference.vmax, quantiles=quantiles)
+        read = matched_reader(read, matcher, windows=windows)
 
-    print('applying corrections and saving files...')
-    base = np.full_like(load_gdal(files[0]), fill_value=pmin)
     fil_dict = sort_into_dict(files)
-    #blacklist_dates = [dt.strptime(dts, '%Y-%m-%d') for dts in BLACKLIST_DATES]
-    for date in tqdm(sorted(fil_dict.keys())):
-        if date.strftime('%Y-%m-%d') in BLACKLIST_DATES:
-            continue
-        fils = fil_dict.get(date)
-        #print('generating scene for: {}'.format(date.strftime('%Y-%m-%d')))
-        base = combine_files_and_save(fils, (pmin,pmax), overview=overview, base=base, date=date)
-
-def combine_files_and_save(fil_paths, minmax, overview=None, base=None, date=None):
-    '''apply the histogram matching and save the file'''
+    dates = [date for date in sorted(fil_dict.keys()) if date.strftime('%Y-%m-%d') not in BLACKLIST_DATES]
+    if TEMPORAL:
+        # frames are every N_DAYS, keyed by the scenes acquired since the previous frame
+        fil_dict = get_frame_dict(dates, fil_dict)
+        dates = sorted(fil_dict.keys())
+    remove_stale_frames(dates)
+
+    # each date's fingerprint covers its inputs and every earlier date's, find the first frame that changed
+    settings = {'normalize': NORMALIZE, 'cube': USE_CUBE}
+    if MATCH:
+        settings['match'] = quantiles[1] # the (rounded) reference distribution
+    if TEMPORAL:
+        settings['temporal'] = [TEMPORAL, WINDOW_DAYS, N_DAYS]
+    if NORMALIZE:
+        settings['inputs'] = [checkpoint.file_fingerprint(f) for f in files] # the reference is the mean of every scene
+    fingerprints = checkpoint.chain(dates, fil_dict, settings)
+    checkpoints.prune(fingerprints)
+    clims = {}
+    for date in dates:
+        # frames of a TEMPORAL window don't have scenes of their own, they are scaled by the range over all dates
+        clims[date] = round_clim(acc.clim(RANGE, key=date)) if (RANGE and PER_SCENE_CLIM and not TEMPORAL) else (pmin,pmax)
+    frame_fingerprints = {date: checkpoint.frame_fingerprint(fingerprints[date], clims[date], overview) for date in dates}
+    todo = [i for i, date in enumerate(dates) if not checkpoints.is_rendered(date, frame_fingerprints[date], get_outpath(date))]
+    # stale frames are removed first, so a follower never encodes them
+    for i in todo:
+        if os.path.exists(get_outpath(dates[i])):
+            os.remove(get_outpath(dates[i]))
+    write_frame_list(dates, complete=not todo)
+    if not todo:
+        print('all {} frames are up to date'.format(len(dates)))
+        return
+
+    print('applying corrections and saving files...')
+    if windows:
+        base = np.lib.format.open_memmap(BASE_PATH, mode='w+', dtype=np.float32, shape=shape)
+        base[:] = FILL
+    elif TEMPORAL:
+        engine = composite.get_window(TEMPORAL, shape) # the sums (or scenes) of the window ending at the frame date
+        in_window = deque() # the scenes in the window, oldest first
+        base = np.full(shape, FILL, dtype=np.float32)
+    else:
+        comp = composite.compositor(shape, fill=FILL) # the forward filled base and the per date sums, reused every date
+        base = comp.get_base()
+    start = checkpoints.resume_index(dates, fingerprints, todo[0])
+    if start >= 0:
+        print('resuming from the {} checkpoint, {} frames to render'.format(dates[start].strftime('%Y-%m-%d'), len(todo)))
+        checkpoints.restore(dates[start], base)
+        if TEMPORAL:
+            # the checkpoint holds the base, refill the window it ended with
+            oldest = dates[start] - timedelta(days=WINDOW_DAYS)
+            fils = [f for date in dates[:start + 1] for f in fil_dict[date] if get_date(f) > oldest]
+            step_window(engine, in_window, fils, dates[start], read)
+    render_dates = set(dates[i] for i in todo)
+    # compositing is sequential (each date forward fills the last), the frames are rendered in parallel
+    pool = None
+    if RENDER_WORKERS > 1 and not windows:
+        pool = render.frame_pool(shape, overview=overview, workers=RENDER_WORKERS)
+    try:
+        for i in tqdm(range(start + 1, len(dates))):
+            date = dates[i]
+            fils = fil_dict.get(date)
+            render_frame = date in render_dates
+            with metrics.measure('mean_and_match', date.strftime('%Y-%m-%d'), scenes=len(fils), rendered=render_frame):
+                if TEMPORAL:
+                    step_window(engine, in_window, fils, date, read)
+                    engine.composite(base)
+                    if render_frame:
+                        save(base, get_outpath(date), clims[date], date=date, overview=overview, pool=pool)
+                elif windows:
+                    combine_tiles_and_save(fils, (pmin,pmax), windows, base, overview=overview, date=date, clim=clims[date], reader=read, render_frame=render_frame)
+                else:
+                    combine_files_and_save(fils, (pmin,pmax), overview=overview, date=date, reference=med, clim=clims[date], loader=load, reader=read, compositor=comp, pool=pool, render_frame=render_frame)
+                if checkpoints.should_checkpoint(i, dates):
+                    checkpoints.save(date, fingerprints[date], base)
+    finally:
+        if pool is not None:
+            pool.close()
+    # only recorded once every frame is written
+    for date in render_dates:
+        checkpoints.rendered(date, frame_fingerprints[date])
+    checkpoints.write()
+    write_frame_list(dates, complete=True)
+
+def combine_files_and_save(fil_paths, minmax, overview=None, base=None, date=None, reference=None, clim=None, loader=None, reader=None, compositor=None, pool=None, render_frame=True):
+    '''apply the histogram matching and save the file. clim overrides minmax for scaling the saved frame.
+    the compositor holds the forward filled base across dates, otherwise one is made from base. returns the base.
+    given a render.frame_pool, the frame is queued there instead of saved before returning.
+    without render_frame only the base is updated'''
+    pmin,pmax = minmax
+    loader = loader or load_gdal
+    reader = reader or read_gdal
+    if compositor is None:
+        compositor = composite.compositor(np.shape(base), base=np.ma.filled(base, pmin).astype(np.float32))
+    if reference is not None:
+        # fit every scene of the date against the reference in one pass
+        arrays = [loader(fil_path) for fil_path in fil_paths]
+        coeff = get_corrections(np.ma.dstack(arrays), reference)
+        for arr, c in zip(arrays, coeff):
+            compositor.add(np.ma.getdata(normalize.apply(arr, c)), valid=~np.ma.getmaskarray(arr))
+    else:
+        for fil_path in fil_paths:
+            compositor.add(reader(fil_path, out=compositor.scratch))
+    base = compositor.composite() # we're going to update the base with the current observation
+    if render_frame:
+        save(base, get_outpath(date), clim or (pmin,pmax), date=date, overview=overview, pool=pool)
+    return base
+
+def combine_tiles_and_save(fil_paths, minmax, windows, base, overview=None, date=None, clim=None, reader=None, render_frame=True):
+    '''tiled combine_files_and_save: combines the scenes one window at a time, updating the full size (disk backed) base
+    in place and rendering the frame from the updated tiles, so only a window of each scene is in memory at once'''
     pmin,pmax = minmax
-    arrays = []
+    reader = reader or read_gdal
+    compositors = {} # tile shape: compositor, edge tiles are smaller
+    def tiles():
+        for window in windows:
+            r, c, nr, nc = window
+            comp = compositors.setdefault((nr, nc), composite.compositor((nr, nc)))
+            for fil_path in fil_paths:
+                comp.add(reader(fil_path, window=window, out=comp.scratch))
+            yield r, c, comp.composite(base=base[r:r + nr, c:c + nc]) # forward fill the base with the current observation
+    clim = clim or (pmin,pmax)
+    if render_frame:
+        render.get_renderer(base.shape, clim, overview=overview).save_tiles(tiles(), get_outpath(date), date=date, clim=clim)
+    else:
+        for _ in tiles():
+            pass
+    if isinstance(base, np.memmap):
+        base.flush()
+    return base
+
+def matched_reader(reader, matcher, windows=None):
+    '''wraps reader so every scene is histogram matched as it is read. the lookup table of a scene is fit the first time
+    it is read, from the whole scene (read window by window if windows are given)'''
+    def read(path, window=None, out=None):
+        if path not in matcher.luts and window is not None:
+            matcher.fit(path, (reader(path, window=w) for w in windows))
+        data = reader(path, window=window, out=out)
+        return matcher.apply(path, data, out=data)
+    return read
+
+def get_frame_dict(dates, fil_dict):
+    '''returns {frame date: [files acquired since the previous frame]} for frames every N_DAYS from the first date,
+    up to the first frame on or after the last date'''
+    frames = {}
+    frame = dates[0]
+    i = 0
+    while i < len(dates):
+        fils = frames.setdefault(frame, [])
+        while i < len(dates) and dates[i] <= frame:
+            fils.extend(fil_dict[dates[i]])
+            i += 1
+        frame += timedelta(days=N_DAYS)
+    return frames
+
+def step_window(engine, in_window, fil_paths, date, reader):
+    '''pushes the scenes entering the window that ends at date, and pops the ones older than WINDOW_DAYS'''
     for fil_path in fil_paths:
-        arr = load_gdal(fil_path)
-        #med.mask = arr.mask # ensure the histogram comparisons are over the same data
-        #matched = np.ma.array(match_histograms(arr, med))
-        #matched.mask = arr.mask # ensure the mask stays the same
-        arrays.append(arr)
-    # combine the matched arrays
-    combined = combine(arrays)
-
-    #np.ma.set_fill_value(matched, 0.) # and ensure the mask is set to zero
-    #matched = np.ma.array(match_histograms(arr, med))
-    outfile = 'S1-{}.matched.png'.format(date.strftime('%Y%m%d'))
-    #outfile = os.path.basename(fil_path).replace('warped.tif', 'matched.png')
-    outpath = os.path.join(OUTFOLDER, outfile)
-    base = np.ma.array(np.ma.filled(combined, fill_value=base)) # we're going to update the base with the current observation
-    save(base, outpath, (pmin,pmax), date=date, overview=overview)
-    #med = np.ma.array(np.ma.filled(arr, fill_value=med)) # we're going to update the median with the current image
-    return (base - pmin) + pmin
-
-def efficient_mean(files):
-    '''iterate through files to limit RAM usage'''
-    mean = np.zeros_like(load_gdal(files[0]))
-    for fil in files:
-        print('loading {} into stack...'.format(fil))
-        mean = mean + load_gdal(fil)
-    mean = mean / float(len(files))
-    return mean
-
-def get_corrections(stack, med):
+        engine.push(fil_path, reader(fil_path, out=engine.scratch))
+        in_window.append(fil_path)
+    while in_window and get_date(in_window[0]) <= date - timedelta(days=WINDOW_DAYS):
+        fil_path = in_window.popleft()
+        engine.pop(fil_path, reader(fil_path, out=engine.scratch) if engine.pop_needs_data else None)
+
+def get_outpath(date):
+    return os.path.join(OUTFOLDER, 'S1-{}.matched.png'.format(date.strftime('%Y%m%d')))
+
+def write_frame_list(dates, complete=False):
+    listing = {'frames': [os.path.basename(get_outpath(date)) for date in dates], 'complete': complete}
+    path = os.path.join(OUTFOLDER, FRAME_LIST)
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as f:
+        json.dump(listing, f)
+    os.replace(tmp, path)
+
+def remove_stale_frames(dates):
+    '''removes the frames of dates that are no longer rendered (blacklisted, or their scenes removed)'''
+    keep = set(os.path.basename(get_outpath(date)) for date in dates)
+    for fil in os.listdir(OUTFOLDER):
+        if re.match(OUT_REGEX, fil) and fil not in keep:
+            os.remove(os.path.join(OUTFOLDER, fil))
+
+def round_clim(clim):
+    return (round(clim[0], CLIM_DECIMALS), round(clim[1], CLIM_DECIMALS))
+
+def is_close(clim, other, tolerance=None):
+    '''True if neither bound of other is further from clim's than tolerance (CLIM_TOLERANCE) of clim's range'''
+    tolerance = CLIM_TOLERANCE if tolerance is None else tolerance
+    return max(abs(clim[0] - other[0]), abs(clim[1] - other[1])) <= tolerance * abs(clim[1] - clim[0])
+
+def get_quantiles(acc):
+    '''returns the (cdf, values) of MATCH_QUANTILES evenly spaced percentiles of the accumulator, values rounded'''
+    q = np.linspace(0., 100., MATCH_QUANTILES)
+    return [float(x) / 100. for x in q], [round(acc.percentile(x), CLIM_DECIMALS) for x in q]
+
+def get_windows(shape, tile):
+    '''returns the (row_off, col_off, rows, cols) windows covering shape in (tile, tile) blocks'''
+    return [(r, c, min(tile, shape[0] - r), min(tile, shape[1] - c)) for r in range(0, shape[0], tile) for c in range(0, shape[1], tile)]
+
+def efficient_mean(files, loader=None):
+    '''iterate through files to limit RAM usage, returns the mean over the valid pixels of each file'''
+    return stats.scan(files, loader or load_gdal, per_pixel=True).mean_image()
+
+def get_corrections(stack, med, mode=None):
     '''determine the proper correction coefficients over the given stack, compared to the stack's mean
     and return a list of the correction coefficients'''
-    coeff = []
-    for i in range(stack.shape[2]):
-        s = stack[:,:,i]
-        coeff.append(determine_coefficients(s, med))
-    return coeff
-
-def save(arr, filename, clim, date=None, overview=None):
-    y,x=arr.shape
-    dpi=300
-    figsize=(x/dpi, y/dpi)
-    fig, ax = plt.subplots(figsize=figsize)
-    #rgba = np.dstack((arr,arr,arr,arr.mask))
-    cmap = plt.cm.get_cmap('gist_gray')
-    size = fig.get_size_inches()*fig.dpi # size of figure
-    extent = 0, size[0], 0, size[1]
-    im = ax.imshow(arr, cmap=cmap, clim=clim, extent=extent)
-    # add the date
-    if date:
-        plt.text(10,10, date.strftime('%Y-%m-%d'), color='white', backgroundcolor='black', font='serif', fontweight='bold', fontsize='medium')
-    if not overview is None:
-        im2 = plt.imshow(overview, interpolation='nearest', extent=extent)
-    ax.axis('off')
-    #print('saving as {}'.format(filename))
-    fig.savefig(filename, dpi=dpi, bbox_inches='tight', pad_inches=0.0, transparent=True, format='png', facecolor=(0.,0.,0.))
-    plt.close(fig)
+    return list(normalize.fit(stack, med, mode=mode or NORMALIZE or 'l2'))
+
+def save(arr, filename, clim, date=None, overview=None, pool=None):
+    '''renders the array through the clim lookup table (gist_gray), stamps the date and overlays the overview.
+    with a render.frame_pool the array is copied to it and rendered in the background'''
+    if pool is not None:
+        pool.submit(arr, filename, date=date, clim=clim)
+        return
+    render.get_renderer(arr.shape, clim, overview=overview).save(arr, filename, date=date, clim=clim)
 
 def combine(arrays):
     '''combine multiple images into a single array (if needed). returns the combined array'''
@@ -117,13 +336,9 @@ def combine(arrays):
     return combined
 
 
-def determine_coefficients(arr, med):
+def determine_coefficients(arr, med, mode='l2'):
     '''returns the scaling m,b for mx+b that minimizes the residuals between arr and med'''
-    def residual(vec):
-        m,b = vec
-        #return np.absolute(m*arr-b - med).sum() L1 norm
-        return np.square(m*arr-b - med).sum()
-    return minimize(residual, np.array([1.,0.]), bounds=[(0.,2.),(-2.,2.)], method='Nelder-Mead').x
+    return normalize.fit(arr, med, mode=mode)[0]
 
 def scale(arr, clim):
     '''returns the scaled array from clim (min,max) bounds to 1-255 integer array (since we use 0 as mask)'''
@@ -136,13 +351,54 @@ def save_gdal(arr, filename):
     dst_ds.GetRasterBand(1).WriteArray(arr)
     dst_ds = None # close raster
 
-def load_gdal(filename):
-    ds = gdal.Open(filename)
-    myarray = np.ma.masked_less_equal(np.ma.array(ds.GetRasterBand(1).ReadAsArray()),0)
+def load_gdal(filename, window=None, factor=None):
+    '''reads the band as a masked array, or only the (row_off, col_off, rows, cols) window of it'''
+    myarray = np.ma.masked_less_equal(np.ma.array(read_gdal(filename, window=window, factor=factor)),0)
     return myarray
 
-def load_binned(filename):
-    return block_reduce(load_gdal(filename), block_size=(N,N), func=np.ma.median)
+def read_gdal(filename, window=None, out=None, factor=None):
+    '''reads the band (or window) as a float32 array without a mask, into out if given. pixels <= 0 are nodata.
+    with a factor > 1 (FACTOR by default) the band is read decimated by it, from its overviews if it has any,
+    and the window is in decimated pixels'''
+    factor = factor or FACTOR
+    ds = gdal.Open(filename)
+    band = ds.GetRasterBand(1)
+    r, c = 0, 0
+    nr, nc = get_shape(filename, factor=factor, ds=ds)
+    if window is not None:
+        r, c, nr, nc = window
+    if out is None:
+        out = np.empty((nr, nc), dtype=np.float32)
+    # the source window in full resolution pixels, gdal decimates it into the buffer shape
+    xoff, yoff = c * factor, r * factor
+    xsize, ysize = min(nc * factor, ds.RasterXSize - xoff), min(nr * factor, ds.RasterYSize - yoff)
+    band.ReadAsArray(xoff, yoff, xsize, ysize, buf_xsize=nc, buf_ysize=nr, buf_obj=out, resample_alg=gdal.GRIORA_NearestNeighbour)
+    return out
+
+def get_shape(filename, factor=None, ds=None):
+    '''returns the (rows, cols) of the raster read decimated by factor (FACTOR by default) without reading it'''
+    factor = factor or FACTOR
+    if ds is None:
+        ds = gdal.Open(filename)
+    return (-(-ds.RasterYSize // factor), -(-ds.RasterXSize // factor))
+
+def get_grid(filename):
+    '''returns the pixel grid (geotransform, projection and size) of the raster as a string'''
+    ds = gdal.Open(filename)
+    return json.dumps([list(ds.GetGeoTransform()), ds.GetProjection(), ds.RasterXSize, ds.RasterYSize, FACTOR])
+
+def set_preview(factor):
+    '''switches to the quick look preview: scenes are read decimated by factor, skipping the (full resolution) cube,
+    and the frames go to PREVIEW_FOLDER'''
+    global FACTOR, OUTFOLDER, BASE_PATH, USE_CUBE
+    FACTOR = factor
+    OUTFOLDER = PREVIEW_FOLDER
+    BASE_PATH = os.path.join(PREVIEW_FOLDER, '.base.npy')
+    USE_CUBE = False
+
+def load_binned(filename, factor=None):
+    '''returns the scene decimated by factor as a masked array, read at the reduced size rather than binned after'''
+    return load_gdal(filename, factor=factor)
 
 def get_matching(infolder):
     file_list = []
@@ -161,5 +417,18 @@ def sort_into_dict(fils):
         fil_dict.setdefault(get_date(fil),[]).append(fil)
     return fil_dict
 
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Composite the warped scenes by date and render the frames")
+    parse.add_argument("--preview", required=False, default=False, action="store_true", help="quick look at PREVIEW_FACTOR (configs) reduced resolution into {}".format(PREVIEW_FOLDER))
+    return parse
+
+
 if __name__ == '__main__':
-    main()
+    args = parser().parse_args()
+    if args.preview:
+        set_preview(int(config.get('PREVIEW_FACTOR', 8)))
+    with metrics.measure('mean_and_match', preview=args.preview):
+        main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+'''lightweight performance records for the pipeline: wall/cpu time, peak rss and bytes read/written per stage, granule
+or frame, appended as json lines to METRICS_PATH. run directly for a report ranking the hot spots'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import functools
+from datetime import datetime
+
+METRICS_PATH=os.environ.get('METRICS_PATH', '/products/metrics.jsonl') # set METRICS_PATH= (empty) to disable
+TOP=10
+
+_lock = threading.Lock()
+_local = threading.local() # the stack of open process scope measures of each thread
+
+def read_io(tid=None):
+    '''returns (bytes read, bytes written) by the process, or the thread tid. these count every read/write call,
+    so downloads and page cache hits are included, not just disk io'''
+    path = '/proc/self/io' if tid is None else '/proc/self/task/{}/io'.format(tid)
+    try:
+        with open(path) as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+def read_peak_rss():
+    '''returns the peak resident set size (bytes) since the last reset_peak_rss'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # lifetime peak, kB on linux
+
+def reset_peak_rss():
+    '''resets the kernel's peak rss counter, so it reflects the measured block alone (linux only, otherwise a no-op)'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def write(record, path=None):
+    path = METRICS_PATH if path is None else path
+    if not path:
+        return
+    line = json.dumps(record) + '\n'
+    with _lock:
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(line)
+
+class measure:
+    '''context manager recording a block. scope='process' measures the whole process (stages, and work on process pools),
+    scope='thread' only the calling thread (work on thread pools), without a peak rss as the process shares it.
+    extra fields are recorded as given, or set on the measure inside the block'''
+    def __init__(self, stage, name=None, scope='process', **fields):
+        self.stage = stage
+        self.name = name
+        self.scope = scope
+        self.fields = fields
+        self.peak = 0
+
+    def __setitem__(self, key, value):
+        self.fields[key] = value
+
+    def __enter__(self):
+        self.tid = threading.get_native_id() if self.scope == 'thread' else None
+        if self.scope == 'process':
+            stack = getattr(_local, 'stack', None)
+            if stack is None:
+                stack = _local.stack = []
+            if stack:
+                # nested: the reset below would hide the outer block's peak so far
+                stack[-1].peak = max(stack[-1].peak, read_peak_rss())
+            stack.append(self)
+            reset_peak_rss()
+        self.start = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time() if self.scope == 'thread' else time.process_time()
+        self.children = os.times()
+        self.io = read_io(self.tid)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall
+        cpu = (time.thread_time() if self.scope == 'thread' else time.process_time()) - self.cpu
+        children = os.times()
+        read_bytes, write_bytes = read_io(self.tid)
+        record = {'stage': self.stage, 'name': self.name, 'scope': self.scope, 'pid': os.getpid(),
+                  'start': datetime.fromtimestamp(self.start).isoformat(), 'wall': wall, 'cpu': cpu,
+                  'children_cpu': (children.children_user - self.children.children_user) + (children.children_system - self.children.children_system),
+                  'read_bytes': read_bytes - self.io[0], 'write_bytes': write_bytes - self.io[1], 'peak_rss': None}
+        if self.scope == 'process':
+            self.peak = max(self.peak, read_peak_rss())
+            record['peak_rss'] = self.peak
+            _local.stack.pop()
+            if _local.stack:
+                _local.stack[-1].peak = max(_local.stack[-1].peak, self.peak)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record.update(self.fields)
+        write(record)
+        return False
+
+def timed(stage, name=None, scope='process'):
+    '''decorator recording every call of the function, named after it unless name is given'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(stage, name or func.__name__, scope=scope):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def load(path=None):
+    path = METRICS_PATH if path is None else path
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+def summarize(records):
+    '''returns {(stage, kind): totals}, kind is 'stage' for the stage wide record (no name) and 'item' for the rest'''
+    out = {}
+    for r in records:
+        key = (r['stage'], 'stage' if r.get('name') is None else 'item')
+        s = out.setdefault(key, {'count': 0, 'wall': 0., 'cpu': 0., 'children_cpu': 0., 'read_bytes': 0, 'write_bytes': 0, 'peak_rss': 0, 'max_wall': 0.})
+        s['count'] += 1
+        for field in ('wall', 'cpu', 'children_cpu', 'read_bytes', 'write_bytes'):
+            s[field] += r.get(field) or 0
+        s['peak_rss'] = max(s['peak_rss'], r.get('peak_rss') or 0)
+        s['max_wall'] = max(s['max_wall'], r['wall'])
+    return out
+
+def report(records, top=TOP, out=sys.stdout):
+    '''prints the stages and items ranked by total wall time, then the slowest individual items'''
+    mb = 1024. * 1024.
+    summary = summarize(records)
+    out.write('{:<22} {:>5} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10} {:>9}\n'.format(
+        'stage', 'kind', 'count', 'wall (s)', 'cpu (s)', 'max (s)', 'read MB', 'write MB', 'rss MB'))
+    for (stage, kind), s in sorted(summary.items(), key=lambda item: -item[1]['wall']):
+        out.write('{:<22} {:>5} {:>7} {:>10.1f} {:>10.1f} {:>10.2f} {:>10.1f} {:>10.1f} {:>9.0f}\n'.format(
+            stage, kind, s['count'], s['wall'], s['cpu'] + s['children_cpu'], s['max_wall'], s['read_bytes'] / mb, s['write_bytes'] / mb, s['peak_rss'] / mb))
+    items = sorted((r for r in records if r.get('name') is not None), key=lambda r: -r['wall'])[:top]
+    if items:
+        out.write('\nslowest {} items:\n'.format(len(items)))
+        for r in items:
+            out.write(' {:<22} {:<50} {:>8.2f}s {:>8.1f}MB read {:>8.1f}MB written\n'.format(
+                r['stage'], str(r['name'])[:50], r['wall'], r['read_bytes'] / mb, r['write_bytes'] / mb))
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Report the hot spots from the pipeline metrics")
+    parse.add_argument("--path", required=False, default=METRICS_PATH, help="metrics json lines file")
+    parse.add_argument("--top", required=False, default=TOP, type=int, help="number of slowest items to list")
+    parse.add_argument("--since", required=False, default=None, help="only records started at or after this iso time")
+    return parse
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    records = load(args.path)
+    if args.since:
+        records = [r for r in records if r['start'] >= args.since]
+    report(records, top=args.top)
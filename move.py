@@ -4,30 +4,33 @@
 
 import os
 import re
-import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from osgeo import gdal
 import track
+import scan
+import metrics
 from tqdm import tqdm
 
 S1_REGEX='^S1.*_([a-zA-Z0-9]{4}).+?$'
 TIFF_REGEX= '^S1.*_HH.tif$'
+CORRECTED_PATH='/products/corrected'
+WORKERS=os.cpu_count()
+
+gdal.UseExceptions()
 
 class group:
-    def __init__(self):
-        self.inpath = '/products/RTC'
-        self.outpath = '/products/corrected'
-        self.t = track.track(False)
+    def __init__(self, inpath=track.RTC_PATH, outpath=CORRECTED_PATH):
+        self.inpath = inpath
+        self.outpath = outpath
+        self.t = track.track(False, output_dir=inpath)
+        self.scanner = scan.scanner(self.inpath) # shares its cache file with track
         if not os.path.exists(self.outpath):
             os.makedirs(self.outpath)
 
     def get_original_name(self, fil):
-        '''looks at the log file to determine the original file name'''
-        path = os.path.join(self.inpath, '{}/{}.log'.format(fil,fil))
-        if not os.path.exists(path):
-            return
-        LOG_REGEX = "^.*SAFE directory[ ]*: (S1.*\.SAFE)"
-        for line in open(path, 'r'):
-            if re.match(LOG_REGEX, line):
-                return re.search(LOG_REGEX, line).group(1)
+        '''looks at the (cached) log file to determine the original file name'''
+        return self.scanner.get_original_name(fil)
 
     def get_tiff_filename(self, fdir):
         dirfiles = os.listdir(fdir)
@@ -35,31 +38,53 @@ class group:
             if re.match(TIFF_REGEX, fil):
                 return fil
 
-    def copy_tiffs(self):
-        '''finds all the local files'''
-        local_files = [f for f in os.listdir(self.inpath) if re.match(S1_REGEX, f) and not f.endswith('.zip')]
-        print('generating virtual files...')
-        for fil in tqdm(local_files):
+    def copy_tiffs(self, workers=WORKERS, force=False):
+        '''finds all the local files and builds a corrected vrt for each'''
+        local_files = self.scanner.scan()
+        tasks = []
+        for fil, original_name in local_files.items():
             fdir = os.path.join(self.inpath, fil)
             if not os.path.isdir(fdir):
-                return
+                continue
             # determine which file to copy and the proper name
-            basename = self.get_original_name(fil).replace('.SAFE', '')
+            basename = original_name.replace('.SAFE', '')
             if not self.t.is_valid_name(basename):
                 #print('{} is not in the query... skipping!'.format(basename))
                 continue
             tiff_fn = self.get_tiff_filename(fdir)
+            if tiff_fn is None:
+                continue
             outfname = '{}.corrected.vrt'.format(basename)
             frompath = os.path.join(fdir, tiff_fn)
             topath = os.path.join(self.outpath, outfname)
-            #if not os.path.exists(topath):
-            #    print('copying {} to {}'.format(frompath, topath))
-            #    shutil.copy(frompath, topath)
-            #print('building {}'.format(outfname))
-            cmd = 'gdalbuildvrt -resolution highest {} {} > /dev/null'.format(topath, frompath)
-            os.system(cmd)
+            if not force and os.path.exists(topath) and os.path.getmtime(topath) >= os.path.getmtime(frompath):
+                continue # already built
+            tasks.append((frompath, topath))
+        print('generating virtual files ({} new)...'.format(len(tasks)))
+        if workers <= 1:
+            # a single in-process pass over every file
+            return [build_vrt(frompath, topath) for frompath, topath in tqdm(tasks)]
+        # BuildVRT releases the GIL, so threads avoid any process start up cost
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(tqdm(pool.map(lambda task: build_vrt(*task), tasks), total=len(tasks)))
 
-if __name__ == '__main__':
-    g = group()
-    g.copy_tiffs()
+def build_vrt(frompath, topath):
+    '''in-process equivalent of gdalbuildvrt -resolution highest'''
+    with metrics.measure('move', os.path.basename(topath), scope='thread'):
+        gdal.BuildVRT(topath, [frompath], resolution='highest')
+    return topath
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Build corrected virtual files from the retrieved RTC products")
+    parse.add_argument("--workers", required=False, default=WORKERS, type=int, help="number of worker threads (1 builds every file in a single pass)")
+    parse.add_argument("--force", required=False, action='store_true', help="rebuild files that already exist")
+    return parse
 
+if __name__ == '__main__':
+    args = parser().parse_args()
+    with metrics.measure('move'):
+        g = group()
+        g.copy_tiffs(workers=args.workers, force=args.force)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+'''closed form radiometric normalization: fits m,b for m*x-b ~ reference for a whole stack of scenes at once,
+and lookup table histogram matching of scenes to a reference distribution'''
+
+import numpy as np
+
+BOUNDS=((0.,2.),(-2.,2.)) # (m, b) bounds, as used with the old Nelder-Mead fit
+MODES=('l2', 'l1', 'huber')
+IRLS_ITERATIONS=20
+HUBER_K=1.345 # huber threshold, in robust standard deviations of the residuals
+
+def _flatten(stack, ref):
+    '''returns (x, y, valid) as (pixels, scenes) float64 arrays and a boolean validity mask'''
+    if stack.ndim == 2:
+        stack = stack[:, :, np.newaxis]
+    n = stack.shape[2]
+    x = np.ma.getdata(stack).reshape(-1, n).astype(np.float64)
+    y = np.ma.getdata(ref).reshape(-1, 1).astype(np.float64)
+    valid = ~np.ma.getmaskarray(stack).reshape(-1, n) & ~np.ma.getmaskarray(ref).reshape(-1, 1)
+    valid &= np.isfinite(x) & np.isfinite(y)
+    return x, y, valid
+
+def _sums(x, y, w):
+    '''weighted sums over the pixels, one value per scene'''
+    wx = w * x
+    wy = w * y
+    return (w.sum(axis=0), wx.sum(axis=0), wy.sum(axis=0), (wx * x).sum(axis=0), (wx * y).sum(axis=0), (wy * y).sum(axis=0))
+
+def _sse(m, c, s):
+    '''weighted sum of squared residuals of y - (m*x + c), from the sums'''
+    n, sx, sy, sxx, sxy, syy = s
+    return syy - 2*m*sxy - 2*c*sy + m*m*sxx + 2*m*c*sx + n*c*c
+
+def _solve(s, bounds):
+    '''bounded weighted least squares for every scene, returns (m, b) arrays'''
+    n, sx, sy, sxx, sxy, syy = s
+    (mlo, mhi), (blo, bhi) = bounds
+    clo, chi = -bhi, -blo # y = m*x + c with c = -b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = n*sxx - sx*sx
+        m0 = np.where(det > 0, (n*sxy - sx*sy) / det, 1.)
+        c0 = np.where(n > 0, (sy - m0*sx) / np.maximum(n, 1e-300), 0.)
+        inside = (m0 >= mlo) & (m0 <= mhi) & (c0 >= clo) & (c0 <= chi)
+        # otherwise the minimum is on an edge of the box: fix one parameter at a bound, solve and clip the other
+        candidates = []
+        for m_edge in (mlo, mhi):
+            m = np.full_like(m0, m_edge)
+            c = np.clip(np.where(n > 0, (sy - m*sx) / np.maximum(n, 1e-300), 0.), clo, chi)
+            candidates.append((m, c))
+        for c_edge in (clo, chi):
+            c = np.full_like(c0, c_edge)
+            m = np.clip(np.where(sxx > 0, (sxy - c*sx) / np.maximum(sxx, 1e-300), 1.), mlo, mhi)
+            candidates.append((m, c))
+    best_m, best_c = candidates[0]
+    best = _sse(best_m, best_c, s)
+    for m, c in candidates[1:]:
+        err = _sse(m, c, s)
+        better = err < best
+        best_m = np.where(better, m, best_m)
+        best_c = np.where(better, c, best_c)
+        best = np.where(better, err, best)
+    m = np.where(inside, m0, best_m)
+    c = np.where(inside, c0, best_c)
+    return m, -c
+
+def fit(stack, ref, mode='l2', bounds=BOUNDS, iterations=IRLS_ITERATIONS):
+    '''returns an (n, 2) array of (m, b) so that m*stack[:,:,i]-b best matches ref over the pixels valid in both.
+    stack is (rows, cols, n) or a single (rows, cols) scene, masked pixels (and nans) are ignored.
+    mode is 'l2' (closed form least squares), or 'l1'/'huber' (iteratively reweighted least squares)'''
+    if mode not in MODES:
+        raise Exception('unknown normalization mode: {}'.format(mode))
+    x, y, valid = _flatten(stack, ref)
+    x[~valid] = 0.
+    y = np.where(np.isfinite(y), y, 0.)
+    w = valid.astype(np.float64)
+    m, b = _solve(_sums(x, y, w), bounds)
+    if mode != 'l2':
+        for _ in range(iterations):
+            resid = np.abs(m*x - b - y)
+            if mode == 'l1':
+                weights = 1. / np.maximum(resid, 1e-6)
+            else:
+                # scale from the median absolute residual of each scene
+                scale = np.nanmedian(np.where(valid, resid, np.nan), axis=0) / 0.6745
+                k = HUBER_K * np.maximum(scale, 1e-12)
+                weights = np.where(resid <= k, 1., k / np.maximum(resid, 1e-12))
+            m_new, b_new = _solve(_sums(x, y, w * weights), bounds)
+            converged = np.allclose(m_new, m, atol=1e-7) and np.allclose(b_new, b, atol=1e-7)
+            m, b = m_new, b_new
+            if converged:
+                break
+    return np.stack((m, b), axis=1)
+
+def apply(arr, coeff):
+    '''returns m*arr-b, keeping the mask of arr'''
+    m, b = coeff
+    return arr * m - b
+
+class histogram_matcher:
+    '''matches scenes to a reference distribution through a lookup table per scene. scenes are quantized into the bins of
+    the reference histogram (a stats.accumulator histogram), so a table is one small interp and applying it one gather.
+    pixels <= 0 (and nans) are nodata and left as they are'''
+    def __init__(self, reference_hist, vmax, quantiles=None):
+        '''quantiles is an optional (cdf, values) pair of increasing arrays to match to instead of the histogram's bins'''
+        reference_hist = np.asarray(reference_hist, dtype=np.float64)
+        self.bins = len(reference_hist)
+        self.scale = self.bins / float(vmax)
+        centers = (np.arange(self.bins) + 0.5) / self.scale
+        cdf = np.cumsum(reference_hist)
+        if cdf[-1] == 0:
+            raise Exception('the reference histogram is empty')
+        used = reference_hist > 0
+        self.ref_cdf = ((cdf - reference_hist / 2.) / cdf[-1])[used] # bin midpoints, strictly increasing over used bins
+        self.ref_values = centers[used]
+        if quantiles is not None:
+            self.ref_cdf, self.ref_values = (np.asarray(a, dtype=np.float64) for a in quantiles)
+        self.luts = {} # scene key: lookup table
+
+    def quantize(self, data):
+        '''returns the bin index of every pixel (nodata pixels land in bin 0)'''
+        idx = np.multiply(data, self.scale, dtype=np.float32)
+        np.nan_to_num(idx, copy=False, nan=0., posinf=self.bins - 1, neginf=0.)
+        idx = idx.astype(np.int32)
+        np.clip(idx, 0, self.bins - 1, out=idx)
+        return idx
+
+    def histogram(self, data):
+        valid = np.greater(data, 0)
+        return np.bincount(self.quantize(data[valid]), minlength=self.bins)
+
+    def fit(self, key, arrays):
+        '''builds the lookup table of the scene key from its data, given as one array or any iterable of windows of it'''
+        if isinstance(arrays, np.ndarray):
+            arrays = [arrays]
+        hist = np.zeros(self.bins, dtype=np.int64)
+        for arr in arrays:
+            hist += self.histogram(arr)
+        cdf = np.cumsum(hist)
+        if cdf[-1] == 0:
+            self.luts[key] = (np.arange(self.bins, dtype=np.float32) + 0.5) / np.float32(self.scale) # no data, identity
+            return self.luts[key]
+        self.luts[key] = np.interp((cdf - hist / 2.) / cdf[-1], self.ref_cdf, self.ref_values).astype(np.float32)
+        return self.luts[key]
+
+    def apply(self, key, data, out=None):
+        '''returns data with its valid pixels mapped through the scene's lookup table (fitting it on data if needed)'''
+        if key not in self.luts:
+            self.fit(key, data)
+        if out is None:
+            out = np.array(data, dtype=np.float32)
+        elif out is not data:
+            np.copyto(out, data)
+        matched = self.luts[key][self.quantize(data)]
+        np.copyto(out, matched, where=np.greater(data, 0))
+        return out
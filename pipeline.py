@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+'''runs the stages of run.sh in one process: the configs and the AOI metadata are read once, the heavy libraries are
+only imported by the stages that run, and a manifest of each stage's settings and input fingerprints skips the stages
+whose inputs are unchanged since they last finished. the stages themselves skip the files that are up to date'''
+
+import os
+import re
+import json
+import hashlib
+import argparse
+from datetime import datetime, timezone
+import config
+import metrics
+import aoi
+import checkpoint
+
+STAGES=('retrieve_data', 'move', 'warp', 'mean_and_match', 'generate_timelapse') # in run order
+MANIFEST_PATH='/products/.pipeline.json'
+
+def digest(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+def listing(folder, regex=None):
+    '''fingerprint of the (matching) entries of folder, following the links into the granule store'''
+    if not os.path.exists(folder):
+        return None
+    paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if regex is None or re.match(regex, f))
+    return digest([checkpoint.file_fingerprint(p) for p in paths if os.path.exists(p)])
+
+class manifest:
+    '''{stage: {'settings': digest, 'inputs': digest}} of the last time each stage finished'''
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.stages = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.stages = json.load(f)
+
+    def get(self, key, field):
+        return self.stages.get(key, {}).get(field)
+
+    def record(self, key, settings, inputs):
+        self.stages[key] = {'settings': settings, 'inputs': inputs}
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp = '{}.tmp'.format(self.path)
+        with open(tmp, 'w') as f:
+            json.dump(self.stages, f, indent=1)
+        os.replace(tmp, self.path)
+
+class pipeline:
+    def __init__(self, cfg=None, manifest_path=MANIFEST_PATH, preview=False, force=False):
+        self.cfg = config.load() if cfg is None else cfg
+        self.shapefile = config.get_shapefile_path(self.cfg)
+        self.meta = aoi.get_metadata(self.shapefile) # the crs, bounds and polygon of every stage, read once
+        self.manifest = manifest(manifest_path)
+        self.preview = preview
+        self.force = force
+        self.factor = int(self.cfg.get('PREVIEW_FACTOR', 8))
+
+    def get_key(self, stage):
+        '''the frames and timelapse of a preview are kept apart from the full resolution ones'''
+        if self.preview and stage in ('mean_and_match', 'generate_timelapse'):
+            return '{}.preview'.format(stage)
+        return stage
+
+    def run(self, stages=STAGES):
+        for stage in stages:
+            key = self.get_key(stage)
+            settings, inputs, done = getattr(self, 'check_{}'.format(stage))()
+            changed = settings != self.manifest.get(key, 'settings')
+            if not self.force and done and not changed and inputs == self.manifest.get(key, 'inputs'):
+                print('{}: inputs unchanged, skipping'.format(stage))
+                continue
+            print('{}: running...'.format(stage))
+            with metrics.measure(stage, preview=self.preview):
+                finished = getattr(self, 'run_{}'.format(stage))(changed)
+            if finished is not False:
+                self.manifest.record(key, settings, inputs)
+
+    # each check_ returns (settings digest, inputs digest, True if the outputs exist), computed before the stage runs.
+    # each run_ is given whether the settings changed since the last run, and returns False if it did not finish
+
+    def check_retrieve_data(self):
+        import track
+        settings = digest([aoi.fingerprint(self.shapefile), self.cfg.get('START_DATE'), self.cfg.get('END_DATE'), self.cfg.get('RELATIVE_ORBIT')])
+        # acquisitions within the ingest lag can still be added to the catalog, so a recent end date is always re-queried
+        end = self.cfg.get('END_DATE')
+        settled = bool(end) and datetime.strptime(end, '%Y-%m-%d').replace(tzinfo=timezone.utc) < datetime.now(timezone.utc) - track.INGEST_LAG
+        return settings, None, settled and os.path.exists(track.RTC_PATH)
+
+    def run_retrieve_data(self, changed):
+        import retrieve_data
+        t = retrieve_data.main(self.shapefile, start=self.cfg.get('START_DATE', False), end=self.cfg.get('END_DATE', False),
+                               relativeorbit=self.cfg.get('RELATIVE_ORBIT', False))
+        return t.is_done()
+
+    def check_move(self):
+        import track
+        import move
+        # the products and asf-results.txt, which move's track filters them by. not the run's state and caches, which
+        # change every retrieve_data cycle
+        inputs = [listing(track.RTC_PATH, move.S1_REGEX), listing(track.RTC_PATH, r'^asf-results\.txt$')]
+        return None, digest(inputs), os.path.exists(move.CORRECTED_PATH)
+
+    def run_move(self, changed):
+        import move
+        move.group().copy_tiffs(force=changed)
+
+    def check_warp(self):
+        import move
+        import warp
+        settings = digest([self.meta['crs'], self.meta['bounds'], self.get_resolution()])
+        return settings, listing(move.CORRECTED_PATH, warp.CORRECTED_REGEX), os.path.exists(warp.WARPED_PATH)
+
+    def run_warp(self, changed):
+        import warp
+        warp.main(shapefile=self.shapefile, resolution=self.get_resolution()) # re-warps every file on a new grid itself
+
+    def get_resolution(self):
+        return float(self.cfg.get('RESOLUTION', 30))
+
+    def check_mean_and_match(self):
+        import mean_and_match as mm
+        self.set_preview(mm)
+        settings = digest([mm.RANGE, mm.PER_SCENE_CLIM, mm.BLACKLIST_DATES, mm.NORMALIZE, mm.MATCH, mm.MATCH_REFERENCE,
+                           mm.USE_CUBE, mm.TILE, mm.TEMPORAL, mm.WINDOW_DAYS, mm.N_DAYS, mm.FACTOR])
+        over = checkpoint.file_fingerprint(mm.OVERVIEW_PATH) if os.path.exists(mm.OVERVIEW_PATH) else None
+        return settings, digest([listing(mm.INFOLDER, mm.IN_REGEX), over]), os.path.exists(os.path.join(mm.OUTFOLDER, mm.FRAME_LIST))
+
+    def run_mean_and_match(self, changed):
+        import mean_and_match as mm
+        self.set_preview(mm)
+        mm.main()
+
+    def set_preview(self, mm):
+        if self.preview and mm.OUTFOLDER != mm.PREVIEW_FOLDER:
+            mm.set_preview(self.factor)
+
+    def get_timelapse(self):
+        import generate_timelapse as gt
+        if self.preview:
+            return gt.timelapse(outpath=gt.PREVIEW_OUTPATH, width=gt.WIDTH // self.factor // 2 * 2, infolder=gt.PREVIEW_INFOLDER)
+        return gt.timelapse()
+
+    def check_generate_timelapse(self):
+        import generate_timelapse as gt
+        t = self.get_timelapse()
+        return digest([t.fps, t.width, gt.PIX_FMT]), listing(t.infolder, gt.IN_REGEX), os.path.exists(t.outpath)
+
+    def run_generate_timelapse(self, changed):
+        self.get_timelapse().build()
+
+def select(stage=None, start=None):
+    '''returns the stages to run: the comma separated stage list, or every stage from start'''
+    if stage:
+        names = stage.split(',')
+    else:
+        names = STAGES[STAGES.index(start):] if start else STAGES
+    for name in names:
+        if name not in STAGES:
+            raise Exception('unknown stage {}, the stages are {}'.format(name, ', '.join(STAGES)))
+    return [name for name in STAGES if name in names]
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Run the pipeline stages in one process, skipping the stages whose inputs are unchanged")
+    parse.add_argument("--stage", required=False, default=None, help="comma separated stages to run, of {}".format(', '.join(STAGES)))
+    parse.add_argument("--from", dest="start", required=False, default=None, choices=STAGES, help="run from this stage on")
+    parse.add_argument("--force", required=False, default=False, action="store_true", help="run the stages even if their inputs are unchanged")
+    parse.add_argument("--preview", required=False, default=False, action="store_true", help="render the quick look at PREVIEW_FACTOR (configs) reduced resolution")
+    parse.add_argument("--manifest", required=False, default=MANIFEST_PATH, help="record of each stage's inputs the last time it finished")
+    return parse
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    if args.stage and args.start:
+        raise Exception('give either --stage or --from')
+    stages = select(args.stage, args.start)
+    with metrics.measure('pipeline', stages=len(stages), preview=args.preview):
+        pipeline(manifest_path=args.manifest, preview=args.preview, force=args.force).run(stages)
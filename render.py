@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+'''renders frames straight to png without matplotlib, matching the frames mean_and_match used to save through pyplot'''
+
+import os
+import numpy as np
+import metrics
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image, ImageDraw, ImageFont
+
+DPI=300
+SCALE=0.77 # the pyplot axes held the image at 77% of the figure size, which bbox_inches='tight' cropped to
+FONT='DejaVuSerif-Bold.ttf' # matplotlib's bold serif
+FONT_SIZE=10*DPI/72. # fontsize='medium' at 300 dpi
+BOX_LEFT=4 # pixel geometry of the date label, measured from the pyplot frames
+TEXT_LEFT=23
+BASELINE=23 # pixels from the bottom edge
+BOX_TOP=74 # pixels from the bottom edge
+COMPRESS_LEVEL=1 # zlib level, encoding dominates the frame time so favour speed over file size
+WORKERS=4 # render/encode processes of a frame_pool
+
+def load_font(size=FONT_SIZE):
+    try:
+        return ImageFont.truetype(FONT, size)
+    except OSError:
+        pass
+    try:
+        import matplotlib
+        return ImageFont.truetype(os.path.join(matplotlib.get_data_path(), 'fonts', 'ttf', FONT), size)
+    except (ImportError, OSError):
+        return ImageFont.load_default()
+
+def get_output_shape(shape):
+    '''returns the (rows, cols) of the frame saved for an array of the given shape'''
+    return (int(shape[0] * SCALE), int(shape[1] * SCALE))
+
+def resample_weights(n_in, n_out):
+    '''returns the sparse (n_out, n_in) matrix of the hanning filter pyplot's antialiasing applied when downsampling'''
+    from scipy import sparse # only loaded once a frame is rendered
+    scale = n_out / float(n_in)
+    radius = int(np.ceil(1. / scale)) + 1
+    rows, cols, vals = [], [], []
+    for i in range(n_out):
+        center = (i + 0.5) / scale - 0.5
+        j = np.arange(max(0, int(center) - radius), min(n_in, int(center) + radius + 1))
+        x = (j - center) * scale
+        w = np.where(np.abs(x) < 1., 0.5 + 0.5 * np.cos(np.pi * x), 0.)
+        keep = w > 0
+        rows.extend([i] * int(keep.sum()))
+        cols.extend(j[keep])
+        vals.extend(w[keep] / w[keep].sum())
+    return sparse.csr_matrix((np.array(vals, dtype=np.float32), (rows, cols)), shape=(n_out, n_in))
+
+def get_extent(weights):
+    '''returns the first and last column of each row of the csr weights'''
+    first = np.array([weights.indices[a:b].min() for a, b in zip(weights.indptr[:-1], weights.indptr[1:])])
+    last = np.array([weights.indices[a:b].max() for a, b in zip(weights.indptr[:-1], weights.indptr[1:])])
+    return first, last
+
+def make_lut(cmap=None, n=256):
+    '''returns an (n, 3) uint8 lookup table for the colormap (gist_gray by default, which is a linear ramp)'''
+    if cmap is None:
+        ramp = np.arange(n, dtype=np.uint8)
+        return np.stack((ramp, ramp, ramp), axis=1)
+    return (cmap(np.linspace(0., 1., n))[:, :3] * 255).astype(np.uint8)
+
+class glyph_atlas:
+    '''pre-rendered glyph masks, so stamping a date is just array copies'''
+    def __init__(self, chars='0123456789-', size=FONT_SIZE):
+        font = load_font(size)
+        ascent, descent = font.getmetrics()
+        self.ascent = ascent
+        self.height = ascent + descent
+        self.glyphs = {}
+        for c in chars:
+            self.glyphs[c] = self.render_glyph(font, c)
+
+    def render_glyph(self, font, c):
+        width = max(1, int(round(font.getlength(c))))
+        img = Image.new('L', (width, self.height), 0)
+        ImageDraw.Draw(img).text((0, self.ascent), c, fill=255, font=font, anchor='ls')
+        return np.asarray(img)
+
+    def get(self, text):
+        '''returns the alpha mask of the text, with the baseline at row self.ascent'''
+        return np.hstack([self.glyphs[c] for c in text])
+
+class renderer:
+    '''maps arrays of a fixed shape to png frames through a precomputed lookup table'''
+    def __init__(self, shape, clim, overview=None, cmap=None, levels=4096):
+        self.shape = shape
+        self.out_shape = get_output_shape(shape)
+        self.clim = clim
+        # quantize the clim range into levels bins and look each bin's color up
+        self.levels = levels
+        lut = make_lut(cmap)
+        idx = np.minimum((np.arange(levels) * len(lut)) // levels, len(lut) - 1)
+        self.lut = lut[idx]
+        self.gray = bool((self.lut == self.lut[:, :1]).all()) # only one channel needs resampling
+        self.rows = resample_weights(shape[0], self.out_shape[0])
+        self.cols = resample_weights(shape[1], self.out_shape[1]).T.tocsc()
+        # the first and last input row (column) each output row (column) is filtered from, nondecreasing
+        self.row_first, self.row_last = get_extent(self.rows)
+        self.col_first, self.col_last = get_extent(self.cols.T.tocsr())
+        self.overview = None
+        if overview is not None:
+            self.overview = self.prepare_overview(overview)
+        self.atlas = glyph_atlas()
+
+    def prepare_overview(self, overview):
+        '''decodes and resizes the overview once, returns (premultiplied rgb, 255 - alpha) as uint16'''
+        if isinstance(overview, str):
+            img = Image.open(overview).convert('RGBA')
+        else:
+            overview = np.asarray(overview)
+            if overview.dtype != np.uint8:
+                overview = (overview * 255).round().astype(np.uint8)
+            if overview.shape[2] == 3:
+                overview = np.dstack((overview, np.full(overview.shape[:2], 255, dtype=np.uint8)))
+            img = Image.fromarray(overview, 'RGBA')
+        img = img.resize((self.out_shape[1], self.out_shape[0]), Image.NEAREST)
+        rgba = np.asarray(img).astype(np.uint16)
+        alpha = rgba[:, :, 3:4]
+        return rgba[:, :, :3] * alpha, 255 - alpha
+
+    def to_index(self, arr, clim=None):
+        '''returns the lookup table index of each pixel, masked/nan pixels map to the lowest level'''
+        if clim is None:
+            clim = self.clim
+        data = np.ma.getdata(arr).astype(np.float32)
+        data -= clim[0]
+        data *= self.levels / float(abs(clim[1] - clim[0]))
+        np.nan_to_num(data, copy=False, nan=0., posinf=self.levels - 1, neginf=0.)
+        np.clip(data, 0, self.levels - 1, out=data)
+        idx = data.astype(np.uint16)
+        mask = np.ma.getmask(arr)
+        if mask is not np.ma.nomask:
+            idx[mask] = 0
+        return idx
+
+    def render(self, arr, date=None, clim=None):
+        '''returns the frame as a (rows, cols, 3) uint8 array, clim overrides the renderer's clim'''
+        idx = self.to_index(arr, clim)
+        if self.gray:
+            frame = np.repeat(self.resample(self.lut[:, 0][idx])[:, :, None], 3, axis=2)
+        else:
+            frame = np.dstack([self.resample(self.lut[:, i][idx]) for i in range(3)])
+        return self.finish(frame, date)
+
+    def render_tiles(self, tiles, date=None, clim=None):
+        '''renders a frame from (row_off, col_off, array) tiles covering the full shape in row major order (as
+        mean_and_match.get_windows makes them), without holding the full array. the resampling is linear, so each tile
+        is resampled into just the output pixels it touches, accumulated over a band of output rows. the band's rows are
+        quantized into the frame once every tile they depend on is done, so memory is the tile and the band, not the AOI'''
+        channels = 1 if self.gray else 3
+        frame = np.empty(self.out_shape + (channels,), dtype=np.uint8)
+        band, top = np.zeros((0, self.out_shape[1], channels), dtype=np.float32), 0 # float rows top to top + len(band)
+        for r, c, tile in tiles:
+            h, w = tile.shape
+            o0, o1 = np.searchsorted(self.row_last, r), np.searchsorted(self.row_first, r + h)
+            p0, p1 = np.searchsorted(self.col_last, c), np.searchsorted(self.col_first, c + w)
+            if o1 > top + len(band):
+                # the rows before o0 only depend on input rows before r, which every earlier tile covered
+                self.quantize(band[:o0 - top], frame[top:o0])
+                band = np.concatenate((band[o0 - top:], np.zeros((o1 - top - len(band), self.out_shape[1], channels), dtype=np.float32)))
+                top = o0
+            idx = self.to_index(tile, clim)
+            rows = self.rows[o0:o1, r:r + h]
+            cols = self.cols[c:c + w, p0:p1]
+            for i in range(channels):
+                band[o0 - top:o1 - top, p0:p1, i] += rows @ (self.lut[:, i][idx].astype(np.float32) @ cols)
+        self.quantize(band, frame[top:top + len(band)])
+        if self.gray and self.overview is not None:
+            frame = np.repeat(frame, 3, axis=2) # single channel frames are written as is
+        return self.finish(frame, date)
+
+    def quantize(self, band, out):
+        np.rint(band, out=band)
+        np.clip(band, 0, 255, out=band)
+        out[:] = band
+
+    def finish(self, frame, date=None):
+        '''overlays the overview and stamps the date on the resampled frame'''
+        if self.overview is not None:
+            premult, inv_alpha = self.overview
+            blended = frame * inv_alpha
+            blended += premult
+            blended += 127
+            blended //= 255
+            frame = blended.astype(np.uint8)
+        if date is not None:
+            self.stamp(frame, date.strftime('%Y-%m-%d'))
+        return frame
+
+    def resample(self, channel):
+        '''downsamples a uint8 channel to the output shape'''
+        out = (self.cols.T @ (self.rows @ channel.astype(np.float32)).T).T
+        return np.clip(np.rint(out), 0, 255).astype(np.uint8)
+
+    def stamp(self, frame, text):
+        '''draws white text on a black box in the lower left corner, as pyplot did'''
+        mask = self.atlas.get(text)
+        rows, cols = frame.shape[:2]
+        text_left = TEXT_LEFT
+        box_right = min(cols, text_left + mask.shape[1] + TEXT_LEFT - BOX_LEFT)
+        box_top = max(0, rows - BOX_TOP)
+        frame[box_top:, BOX_LEFT:box_right] = 0
+        # place the mask so its baseline sits BASELINE pixels above the bottom edge, clipped to the frame
+        top = rows - BASELINE - self.atlas.ascent
+        y0, y1 = max(top, 0), min(top + mask.shape[0], rows)
+        x1 = min(text_left + mask.shape[1], cols)
+        if y1 <= y0 or x1 <= text_left:
+            return
+        glyphs = mask[y0 - top:y1 - top, :x1 - text_left]
+        frame[y0:y1, text_left:x1] = glyphs[:, :, None]
+
+    def save(self, arr, filename, date=None, clim=None):
+        self.write(self.render(arr, date=date, clim=clim), filename)
+
+    def save_tiles(self, tiles, filename, date=None, clim=None):
+        self.write(self.render_tiles(tiles, date=date, clim=clim), filename)
+
+    def write(self, frame, filename):
+        if self.gray and self.overview is None:
+            # every channel is the same, a single channel png encodes a third of the data
+            img = Image.fromarray(np.ascontiguousarray(frame[:, :, 0]), 'L')
+        else:
+            img = Image.fromarray(frame, 'RGB')
+        # written aside and renamed, so a frame is never seen half written (e.g. by generate_timelapse --follow)
+        tmp = '{}.tmp'.format(filename)
+        img.save(tmp, format='png', compress_level=COMPRESS_LEVEL)
+        os.replace(tmp, filename)
+
+_renderers = {}
+
+def get_renderer(shape, clim, overview=None):
+    '''returns a cached renderer, so the lookup table, overview and glyphs are only prepared once per run.
+    the renderer is shared across clims, so pass the clim to save/render as well'''
+    key = (tuple(shape), overview if isinstance(overview, str) else id(overview))
+    if key not in _renderers:
+        _renderers[key] = renderer(shape, clim, overview=overview)
+    return _renderers[key]
+
+_attached = {} # shared memory name: (handle, frames), in the worker processes
+
+def _render_slot(name, frames_shape, index, filename, date, clim, overview):
+    '''renders slot index of the shared frames in a worker process, returns the index so the slot can be reused'''
+    if name not in _attached:
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = (shm, np.ndarray(frames_shape, dtype=np.float32, buffer=shm.buf))
+    arr = _attached[name][1][index]
+    with metrics.measure('render', os.path.basename(filename)):
+        get_renderer(arr.shape, clim, overview=overview).save(arr, filename, date=date, clim=clim)
+    return index
+
+class frame_pool:
+    '''renders and encodes frames on worker processes. frames are copied into slots of a shared memory block rather than
+    pickled, submit blocks while every slot is still being rendered. the overview should be a path so each worker decodes it.
+    each slot is a full size float32 frame, by default one per worker and one more being filled, so the pool costs
+    (workers + 1) * rows * cols * 4 bytes of shared memory on top of the compositing'''
+    def __init__(self, shape, overview=None, workers=WORKERS, slots=None):
+        self.shape = tuple(shape)
+        self.overview = overview
+        self.slots = slots or workers + 1
+        self.frames_shape = (self.slots,) + self.shape
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.frames_shape)) * 4)
+        self.frames = np.ndarray(self.frames_shape, dtype=np.float32, buffer=self.shm.buf)
+        self.free = list(range(self.slots))
+        self.pending = {} # future: slot index
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, arr, filename, date=None, clim=None):
+        '''queues the frame for rendering to filename, masked pixels render as the lowest level'''
+        if not self.free:
+            self.collect(wait(self.pending, return_when=FIRST_COMPLETED).done)
+        index = self.free.pop()
+        frame = self.frames[index]
+        np.copyto(frame, np.ma.getdata(arr))
+        mask = np.ma.getmask(arr)
+        if mask is not np.ma.nomask:
+            frame[mask] = np.nan
+        future = self.executor.submit(_render_slot, self.shm.name, self.frames_shape, index, filename, date, clim, self.overview)
+        self.pending[future] = index
+
+    def collect(self, done):
+        for future in done:
+            self.pending.pop(future)
+            self.free.append(future.result()) # raises any error from the worker
+
+    def close(self):
+        '''waits for the queued frames, then releases the workers and the shared memory'''
+        try:
+            self.collect(wait(self.pending).done)
+        finally:
+            self.executor.shutdown()
+            del self.frames
+            self.shm.close()
+            self.shm.unlink()
@@ -2,75 +2,234 @@
 
 '''Submits job to ASF for RTC SLC and retrieves the data'''
 
-import time
+import os
 import argparse
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from hyp3_sdk import HyP3
-from hyp3_sdk import util
 import track
+import scheduler
+import metrics
+import granules
+import fetch
 
+API_URL='https://hyp3-api.asf.alaska.edu'
+WORKERS=4 # number of concurrent downloads/extractions
+RTC_PARAMS={'dem_matching': True} # processing parameters of the RTC jobs, part of each product's key in the store
+LEGACY_JOB_NAME='job_thwaites_{}' # jobs submitted before the granule store, named by gid
+LISTING_WINDOW=timedelta(days=21) # jobs requested longer ago than this have expired, so they are not listed
 
-def submit():
-    hyp3 = HyP3(api_url='https://hyp3-api.asf.alaska.edu')
+_clients = {}
+
+def get_client(api_url=API_URL, token=None):
+    '''returns a HyP3 client, reused (along with its session) for the whole run'''
+    if api_url not in _clients:
+        if token is None:
+            _clients[api_url] = HyP3(api_url=api_url)
+        else:
+            _clients[api_url] = HyP3(api_url=api_url, token=token)
+    return _clients[api_url]
+
+def get_job_names(t):
+    '''returns {job name: granule} of the run's submitted granules, under the store's and the legacy job names'''
+    names = {}
+    for gran in t.submitted_granules:
+        names[granules.get_job_name(gran.name, RTC_PARAMS)] = gran
+        names[LEGACY_JOB_NAME.format(gran.gid)] = gran
+    return names
+
+@metrics.timed('retrieve_data')
+def sync_jobs(hyp3, names=None, window=LISTING_WINDOW):
+    '''lists the jobs requested within the window once and classifies them locally, keeping only the named jobs if
+    names are given. returns {status_code: [jobs]}'''
+    status = {'SUCCEEDED': [], 'RUNNING': [], 'PENDING': [], 'FAILED': []}
+    for job in hyp3.find_jobs(start=datetime.now(timezone.utc) - window):
+        if names is None or job.name in names:
+            status.setdefault(job.status_code, []).append(job)
+    return status
+
+@metrics.timed('retrieve_data')
+def submit(t, hyp3, store, include=fetch.INCLUDE):
     granule_names = t.submit_these()
     if len(granule_names) == 0:
         print('nothing allowable to submit...')
     else:
         print('submitting {} jobs...'.format(len(granule_names)))
 
-    for gran in granule_names:
-        job_name = 'job_thwaites_{}'.format(gran[-4:])
+    # only the granules no other run has submitted (or retrieved) are submitted, the rest are linked once local
+    claimed = store.acquire(t.output_dir, granule_names, RTC_PARAMS, include=include)
+    if len(claimed) < len(granule_names):
+        print('{} already submitted or retrieved by other runs'.format(len(granule_names) - len(claimed)))
+    prepared = []
+    for gran in claimed:
+        job_name = granules.get_job_name(gran, RTC_PARAMS)
         print('submitting {} as {}'.format(gran, job_name))
-        #job = hyp3.submit_rtc_job(granule=gran, name=job_name, resolution=90, radiometry='gamma0', dem_name='copernicus', dem_matching=True)
-        job = hyp3.submit_rtc_job(granule=gran, name=job_name, dem_matching=True)
+        #job = hyp3.prepare_rtc_job(granule=gran, name=job_name, resolution=90, radiometry='gamma0', dem_name='copernicus', dem_matching=True)
+        prepared.append(hyp3.prepare_rtc_job(granule=gran, name=job_name, **RTC_PARAMS))
+    if prepared:
+        # one request for the whole batch
+        try:
+            batch = hyp3.submit_prepared_jobs(prepared)
+        except Exception:
+            store.abandon(claimed, RTC_PARAMS)
+            raise
+        # recorded before anything else can fail, so the jobs (and their quota) are never submitted twice
+        store.submitted(claimed, RTC_PARAMS)
+        for gran in claimed:
+            t.submit(gran)
+        t.commit()
+        print('submitted job info: {}'.format(batch))
+    for gran in granule_names:
         t.submit(gran)
+    if granule_names:
         t.print_status()
-        print('submitted job info: {}'.format(job))
-        print('submitted job: {}'.format(job_name))
+    t.commit()
+
+def resubmit_failed(t, status, store):
+    '''returns the submitted granules whose every job failed or expired to unsubmitted, so this cycle submits them
+    again. otherwise they stay submitted and the run waits on them forever. granules without any job in the listing
+    window expired before it'''
+    names = get_job_names(t)
+    live = set()
+    for code, jobs in status.items():
+        for job in jobs:
+            if job.name in names and not (code == 'FAILED' or (code == 'SUCCEEDED' and job.expired())):
+                live.add(names[job.name].name)
+    failed = sorted(set(gran.name for gran in names.values()) - live)
+    if not failed:
+        return []
+    # another run may have resubmitted them already, then this run waits on its job
+    claimable = store.reset(failed, RTC_PARAMS)
+    for name in claimable:
+        print('{} failed or expired, submitting it again'.format(name))
+        t.unsubmit(name)
+    t.commit()
+    return claimable
+
+def retrieve(job, location, include=fetch.INCLUDE):
+    '''extracts the included members of the job's product zips into location, without downloading the rest.
+    returns (the product folders, the fetch stats summed over the files)'''
+    with metrics.measure('retrieve_data', job.name, scope='thread', job_id=job.job_id) as m:
+        if job.request_time is not None:
+            # from the request to ASF until the product is local: queueing, processing and the download
+            m['asf_seconds'] = (datetime.now(job.request_time.tzinfo) - job.request_time).total_seconds()
+        if job.expired():
+            raise Exception('{} expired at {}'.format(job.name, job.expiration_time))
+        session = fetch.get_session()
+        paths, totals = [], {}
+        try:
+            for fil in job.files:
+                stats = fetch.fetch(fil['url'], location, include=include, expected_size=fil.get('size'), session=session, desc=fil['filename'])
+                for k, v in stats.items():
+                    totals[k] = totals.get(k, 0) + v
+                paths.append(os.path.join(location, os.path.splitext(fil['filename'])[0]))
+        finally:
+            session.close()
+        for k in ('downloaded_bytes', 'written_bytes', 'saved_bytes'):
+            m[k] = totals.get(k, 0)
+        return paths, totals
+
+def retrieve_all(jobs, store, workers=WORKERS, callback=None):
+    '''downloads and extracts the (job, key) pairs, claimed in the store, on a bounded thread pool, with the files every
+    run referencing them needs. each product is moved into the store and linked into the runs referencing it as it
+    finishes, then callback(job) is called'''
+    extracted = []
+    if not jobs:
+        return extracted
+    totals = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for job, key in jobs:
+            include = store.get_include(key)
+            futures[pool.submit(retrieve, job, store.get_partial_dir(key), include)] = (job, key, include)
+        for future in as_completed(futures):
+            job, key, include = futures[future]
+            try:
+                paths, stats = future.result()
+                extracted.extend(store.finished(key, paths, include=include or ['*']))
+                for k, v in stats.items():
+                    totals[k] = totals.get(k, 0) + v
+                if callback is not None:
+                    callback(job)
+            except Exception as e:
+                store.failed(key)
+                print('failed to retrieve {}: {}'.format(job.name, e))
+    print_savings(totals)
+    return extracted
+
+def print_savings(totals):
+    '''reports the network and disk io saved by extracting only the included members'''
+    if not totals.get('archive_bytes'):
+        return
+    mb = 1024. * 1024.
+    print('downloaded {:.1f} of {:.1f}MB of product zips, wrote {:.1f}MB for {} of {} files ({:.1f}MB less than extracting the whole zips)'.format(
+        totals['downloaded_bytes'] / mb, totals['archive_bytes'] / mb, totals['written_bytes'] / mb, totals['members'],
+        totals['members'] + totals['skipped'], totals['saved_bytes'] / mb))
+
+def claim_downloads(jobs, store):
+    '''returns the (job, key) pairs this run claimed the download of, the rest are local or downloading elsewhere'''
+    claimed = [(job, key) for job, key in jobs if store.claim_download(key)]
+    if len(claimed) < len(jobs):
+        print('{} retrieved or being retrieved by other runs'.format(len(jobs) - len(claimed)))
+    return claimed
 
-def check_and_retrieve():
-    hyp3 = HyP3(api_url='https://hyp3-api.asf.alaska.edu')
-    #jobs = hyp3.find_jobs()
-    jobs = t.get_submitted_job_names()
+def check_and_retrieve(t, status, store, workers=WORKERS, callback=None):
+    '''downloads any succeeded jobs of the granules we submitted, from the classified job listing'''
     print('checking jobs...')
-    #succeeded_jobs = hyp3.find_jobs(status_code='SUCCEEDED')
-    #print(succeeded_jobs)
-    for jname in jobs:
-        job = hyp3.find_jobs(status_code='SUCCEEDED', name=jname)
-        if job:
-            print('{} status is : {}'.format(jname, job))
-            paths = job.download_files(location='/products/RTC/', create=True)
-            for path in paths:
-                util.extract_zipped_product(path, delete=True)
-
-def just_download_available():
-    hyp3 = HyP3(api_url='https://hyp3-api.asf.alaska.edu')
-
-        #job = hyp3.get_job_by_id(jname)
-        #success = job.filter_jobs(succeeded=True, running=False, failed=False, include_expired=False)
-        #print('success:'.format(success))
-        # success.download_files(location='/products/RTC/', create=True)
-        #print(job)
-
-    #succeeded_jobs = jobs.filter_jobs(succeeded=True, running=False, failed=False, include_expired=False)
-    succeeded_jobs = hyp3.find_jobs(status_code='SUCCEEDED')
+    names = {name: granules.get_key(gran.name, RTC_PARAMS) for name, gran in get_job_names(t).items()}
+    ready = {}
+    for job in status.get('SUCCEEDED', []):
+        if job.name in names and names[job.name] not in ready and not job.expired():
+            ready[names[job.name]] = job
+    for job in ready.values():
+        print('{} status is : {}'.format(job.name, job))
+    jobs = claim_downloads([(job, key) for key, job in ready.items()], store)
+    return retrieve_all(jobs, store, workers=workers, callback=callback)
+
+def just_download_available(hyp3, store, folder, workers=WORKERS):
+    '''downloads the succeeded jobs of the products the RTC folder references, not every job on the account'''
+    wanted = store.job_names(folder)
+    succeeded_jobs = [job for job in hyp3.find_jobs(status_code='SUCCEEDED') if job.name in wanted and not job.expired()]
     if len(succeeded_jobs) > 0:
         print('found completed jobs!')
-        paths = succeeded_jobs.download_files(location='/products/RTC/', create=True)
-        for path in paths:
-            util.extract_zipped_product(path, delete=True)
-
-def print_ASF():
-    hyp3 = HyP3(api_url='https://hyp3-api.asf.alaska.edu')
-    suc = hyp3.find_jobs(status_code='SUCCEEDED')
-    run = hyp3.find_jobs(status_code='RUNNING')
-    fail = hyp3.find_jobs(status_code='FAILED')
-    pend = hyp3.find_jobs(status_code='PENDING')
+        retrieve_all(claim_downloads([(job, wanted[job.name]) for job in succeeded_jobs], store), store, workers=workers)
+
+def print_ASF(status):
+    suc = status.get('SUCCEEDED', [])
+    run = status.get('RUNNING', [])
+    fail = status.get('FAILED', [])
+    pend = status.get('PENDING', [])
     print('::ASF::\n succeeded: {}\n' \
                    ' running:   {}\n' \
                    ' pending:   {}\n' \
                    ' failed:    {}'.format(len(suc), len(run), len(pend), len(fail)))
 
+def main(shapefile, start=False, end=False, relativeorbit=False, output_dir=track.RTC_PATH, store_path=granules.STORE_PATH,
+         api_url=API_URL, workers=WORKERS, include=fetch.INCLUDE, min_interval=scheduler.MIN_INTERVAL, max_interval=scheduler.MAX_INTERVAL):
+    '''submits and retrieves every granule of the query, polling until all of them are local. returns the track'''
+    t = track.track(shapefile, start_date=start, end_date=end, relativeorbit=relativeorbit, output_dir=output_dir)
+    store = granules.store(store_path)
+    # granules submitted before the store existed are recorded without claiming them
+    store.acquire(t.output_dir, [g.name for g in t.submitted_granules], RTC_PARAMS, state=granules.SUBMITTED, include=include)
+    hyp3 = get_client(api_url)
+    sched = scheduler.scheduler(min_interval=min_interval, max_interval=max_interval)
+    while not t.is_done():
+        store.link(t.output_dir) # products other runs retrieved since the last cycle
+        t.refresh()
+        status = sync_jobs(hyp3, names=get_job_names(t)) # this run's jobs, so the backoff follows them
+        sched.observe(status)
+        if check_and_retrieve(t, status, store, workers=workers, callback=sched.retrieved):
+            t.refresh() # retrieved granules free up slots for this cycle's submissions
+        resubmit_failed(t, status, store)
+        submit(t, hyp3, store, include=include)
+        t.print_status()
+        print_ASF(status)
+        sched.print_latency()
+        if t.is_done():
+            break
+        sched.wait(status, track.ALLOWABLE - len(t.granules.submitted), t.granules.count_unsubmitted())
+    return t
+
 def parser():
     '''
     Construct a parser to parse arguments, returns the parser
@@ -80,19 +239,20 @@ def parser():
     parse.add_argument("--start", required=False, default=False, help="start date")
     parse.add_argument("--end", required=False, default=False, help="end date")
     parse.add_argument("--relativeorbit", required=False, default=False, help="relative orbit")
+    parse.add_argument("--workers", required=False, default=WORKERS, type=int, help="number of concurrent downloads")
+    parse.add_argument("--include", required=False, default=','.join(fetch.INCLUDE), help="comma separated file name patterns of the product files to extract ('*' for all)")
+    parse.add_argument("--output-dir", required=False, default=track.RTC_PATH, help="RTC folder of this run, the retrieved products are linked into it")
+    parse.add_argument("--store", required=False, default=granules.STORE_PATH, help="granule store shared with concurrent runs")
+    parse.add_argument("--api-url", required=False, default=API_URL, help="HyP3 API url")
+    parse.add_argument("--min-interval", required=False, default=scheduler.MIN_INTERVAL, type=float, help="shortest time between polls (s)")
+    parse.add_argument("--max-interval", required=False, default=scheduler.MAX_INTERVAL, type=float, help="longest time between polls (s)")
     return parse
 
 
 if __name__ == '__main__':
 
     args = parser().parse_args()
-    t = track.track(args.shapefile, start_date=args.start, end_date=args.end, relativeorbit=args.relativeorbit)
-    while not t.is_done():
-        t.refresh()
-        check_and_retrieve()
-        submit()
-        t.refresh()
-        t.print_status()
-        print_ASF()
-        time.sleep(120)
-
+    with metrics.measure('retrieve_data'):
+        main(args.shapefile, start=args.start, end=args.end, relativeorbit=args.relativeorbit, output_dir=args.output_dir,
+             store_path=args.store, api_url=args.api_url, workers=args.workers, include=args.include.split(','),
+             min_interval=args.min_interval, max_interval=args.max_interval)
@@ -4,17 +4,9 @@ set -e
 set -x
 
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" &> /dev/null && pwd )"
-source ${SCRIPT_DIR}/configs
 
-if [ ! -f "${SHAPEFILE_PATH}" ]; then
-    SHAPEFILE_PATH="${SCRIPT_DIR}/shapefiles/test.shp"
-fi
-
-${SCRIPT_DIR}/retrieve_data.py --shapefile ${SHAPEFILE_PATH} --start ${START_DATE} --end ${END_DATE} --relativeorbit ${RELATIVE_ORBIT}
-${SCRIPT_DIR}/move.py
-${SCRIPT_DIR}/project_and_crop.sh
-${SCRIPT_DIR}/mean_and_match.py
-${SCRIPT_DIR}/generate_timelapse.py
+# the configs (and the shapefile fallback) are read by pipeline.py, which skips the stages whose inputs are unchanged
+python3 ${SCRIPT_DIR}/pipeline.py "$@"
 
 #rm -rf /products/matched
 #rm -rf /products/timelapse
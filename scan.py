@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+'''persistent cache of the local RTC product directories and the original SAFE names parsed from their log files'''
+
+import os
+import re
+import json
+
+S1_REGEX='^S1.*_([a-zA-Z0-9]{4}).+?$'
+LOG_REGEX = "^.*SAFE directory[ ]*: (S1.*\.SAFE)"
+CACHE_FILENAME='.scan-cache.json'
+
+def parse_log(path):
+    '''looks at the log file to determine the original file name'''
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        for line in f:
+            match = re.match(LOG_REGEX, line)
+            if match:
+                return match.group(1)
+    return None
+
+class scanner:
+    def __init__(self, inpath='/products/RTC'):
+        self.inpath = inpath
+        self.cache_file = os.path.join(inpath, CACHE_FILENAME)
+        self.cache = self.load() # dirname: [mtime, original name]
+
+    def load(self):
+        if not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            return {} # corrupt cache, rescan everything
+
+    def save(self):
+        '''writes the cache atomically so track and move can share it'''
+        tmp = '{}.{}.tmp'.format(self.cache_file, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.cache, f)
+        os.replace(tmp, self.cache_file)
+
+    def scan(self):
+        '''returns {dirname: original SAFE name}, only parsing log files of new or modified product directories'''
+        if not os.path.exists(self.inpath):
+            return {}
+        self.cache = self.load() # pick up entries written by other processes
+        changed = False
+        seen = set()
+        with os.scandir(self.inpath) as entries:
+            for entry in entries:
+                if not re.match(S1_REGEX, entry.name) or entry.name.endswith('.zip') or not entry.is_dir():
+                    continue
+                seen.add(entry.name)
+                mtime = entry.stat().st_mtime
+                cached = self.cache.get(entry.name)
+                if cached is not None and cached[0] == mtime:
+                    continue
+                name = parse_log(os.path.join(entry.path, '{}.log'.format(entry.name)))
+                self.cache[entry.name] = [mtime, name]
+                changed = True
+        for fil in set(self.cache) - seen:
+            del self.cache[fil]
+            changed = True
+        if changed:
+            self.save()
+        return {fil: name for fil, (mtime, name) in self.cache.items() if name is not None}
+
+    def get_original_name(self, fil):
+        '''returns the original SAFE name for the product directory'''
+        entry = self.cache.get(fil)
+        if entry is None or entry[1] is None:
+            self.scan()
+            entry = self.cache.get(fil)
+        if entry is None:
+            return None
+        return entry[1]
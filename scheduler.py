@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+'''adapts the retrieve_data poll interval to the state of the ASF queue and records retrieval latency'''
+
+import time
+
+MIN_INTERVAL=15 # seconds, used when jobs are running or there is work to do right away
+MAX_INTERVAL=900 # seconds, ceiling of the backoff while everything is pending
+START_INTERVAL=120
+BACKOFF=2.
+
+class scheduler:
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, start_interval=START_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = start_interval
+        self.last_poll = None
+        self.first_seen = {} # job_id: (time first seen SUCCEEDED, seconds since the poll before it)
+        self.latencies = [] # (job name, observed seconds, upper bound seconds)
+
+    def observe(self, status):
+        '''notes when each job was first seen as succeeded, call once per poll with the classified job listing'''
+        now = time.time()
+        since_last = 0. if self.last_poll is None else now - self.last_poll
+        self.last_poll = now
+        for job in status.get('SUCCEEDED', []):
+            if job.job_id not in self.first_seen:
+                self.first_seen[job.job_id] = (now, since_last)
+
+    def retrieved(self, job):
+        '''records the latency from job completion to local availability'''
+        seen = self.first_seen.get(job.job_id)
+        if seen is None:
+            return
+        observed = time.time() - seen[0]
+        # the job finished at some point between the previous poll and the one that saw it
+        self.latencies.append((job.name, observed, observed + seen[1]))
+
+    def next_interval(self, status, free_slots, unsubmitted):
+        '''returns how long to sleep before the next poll'''
+        if free_slots > 0 and unsubmitted > 0:
+            # a slot is open and there is something to submit
+            self.interval = self.min_interval
+        elif status.get('RUNNING'):
+            # jobs are close to completion, poll fast so they are downloaded as soon as they finish
+            self.interval = self.min_interval
+        elif status.get('PENDING'):
+            # everything is waiting in the queue, back off
+            self.interval = min(self.max_interval, max(self.min_interval, self.interval * BACKOFF))
+        else:
+            self.interval = self.min_interval
+        return self.interval
+
+    def wait(self, status, free_slots, unsubmitted):
+        interval = self.next_interval(status, free_slots, unsubmitted)
+        print('next poll in {:.1f}s'.format(interval))
+        time.sleep(interval)
+
+    def print_latency(self):
+        if not self.latencies:
+            return
+        observed = sorted(l[1] for l in self.latencies)
+        bound = sorted(l[2] for l in self.latencies)
+        print('::LATENCY:: (job completion to local availability)\n' \
+              ' retrieved: {}\n' \
+              ' median:    {:.0f}s (at most {:.0f}s)\n' \
+              ' max:       {:.0f}s (at most {:.0f}s)'.format(len(observed), observed[len(observed) // 2], bound[len(bound) // 2], observed[-1], bound[-1]))
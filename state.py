@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+'''sqlite backed record of submitted/retrieved granules, replaces submitted.pkl'''
+
+import os
+import time
+import pickle
+import sqlite3
+
+SUBMITTED='submitted'
+LOCAL='local'
+FAILED='failed' # the job failed or expired, submitted again
+
+class store:
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS granules (gid TEXT PRIMARY KEY, name TEXT NOT NULL, state TEXT NOT NULL, cycle INTEGER NOT NULL, updated REAL NOT NULL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS granules_cycle ON granules (cycle)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS granules_state ON granules (state)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.pending = {} # gid: (name, state), written on commit()
+
+    def get_cycle(self):
+        '''returns the cycle number of the last commit'''
+        row = self.conn.execute("SELECT value FROM meta WHERE key='cycle'").fetchone()
+        return int(row[0]) if row else 0
+
+    def set_state(self, name, gid, state):
+        '''queues a state change, nothing is written until commit()'''
+        self.pending[gid] = (name, state)
+
+    def commit(self):
+        '''writes all queued state changes in one transaction as a new cycle. returns the cycle number'''
+        if not self.pending:
+            return self.get_cycle()
+        now = time.time()
+        with self.conn:
+            cycle = self.get_cycle() + 1
+            self.conn.executemany('INSERT INTO granules (gid, name, state, cycle, updated) VALUES (?, ?, ?, ?, ?) '
+                                  'ON CONFLICT(gid) DO UPDATE SET name=excluded.name, state=excluded.state, '
+                                  'cycle=excluded.cycle, updated=excluded.updated',
+                                  [(gid, name, st, cycle, now) for gid, (name, st) in self.pending.items()])
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('cycle', ?)", (str(cycle),))
+        self.pending = {}
+        return cycle
+
+    def get(self, state):
+        '''returns a list of (name, gid) in the given state'''
+        rows = self.conn.execute('SELECT name, gid FROM granules WHERE state=? ORDER BY rowid', (state,))
+        return [(name, gid) for name, gid in rows]
+
+    def changed_since(self, cycle):
+        '''returns a list of (name, gid, state) that changed in any cycle after the given one'''
+        rows = self.conn.execute('SELECT name, gid, state FROM granules WHERE cycle > ? ORDER BY cycle, rowid', (cycle,))
+        return list(rows)
+
+    def is_empty(self):
+        return self.conn.execute('SELECT 1 FROM granules LIMIT 1').fetchone() is None
+
+    def migrate_pkl(self, pkl_path):
+        '''imports the granules from a legacy submitted.pkl, then renames it so it is only migrated once'''
+        with open(pkl_path, 'rb') as f:
+            grans = pickle.load(f)
+        for gran in grans:
+            self.set_state(gran.name, gran.gid, SUBMITTED)
+        self.commit()
+        os.rename(pkl_path, pkl_path + '.migrated')
+        return len(grans)
+
+    def close(self):
+        self.conn.close()
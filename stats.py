@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+'''single pass, bounded memory statistics over the warped scenes: running mean/variance and fixed-bin histograms,
+from which global and per-scene percentile clims are derived'''
+
+import numpy as np
+
+BINS=4096
+VMAX=5. # histogram upper edge, gamma0 backscatter above this lands in the last bin
+
+class accumulator:
+    def __init__(self, bins=BINS, vmax=VMAX, per_pixel=False):
+        self.bins = bins
+        self.vmax = vmax
+        self.width = vmax / float(bins)
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0. # sum of squared deviations from the mean
+        self.hist = np.zeros(bins, dtype=np.int64)
+        self.scene_hists = {} # key: histogram
+        self.per_pixel = per_pixel
+        self.total = None # per pixel sum & count, only kept if per_pixel
+        self.pixel_count = None
+
+    def add(self, arr, key=None):
+        '''adds the valid (unmasked, finite) pixels of arr, and to the histogram of the scene key if given'''
+        data = np.ma.getdata(arr)
+        valid = ~np.ma.getmaskarray(arr) & np.isfinite(data)
+        values = data[valid]
+        n = values.size
+        if self.per_pixel:
+            if self.total is None:
+                self.total = np.zeros(data.shape, dtype=np.float64)
+                self.pixel_count = np.zeros(data.shape, dtype=np.uint32)
+            np.add(self.total, data, out=self.total, where=valid)
+            self.pixel_count += valid
+        if n == 0:
+            return
+        # merge this scene's mean/variance into the running totals (Chan et al.)
+        mean = float(values.mean(dtype=np.float64))
+        m2 = float(np.square(values - mean, dtype=np.float64).sum())
+        delta = mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+        idx = (values * (1. / self.width)).astype(np.int64)
+        np.clip(idx, 0, self.bins - 1, out=idx)
+        hist = np.bincount(idx, minlength=self.bins)
+        self.hist += hist
+        if key is not None:
+            if key in self.scene_hists:
+                self.scene_hists[key] += hist
+            else:
+                self.scene_hists[key] = hist
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def percentile(self, q, key=None):
+        '''returns the q-th percentile (0-100), interpolated within the histogram bin. a scene key without any valid
+        pixels (e.g. scenes outside the cropped bounds) falls back to the histogram of all scenes'''
+        hist = self.scene_hists.get(key, self.hist) if key is not None else self.hist
+        cdf = np.cumsum(hist)
+        if cdf[-1] == 0:
+            return 0.
+        target = q / 100. * cdf[-1]
+        i = int(np.searchsorted(cdf, target, side='left'))
+        i = min(i, self.bins - 1)
+        below = cdf[i - 1] if i > 0 else 0
+        frac = (target - below) / float(hist[i]) if hist[i] else 0.
+        return float((i + frac) * self.width)
+
+    def clim(self, prange, key=None):
+        '''returns the (min, max) percentile range, globally or for the scene key'''
+        return (self.percentile(prange[0], key=key), self.percentile(prange[1], key=key))
+
+    def mean_image(self):
+        '''returns the per pixel mean over the valid pixels of all scenes (requires per_pixel)'''
+        mean = np.ma.array(self.total, mask=(self.pixel_count == 0))
+        mean /= np.maximum(self.pixel_count, 1)
+        return mean
+
+def scan(files, loader, key=None, per_pixel=False, windows=None):
+    '''one pass over the files, returns the accumulator. key(path) gives the scene key of each file.
+    given (row_off, col_off, rows, cols) windows, each file is read window by window with loader(path, window=...)'''
+    if per_pixel and windows is not None:
+        raise Exception('per pixel statistics need whole scenes, they cannot be accumulated over windows')
+    acc = accumulator(per_pixel=per_pixel)
+    for fil in files:
+        k = None if key is None else key(fil)
+        if windows is None:
+            acc.add(loader(fil), key=k)
+            continue
+        for window in windows:
+            acc.add(loader(fil, window=window), key=k)
+    return acc
@@ -6,16 +6,28 @@ Retrieves Sentinel SLC files
 
 import re
 import os
+import csv
 import json
-import pickle
+import hashlib
+import itertools
+from datetime import datetime, timedelta, timezone
 import dateutil.parser
 import requests
-import geopandas
+import state
+import scan
+import aoi
 
 ALLOWABLE=40 #number to allow on ASF's queue
 S1_REGEX='^S1.*_([a-zA-Z0-9]{4}).+?$'
+DATE_REGEX=r'_([0-9]{8}T[0-9]{6})_'
+DATE_FORMAT='%Y-%m-%dT%H:%M:%S'
+SEARCH_URL='https://api.daac.asf.alaska.edu/services/search/param'
+RTC_PATH='/products/RTC'
+INGEST_LAG=timedelta(days=3) # recent acquisitions can still be added to the catalog, so they are always re-queried
 
 class granule:
+    __slots__ = ('name', 'gid')
+
     def __init__(self, name, gid):
         self.name = name
         self.gid = gid
@@ -23,12 +35,150 @@ class granule:
     def __eq__(self, other):
         return self.gid == other.gid
 
+    def __hash__(self):
+        return hash(self.gid)
+
+    def __getstate__(self):
+        return (self.name, self.gid)
+
+    def __setstate__(self, data):
+        '''handles both the current tuple state and the __dict__ state of older pickles'''
+        if isinstance(data, dict):
+            data = (data.get('name'), data.get('gid'))
+        self.name, self.gid = data
+
+class registry:
+    '''granules indexed by gid and by name, with set based state (unsubmitted -> submitted -> local)'''
+    def __init__(self):
+        self.by_gid = {} # gid: granule, in query order
+        self.by_name = {} # name: granule
+        self.submitted = {} # gid: granule, may include granules outside of the query
+        self.local = set() # gids
+
+    def __len__(self):
+        return len(self.by_gid)
+
+    def __contains__(self, gran):
+        return gran.gid in self.by_gid
+
+    def add(self, gran):
+        '''adds the granule if its gid is not already registered. returns True if it was added'''
+        if gran.gid in self.by_gid:
+            return False
+        self.by_gid[gran.gid] = gran
+        self.by_name[gran.name] = gran
+        return True
+
+    def get_by_gid(self, gid):
+        return self.by_gid.get(gid)
+
+    def get_by_name(self, name):
+        return self.by_name.get(name)
+
+    def mark_submitted(self, gran):
+        self.submitted[gran.gid] = gran
+
+    def mark_unsubmitted(self, gran):
+        self.submitted.pop(gran.gid, None)
+
+    def mark_local(self, gran):
+        '''moves a granule to local, removing it from submitted. returns True if it was submitted'''
+        self.local.add(gran.gid)
+        return self.submitted.pop(gran.gid, None) is not None
+
+    def is_submitted(self, gran):
+        return gran.gid in self.submitted
+
+    def is_local(self, gran):
+        return gran.gid in self.local
+
+    def all(self):
+        return list(self.by_gid.values())
+
+    def local_granules(self):
+        return [self.by_gid[gid] for gid in self.local]
+
+    def submitted_granules(self):
+        return list(self.submitted.values())
+
+    def iter_unsubmitted(self):
+        '''yields granules that are neither submitted or local, in query order'''
+        for gid, gran in self.by_gid.items():
+            if gid not in self.submitted and gid not in self.local:
+                yield gran
+
+    def count_unsubmitted(self):
+        return sum(1 for _ in self.iter_unsubmitted())
+
+class query_cache:
+    '''granule names returned by ASF for one set of search parameters, along with the date range they cover'''
+    def __init__(self, cache_dir, params):
+        self.params = params
+        key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, '{}.json'.format(key))
+        self.start = self.end = None
+        self.names = []
+        self.exists = os.path.exists(self.path)
+        if self.exists:
+            with open(self.path, 'r') as f:
+                cached = json.load(f)
+            self.start, self.end, self.names = cached['start'], cached['end'], cached['names']
+
+    def missing(self, start, end):
+        '''returns the list of (start, end) ranges not covered by the cache. None start is unbounded'''
+        if not self.exists:
+            return [(start, end)]
+        gaps = []
+        if self.start is not None and (start is None or start < self.start):
+            gaps.append((start, self.start))
+        if end > self.end:
+            gaps.append((self.end, end))
+        return gaps
+
+    def extend(self, names, start, end):
+        '''adds the names queried over start-end, keeping the covered range contiguous'''
+        seen = set(self.names)
+        for name in names:
+            if name not in seen:
+                seen.add(name)
+                self.names.append(name)
+        if not self.exists:
+            self.start, self.end = start, end
+            self.exists = True
+        else:
+            self.start = None if (start is None or self.start is None) else min(start, self.start)
+            self.end = max(end, self.end)
+
+    def save(self):
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        tmp = '{}.tmp'.format(self.path)
+        with open(tmp, 'w') as f:
+            json.dump({'params': self.params, 'start': self.start, 'end': self.end, 'names': self.names}, f)
+        os.replace(tmp, self.path)
+
+    def get(self, start, end):
+        '''returns the cached names acquired between start and end'''
+        out = []
+        for name in self.names:
+            acquired = get_acquisition_date(name)
+            if acquired is not None and ((start is not None and acquired < start) or acquired > end):
+                continue
+            out.append(name)
+        return out
+
+def get_acquisition_date(name):
+    '''returns the acquisition start from the granule name in the same format as the query dates'''
+    match = re.search(DATE_REGEX, name)
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), '%Y%m%dT%H%M%S').strftime(DATE_FORMAT)
+
 class track:
-    def __init__(self, shapefile_path, start_date=False, end_date=False, relativeorbit=False):
-        self.output_dir = os.path.join('/products', 'RTC')
-        self.json_file = os.path.join(self.output_dir, 'asf-results.json')
-        if os.path.exists(self.json_file) and not shapefile_path == False:
-            os.remove(self.json_file) # remove any prior run
+    def __init__(self, shapefile_path, start_date=False, end_date=False, relativeorbit=False, output_dir=RTC_PATH):
+        self.output_dir = output_dir
+        self.results_file = os.path.join(self.output_dir, 'asf-results.txt')
+        self.cache_dir = os.path.join(self.output_dir, 'asf-cache')
         # set date/time and shapefile then refresh 
         if not os.path.exists(shapefile_path):
             raise Exception('shapefile path does not exist: {}'.format(shapefile_path))
@@ -37,136 +187,180 @@ class track:
         self.end_date = end_date
         self.relativeorbit = relativeorbit
         if not start_date == False:
-            self.start_date = dateutil.parser.parse(start_date).strftime("%Y-%m-%dT%H:%M:%S")
+            self.start_date = dateutil.parser.parse(start_date).strftime(DATE_FORMAT)
         if not end_date == False:
-            self.end_date = dateutil.parser.parse(end_date).strftime("%Y-%m-%dT%H:%M:%S")
+            self.end_date = dateutil.parser.parse(end_date).strftime(DATE_FORMAT)
+        if not shapefile_path == False:
+            self.search() # resolve this run's query, replacing any prior run's results
         self.refresh() # loads/reloads all the lists
 
+    @property
+    def all_granules(self):
+        return self.granules.all()
+
+    @property
+    def submitted_granules(self):
+        return self.granules.submitted_granules()
+
+    @property
+    def local_granules(self):
+        return self.granules.local_granules()
+
     def refresh(self):
         self.submitted_file = os.path.join(self.output_dir, 'submitted.pkl')
-        self.submitted_granules = []
-        if os.path.exists(self.submitted_file):
-            self.load_pkl()
-        self.all_granules = []
-        self.local_granules = []
-        if not os.path.exists(self.json_file):
-            self.query_asf()
+        self.state_file = os.path.join(self.output_dir, 'state.db')
+        self.granules = registry()
+        self.load_state()
+        if not os.path.exists(self.results_file):
+            self.search()
         # parse out all the files that we want from the asf query
-        self.parse_json()
+        self.parse_results()
         # determine the files we have & correct submitted files
         self.find_local_files()
 
     def get_polygon(self):
-        '''gets the polygon from an input shapefiles'''
-        data = geopandas.read_file(self.shapefile_path)
-        data = data.to_crs(epsg=4326) # epsg used by ASF
-        coords = json.loads(data.exterior.to_json()).get('features',{})[0].get('geometry').get('coordinates')
-        cstring = ','.join(['{} {}'.format(a,b) for a,b in coords])
-        return 'polygon(({}))'.format(cstring)
+        '''gets the polygon from the (cached) shapefile metadata'''
+        return aoi.get_metadata(self.shapefile_path)['polygon']
 
 
-    def query_asf(self):
-        url = 'https://api.daac.asf.alaska.edu/services/search/param?'
-        params = []
+    def get_query_params(self):
+        '''returns the search parameters, excluding the dates'''
         # ADD YOUR QUERY PARAMETERS
-        params.append('platform=S1')
-        params.append('polarization=HH')
-        params.append('processingLevel=SLC')
-        params.append('intersectsWith={}'.format(self.get_polygon()))
+        params = {'platform': 'S1', 'polarization': 'HH', 'processingLevel': 'SLC', 'intersectsWith': self.get_polygon()}
         if not self.relativeorbit == False:
-            params.append('relativeOrbit={}'.format(self.relativeorbit))
-        if not self.start_date == False:
-            params.append("start={}".format(self.start_date))
+            params['relativeOrbit'] = str(self.relativeorbit)
+        return params
+
+    def search(self):
+        '''resolves the query through the local cache, only querying ASF over date ranges that are not cached yet'''
+        cache = query_cache(self.cache_dir, self.get_query_params())
+        start = None if self.start_date == False else self.start_date
+        end = (datetime.now(timezone.utc) - INGEST_LAG).strftime(DATE_FORMAT)
         if not self.end_date == False:
-            params.append("end={}".format(self.end_date))
-        params.append('output=json')
-        query = url + '&'.join(params)
-        print(query)
+            end = min(end, self.end_date)
+        gaps = cache.missing(start, end)
+        for gap_start, gap_end in gaps:
+            cache.extend(self.query_asf(cache.params, gap_start, gap_end), gap_start, gap_end)
+        if gaps:
+            cache.save()
+        else:
+            print('using cached search results: {}'.format(cache.path))
+        # names acquired after the cached range are always queried fresh
+        names = cache.get(start, end)
+        if self.end_date == False or self.end_date > end:
+            names.extend(self.query_asf(cache.params, end, None if self.end_date == False else self.end_date))
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
-        # save results to file
-        response = requests.get(query).text
-        with open(self.json_file, "w") as fout:
-            fout.write(response)
-
-    def parse_json(self):
-        with open(self.json_file, "r") as f:
-            txt = f.read()
-        json_obj = json.loads(txt)[0]
-        #print('found {} results!'.format(len(j)))
-        for entry in json_obj:
-            name = entry.get('granuleName')
-            gid = name[-4:]
-            gran = granule(name, gid)
-            if gran not in self.all_granules:
-                self.all_granules.append(gran)
+        tmp = '{}.tmp'.format(self.results_file)
+        with open(tmp, 'w') as fout:
+            fout.write(''.join('{}\n'.format(name) for name in names))
+        os.replace(tmp, self.results_file)
+
+    def query_asf(self, params, start=None, end=None):
+        '''streams the search results as csv, yielding only the granule names'''
+        params = dict(params, output='csv')
+        if start is not None:
+            params['start'] = start
+        if end is not None:
+            params['end'] = end
+        response = requests.get(SEARCH_URL, params=params, stream=True)
+        print(response.url)
+        response.raise_for_status()
+        response.encoding = 'utf-8' # otherwise iter_lines yields bytes when the response declares no charset
+        try:
+            for row in csv.DictReader(response.iter_lines(decode_unicode=True)):
+                yield row['Granule Name']
+        finally:
+            response.close()
+
+    def parse_results(self):
+        with open(self.results_file, "r") as f:
+            for line in f:
+                name = line.strip()
+                if not name:
+                    continue
+                gid = name[-4:]
+                self.granules.add(granule(name, gid))
 
     def get_name(self, gid):
         '''attempts to return the granule name for the id'''
-        for gran in self.all_granules:
-            if gran.gid == gid:
-                return gran.name
-        return None
+        gran = self.granules.get_by_gid(gid)
+        if gran is None:
+            return None
+        return gran.name
 
     def get_original_name(self, fil):
-        '''looks at the log file to determine the original file name'''
-        path = '/products/RTC/{}/{}.log'.format(fil,fil)
-        LOG_REGEX = "^.*SAFE directory[ ]*: (S1.*\.SAFE)"
-        for line in open(path, 'r'):
-            if re.match(LOG_REGEX, line): 
-                return re.search(LOG_REGEX, line).group(1)
+        '''looks at the (cached) log file to determine the original file name'''
+        return self.scanner.get_original_name(fil)
 
     def find_local_files(self):
         '''finds all the local files'''
-        local_files = [f for f in os.listdir(self.output_dir) if re.match(S1_REGEX, f) and not f.endswith('.zip')]
-        for fil in local_files:
+        if getattr(self, 'scanner', None) is None:
+            self.scanner = scan.scanner(self.output_dir)
+        # only new or modified product directories have their log files parsed
+        local_files = self.scanner.scan()
+        for fil, name in local_files.items():
             #name = self.get_name(gid)
-            name = self.get_original_name(fil) 
             gid = re.search(S1_REGEX, name).group(1)
             gran = granule(name, gid)
             #print('name: {}, gid: {}'.format(name, gid))
-            if gran not in self.local_granules and gran in self.all_granules:
-                self.local_granules.append(gran)
+            if gran in self.granules and not self.granules.is_local(gran):
                 # now remove from submitted
-                if gran in self.submitted_granules:
-                    self.submitted_granules.remove(gran)
-                    self.save_pkl()
+                if self.granules.mark_local(gran):
+                    self.store.set_state(gran.name, gran.gid, state.LOCAL)
+        self.commit()
 
     
     def submit(self, name):
-        '''adds the granule to the submitted list and saves the pickle file'''
+        '''adds the granule to the submitted list, the change is saved on the next commit()'''
         g = granule(name, name[-4:])
-        self.submitted_granules.append(g)
-        self.save_pkl()
+        self.granules.mark_submitted(g)
+        self.store.set_state(g.name, g.gid, state.SUBMITTED)
 
-    def save_pkl(self):
-        pickle.dump(self.submitted_granules, open(self.submitted_file, 'wb'))
+    def unsubmit(self, name):
+        '''returns a granule whose job failed or expired to unsubmitted, the change is saved on the next commit()'''
+        g = granule(name, name[-4:])
+        self.granules.mark_unsubmitted(g)
+        self.store.set_state(g.name, g.gid, state.FAILED)
+
+    def commit(self):
+        '''saves all pending state changes for this polling cycle in one transaction'''
+        return self.store.commit()
 
-    def load_pkl(self):
-        '''loads the submitted files from the local pkl file'''
-        self.submitted_granules = pickle.load(open(self.submitted_file, "rb" ) )
+    def load_state(self):
+        '''opens the state store (migrating any old submitted.pkl) and loads the submitted granules'''
+        if getattr(self, 'store', None) is None:
+            if not os.path.exists(self.output_dir):
+                os.makedirs(self.output_dir)
+            self.store = state.store(self.state_file)
+            if os.path.exists(self.submitted_file) and self.store.is_empty():
+                n = self.store.migrate_pkl(self.submitted_file)
+                print('migrated {} granules from {}'.format(n, self.submitted_file))
+        for name, gid in self.store.get(state.SUBMITTED):
+            self.granules.mark_submitted(granule(name, gid))
+
+    def changed_since(self, cycle):
+        '''returns a list of (name, gid, state) changed since the given cycle'''
+        return self.store.changed_since(cycle)
 
     def get_unsubmitted(self):
         '''returns a list of the names of all the unsubmitted granules'''
-        return [g for g in self.all_granules if g not in self.submitted_granules and g not in self.local_granules]
-
-    def get_submitted_job_names(self):
-        return ['job_thwaites_{}'.format(j.name[-4:]) for j in self.submitted_granules]
+        return list(self.granules.iter_unsubmitted())
 
     def submit_these(self):
         '''returns a list of granule names, if there are any allowable to be submitted'''
-        submitted_count = len(self.submitted_granules)
+        submitted_count = len(self.granules.submitted)
         if submitted_count >= ALLOWABLE:
             return []
         count = ALLOWABLE - submitted_count
-        grans = self.get_unsubmitted()[0:count]
+        grans = itertools.islice(self.granules.iter_unsubmitted(), count)
         return [g.name for g in grans]
 
     def print_status(self):
-        n_all = len(self.all_granules)
-        n_out = len(self.submitted_granules)
-        n_uns = len(self.get_unsubmitted())
-        n_local = len(self.local_granules)
+        n_all = len(self.granules)
+        n_out = len(self.granules.submitted)
+        n_uns = self.granules.count_unsubmitted()
+        n_local = len(self.granules.local)
         print('::LOCAL::')
         print(' submitted: {}'.format(n_out))
         print(' unsubmitted: {}'.format(n_uns))
@@ -175,15 +369,14 @@ class track:
 
     def is_done(self):
         '''returns True if everything has been retrieved'''
-        if len(self.local_granules) >= len(self.all_granules):
+        if len(self.granules.local) >= len(self.granules):
             return True
         return False
 
     def is_valid_name(self, name):
         '''returns True/False if the granule name is a valid granule to run over'''
         gid = name[-4:] 
-        gran = granule(name, gid)
-        if gran in self.all_granules:
+        if gid in self.granules.by_gid:
             return True
         return False
 
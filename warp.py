@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+'''Projects and crops all files in the corrected directory (in process, replaces project_and_crop.sh)'''
+
+import os
+import re
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from osgeo import gdal
+from tqdm import tqdm
+import config
+import aoi
+import metrics
+
+CORRECTED_PATH='/products/corrected'
+CORRECTED_REGEX=r'^.*\.corrected\.vrt$'
+WARPED_PATH='/products/warped'
+WORKERS=os.cpu_count()
+STAMP='.warp.json' # in the warped folder, the grid the files were warped to
+
+gdal.UseExceptions()
+
+def get_warped_path(inpath, outfolder=WARPED_PATH):
+    # same naming that project_and_crop.sh used, so existing warped files are reused
+    return os.path.join(outfolder, '{}.warped.vrt'.format(os.path.basename(inpath)))
+
+def is_up_to_date(inpath, outpath):
+    return os.path.exists(outpath) and os.path.getmtime(outpath) >= os.path.getmtime(inpath)
+
+def get_grid(srs, bounds, resolution):
+    return {'srs': srs, 'bounds': [float(b) for b in bounds], 'resolution': float(resolution)}
+
+def read_stamp(outfolder):
+    path = os.path.join(outfolder, STAMP)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_stamp(outfolder, grid):
+    path = os.path.join(outfolder, STAMP)
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as f:
+        json.dump(grid, f)
+    os.replace(tmp, path)
+
+def warp_file(inpath, outpath, bounds, srs, resolution):
+    '''convert to the same projection and generate a cropped vrt'''
+    gdal.Warp(outpath, inpath, format='VRT', outputBounds=bounds, xRes=resolution, yRes=resolution,
+              dstSRS=srs, resampleAlg='near', multithread=True)
+    return outpath
+
+def _warp(task):
+    with metrics.measure('warp', os.path.basename(task[0])):
+        return warp_file(*task)
+
+def main(shapefile=None, resolution=None, infolder=CORRECTED_PATH, outfolder=WARPED_PATH, workers=WORKERS, force=False):
+    cfg = config.load()
+    if shapefile is None:
+        shapefile = config.get_shapefile_path(cfg)
+    if resolution is None:
+        resolution = float(cfg.get('RESOLUTION', 30))
+    meta = aoi.get_metadata(shapefile) # the crs and the extent get_bounds.sh read from ogrinfo, cached
+    srs, bounds = meta['crs'], tuple(meta['bounds'])
+    if not os.path.exists(outfolder):
+        os.makedirs(outfolder)
+    # files warped to another crs, extent or resolution are out of date whatever their times
+    grid = get_grid(srs, bounds, resolution)
+    if read_stamp(outfolder) != grid:
+        force = True
+    inpaths = sorted(os.path.join(infolder, f) for f in os.listdir(infolder) if re.match(CORRECTED_REGEX, f))
+    tasks = []
+    for inpath in inpaths:
+        outpath = get_warped_path(inpath, outfolder)
+        if force or not is_up_to_date(inpath, outpath):
+            tasks.append((inpath, outpath, bounds, srs, resolution))
+    print('generating projected and cropped virtual files ({} of {} need warping)...'.format(len(tasks), len(inpaths)))
+    outpaths = []
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outpaths = list(tqdm(pool.map(_warp, tasks), total=len(tasks)))
+    write_stamp(outfolder, grid) # only once every file is on the grid
+    return outpaths
+
+def parser():
+    '''
+    Construct a parser to parse arguments, returns the parser
+    '''
+    parse = argparse.ArgumentParser(description="Project and crop the corrected files onto the shapefile extent")
+    parse.add_argument("--shapefile", required=False, default=None, help="input shapefile (defaults to SHAPEFILE_PATH in configs)")
+    parse.add_argument("--resolution", required=False, default=None, type=float, help="output resolution (defaults to RESOLUTION in configs)")
+    parse.add_argument("--workers", required=False, default=WORKERS, type=int, help="number of worker processes")
+    parse.add_argument("--force", required=False, action='store_true', help="re-warp files that are already up to date")
+    return parse
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    with metrics.measure('warp'):
+        main(shapefile=args.shapefile, resolution=args.resolution, workers=args.workers, force=args.force)